@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Compact archive of pipeline results
+
+Keeping the results dict of every image of a large run costs five full
+size arrays per image. An archive directory stores them compactly instead:
+
+    masks.bin   every image array, encoded one after another
+    index.npz   one column per scalar (path, area, category, parameters)
+                plus the offset, size and encoding of each stored array
+
+Two-valued images (binary, tumor and Otsu masks, and the watershed image,
+which is labels * 127) are bit-packed; images with few runs are
+run-length encoded when that is smaller, anything else is stored raw.
+Opening an archive loads only the index: masks.bin is memory-mapped and
+an array is decoded when it is first asked for, so a whole archive can be
+queried without reading every image into RAM.
+
+Usage:
+    python brain_tumor_archive.py scans/ -o run.archive --workers 8
+    
+    archive = ResultArchive('run.archive')
+    malignant = archive.select(category='Malignant Tumor')
+    mask = archive[malignant[0]]['morphology_tumor']
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from collections.abc import Mapping
+from functools import partial
+
+import numpy as np
+
+from brain_tumor_batch import find_images, map_threaded
+from brain_tumor_components import RegionStats
+from brain_tumor_core import pipeline_params, run_pipeline
+
+# Result keys stored as encoded images; 'regions.mask' is the RegionStats mask
+IMAGE_KEYS = ('original', 'binary', 'watershed', 'morphology_tumor', 'threshold', 'regions.mask')
+
+# Per-region arrays, stored concatenated over all images
+REGION_ARRAYS = ('areas_px', 'areas_cm2', 'bboxes', 'centroids')
+
+# Encodings of a stored image
+ENCODING_NONE = -1  # The result did not have this image
+ENCODING_RAW = 0
+ENCODING_BITS = 1   # np.packbits(image == high); pixels that are not high are low
+ENCODING_RLE = 2    # uint32 run lengths followed by uint8 run values
+
+MASKS_FILE = 'masks.bin'
+INDEX_FILE = 'index.npz'
+
+
+def encode_image(image):
+    """(encoding, low, high, payload bytes) of a 2D uint8 image, whichever encoding is smallest"""
+    image = np.ascontiguousarray(image)
+    if image.dtype != np.uint8 or image.ndim != 2:
+        raise ValueError(f"Only 2D uint8 images can be archived, got {image.dtype} {image.shape}")
+    
+    flat = image.reshape(-1)
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    run_bytes = 5 * (len(starts) + 1)
+    
+    values = np.flatnonzero(np.bincount(flat, minlength=256))
+    bit_bytes = (flat.size + 7) // 8 if len(values) <= 2 else flat.size + 1
+    
+    if run_bytes < min(bit_bytes, flat.size):
+        lengths = np.diff(starts, prepend=0, append=flat.size).astype('<u4')
+        return ENCODING_RLE, 0, 0, lengths.tobytes() + flat[np.insert(starts, 0, 0)].tobytes()
+    if bit_bytes < flat.size:
+        low, high = int(values[0]), int(values[-1])
+        return ENCODING_BITS, low, high, np.packbits(flat == high).tobytes()
+    return ENCODING_RAW, 0, 0, flat.tobytes()
+
+
+def decode_image(encoding, low, high, payload, shape):
+    """Inverse of encode_image; payload is bytes or a uint8 array (e.g. a memory-mapped slice)"""
+    payload = np.frombuffer(payload, dtype=np.uint8)
+    size = shape[0] * shape[1]
+    
+    if encoding == ENCODING_RAW:
+        image = payload.copy()
+    elif encoding == ENCODING_BITS:
+        bits = np.unpackbits(payload, count=size).view(bool)
+        image = np.where(bits, np.uint8(high), np.uint8(low))
+    elif encoding == ENCODING_RLE:
+        runs = len(payload) // 5
+        lengths = payload[:4 * runs].view('<u4')
+        image = np.repeat(payload[4 * runs:], lengths)
+    else:
+        raise ValueError(f"Unknown image encoding: {encoding}")
+    
+    return image.reshape(shape)
+
+
+def _column(values):
+    """(array, is_json) for one index column; values that numpy cannot store are JSON-encoded"""
+    if all(isinstance(v, (bool, int, float, np.bool_, np.number)) for v in values):
+        return np.asarray(values), False
+    if all(isinstance(v, str) for v in values):
+        return np.asarray(values, dtype=str), False
+    return np.asarray([json.dumps(v) for v in values], dtype=str), True
+
+
+class ArchiveWriter:
+    """Appends results to a new archive directory
+    
+    params holds the pipeline parameters shared by every result (e.g.
+    pipeline_params()); add() can override them per result. Each
+    parameter becomes a column of the index. Only the image keys listed in
+    images are stored. The index is written by close().
+    """
+    
+    def __init__(self, path, params=None, images=IMAGE_KEYS):
+        self.path = path
+        self.params = dict(params or {})
+        self.images = tuple(images)
+        os.makedirs(path, exist_ok=True)
+        self._masks = open(os.path.join(path, MASKS_FILE), 'wb')
+        self._offset = 0
+        
+        self._paths, self._areas, self._categories, self._record_params = [], [], [], []
+        self._layout = {key: [] for key in self.images}  # key -> [(encoding, low, high, offset, nbytes, h, w)]
+        self._region_counts = []
+        self._regions = {name: [] for name in REGION_ARRAYS}
+    
+    def add(self, results, path='', params=None):
+        """Store one results dict (or PipelineResult); returns its index"""
+        if hasattr(results, 'as_dict'):
+            results = results.as_dict()
+        regions = results.get('regions')
+        
+        stored = {}  # Encoded content already written for this result -> its layout
+        for key in self.images:
+            image = regions.mask if key == 'regions.mask' and regions is not None else results.get(key)
+            if image is None:
+                self._layout[key].append((ENCODING_NONE, 0, 0, 0, 0, 0, 0))
+                continue
+            
+            # The regions mask usually equals the tumor mask; identical arrays are stored once
+            encoding, low, high, payload = encode_image(image)
+            content = (encoding, low, high, image.shape, payload)
+            if content not in stored:
+                self._masks.write(payload)
+                stored[content] = (encoding, low, high, self._offset, len(payload)) + image.shape
+                self._offset += len(payload)
+            self._layout[key].append(stored[content])
+        
+        if regions is not None:
+            self._region_counts.append(len(regions))
+            for name in REGION_ARRAYS:
+                self._regions[name].append(np.asarray(getattr(regions, name)))
+        else:
+            self._region_counts.append(-1)
+        
+        area = results.get('tumor_area_cm2')
+        self._paths.append(str(path))
+        self._areas.append(np.nan if area is None else float(area))
+        self._categories.append(results.get('category') or '')
+        self._record_params.append({**self.params, **(params or {})})
+        return len(self._paths) - 1
+    
+    def _columns(self):
+        columns = {'path': np.asarray(self._paths, dtype=str),
+                   'tumor_area_cm2': np.asarray(self._areas, dtype=np.float64),
+                   'category': np.asarray(self._categories, dtype=str)}
+        json_columns = []
+        
+        names = []
+        for record in self._record_params:
+            names.extend(name for name in record if name not in names)
+        for name in names:
+            column, is_json = _column([record.get(name) for record in self._record_params])
+            columns[f'param.{name}'] = column
+            if is_json:
+                json_columns.append(f'param.{name}')
+        
+        for key, layouts in self._layout.items():
+            layout = np.asarray(layouts, dtype=np.int64).reshape(-1, 7)
+            for j, field in enumerate(('encoding', 'low', 'high', 'offset', 'nbytes', 'height', 'width')):
+                columns[f'{key}.{field}'] = layout[:, j]
+        
+        counts = np.asarray(self._region_counts, dtype=np.int64)
+        columns['regions.count'] = counts
+        columns['regions.start'] = np.concatenate(([0], np.cumsum(np.maximum(counts, 0))[:-1]))
+        for name in REGION_ARRAYS:
+            parts = self._regions[name]
+            columns[f'regions.{name}'] = np.concatenate(parts) if parts else np.empty(0)
+        
+        columns['_json_columns'] = np.asarray(json_columns, dtype=str)
+        columns['_images'] = np.asarray(self.images, dtype=str)
+        return columns
+    
+    def close(self):
+        """Write the index; the archive can be opened once this returns"""
+        if self._masks.closed:
+            return
+        self._masks.close()
+        
+        # Write to a temp file and rename so readers never see a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **self._columns())
+        os.replace(tmp_path, os.path.join(self.path, INDEX_FILE))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchivedResult(Mapping):
+    """Results dict of one archived image; arrays are decoded on first access"""
+    
+    def __init__(self, archive, index):
+        self._archive = archive
+        self._index = index
+        self._cache = {}
+    
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self._archive._value(self._index, key)
+        return self._cache[key]
+    
+    def __iter__(self):
+        return iter(self._archive.result_keys)
+    
+    def __len__(self):
+        return len(self._archive.result_keys)
+    
+    def __repr__(self):
+        return (f"ArchivedResult({str(self._archive.column('path')[self._index])!r}, "
+                f"tumor_area_cm2={self['tumor_area_cm2']!r}, category={self['category']!r})")
+
+
+class ResultArchive:
+    """Read access to an archive written by ArchiveWriter
+    
+    The index columns are loaded up front (a few bytes per image); image
+    arrays are decoded from the memory-mapped mask file only when asked for.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, INDEX_FILE), allow_pickle=False) as npz:
+            self._columns = {name: npz[name] for name in npz.files}
+        self._json_columns = set(self._columns.pop('_json_columns').tolist())
+        self.images = tuple(self._columns.pop('_images').tolist())
+        
+        masks_path = os.path.join(path, MASKS_FILE)
+        if os.path.getsize(masks_path):
+            self._masks = np.memmap(masks_path, dtype=np.uint8, mode='r')
+        else:
+            self._masks = np.empty(0, dtype=np.uint8)
+        
+        self.result_keys = tuple(key for key in ('original', 'binary', 'watershed',
+                                                  'morphology_tumor', 'threshold') if key in self.images)
+        self.result_keys += ('tumor_area_cm2', 'category', 'regions')
+    
+    def __len__(self):
+        return len(self._columns['path'])
+    
+    def __getitem__(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"Archive index out of range: {index}")
+        return ArchivedResult(self, index % len(self))
+    
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+    
+    @property
+    def columns(self):
+        """Names of the scalar columns (path, tumor_area_cm2, category, param.*)"""
+        return [name for name in self._columns
+                if name in ('path', 'tumor_area_cm2', 'category') or name.startswith('param.')]
+    
+    def column(self, name):
+        """One scalar column for every image (JSON-encoded parameters are decoded to a list)"""
+        column = self._columns[name]
+        if name in self._json_columns:
+            return [json.loads(value) for value in column]
+        return column
+    
+    def select(self, **conditions):
+        """Indices of images whose columns equal the given values, e.g. select(category='Large')
+        
+        Parameters are matched by name, so select(threshold=0.6) checks
+        the param.threshold column.
+        """
+        selected = np.ones(len(self), dtype=bool)
+        for name, value in conditions.items():
+            if name not in self._columns:
+                name = f'param.{name}'
+            column = self.column(name)
+            if isinstance(column, list):
+                selected &= np.array([v == value for v in column], dtype=bool)
+            else:
+                selected &= column == value
+        return np.flatnonzero(selected)
+    
+    def image(self, index, key):
+        """Decode one stored image, or None if the result did not have it"""
+        if key not in self.images:
+            raise KeyError(f"Image not archived: {key!r}")
+        if self._masks is None:
+            raise ValueError("archive is closed")
+        encoding, low, high, offset, nbytes, height, width = (
+            int(self._columns[f'{key}.{field}'][index])
+            for field in ('encoding', 'low', 'high', 'offset', 'nbytes', 'height', 'width'))
+        if encoding == ENCODING_NONE:
+            return None
+        return decode_image(encoding, low, high, self._masks[offset:offset + nbytes], (height, width))
+    
+    def regions(self, index):
+        """RegionStats of one image, or None if the result did not have them"""
+        count = int(self._columns['regions.count'][index])
+        if count < 0:
+            return None
+        start = int(self._columns['regions.start'][index])
+        arrays = {name: self._columns[f'regions.{name}'][start:start + count] for name in REGION_ARRAYS}
+        mask = self.image(index, 'regions.mask') if 'regions.mask' in self.images else None
+        total_px = int(arrays['areas_px'].sum())
+        return RegionStats(total_area_px=total_px, total_area_cm2=float(arrays['areas_cm2'].sum()),
+                           mask=mask, **arrays)
+    
+    def _value(self, index, key):
+        if key == 'tumor_area_cm2':
+            area = float(self._columns['tumor_area_cm2'][index])
+            return None if np.isnan(area) else area
+        if key == 'category':
+            return str(self._columns['category'][index]) or None
+        if key == 'regions':
+            return self.regions(index)
+        if key in self.images:
+            return self.image(index, key)
+        raise KeyError(key)
+    
+    def stored_bytes(self):
+        """Size of the archive on disk"""
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in (MASKS_FILE, INDEX_FILE))
+    
+    def close(self):
+        """Release the memory map (arrays decoded so far stay valid)
+        
+        Scalar columns can still be read; decoding an image raises ValueError.
+        """
+        self._masks = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _run_file(image_path, params):
+    """(path, PipelineResult, None), or (path, None, error message) if the file fails"""
+    try:
+        return image_path, run_pipeline(image_path, **params), None
+    except Exception as e:
+        return image_path, None, f"{type(e).__name__}: {e}"
+
+
+def archive_images(image_paths, archive_path, workers=None, images=IMAGE_KEYS, **params):
+    """Run the pipeline over image files and store every result in a new archive
+    
+    params (threshold, min_area, pixel_w, pixel_h, native, pixel_spacing,
+    watershed_backend) are forwarded to run_pipeline and recorded in the
+    index. A file that fails is skipped instead of stopping the run.
+    Returns (images archived, raw bytes of the stored arrays, errors), where
+    errors lists (path, message) of the skipped files.
+    """
+    archived, raw_bytes, errors = 0, 0, []
+    with ArchiveWriter(archive_path, pipeline_params(**params), images) as writer:
+        for path, result, error in map_threaded(partial(_run_file, params=params), image_paths,
+                                                max_workers=workers):
+            if error is not None:
+                errors.append((path, error))
+                continue
+            writer.add(result, path)
+            archived += 1
+            raw_bytes += sum(getattr(result, key).nbytes for key in images
+                             if key != 'regions.mask' and getattr(result, key) is not None)
+    return archived, raw_bytes, errors
+
+
+def main(argv=None):
+    """Command line entry point for building an archive"""
+    parser = argparse.ArgumentParser(description="Run the pipeline over a directory into a compact archive")
+    parser.add_argument('directory', help="Directory containing MRI images")
+    parser.add_argument('-o', '--output', required=True, help="Archive directory to create")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Images processed in parallel (default: all cores)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Search subdirectories too")
+    parser.add_argument('--no-original', action='store_true',
+                        help="Do not store the grayscale input (the largest array by far)")
+    args = parser.parse_args(argv)
+    
+    image_files = find_images(args.directory, recursive=args.recursive, exclude=[args.output])
+    if not image_files:
+        print("No image files found")
+        return 1
+    
+    images = tuple(key for key in IMAGE_KEYS if not (args.no_original and key == 'original'))
+    count, raw_bytes, errors = archive_images(image_files, args.output, workers=args.workers,
+                                              images=images)
+    for path, error in errors:
+        print(f"   Error processing {path}: {error}")
+    
+    with ResultArchive(args.output) as archive:
+        stored = archive.stored_bytes()
+    print(f"Archived {count} results ({len(errors)} errors) in {args.output}: "
+          f"{stored / 2**20:.2f} MB "
+          f"({raw_bytes / max(stored, 1):.1f}x smaller than the raw arrays)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Parallel batch scanner for brain tumor detection
+
+Usage:
+    python brain_tumor_batch.py scans/ --workers 8 --output results.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
+
+from brain_tumor_cache import DEFAULT_MAX_BYTES, ResultCache
+from brain_tumor_core import DEFAULT_DECODE, iter_gray_images, run_pipeline, thread_workspace
+from brain_tumor_tiled import run_tiled
+
+# Same file types the GUI file dialogs accept
+IMAGE_EXTENSIONS = ['*.png', '*.jpg', '*.jpeg', '*.bmp', '*.tiff']
+
+RESULT_FIELDS = ['index', 'path', 'tumor_area_cm2', 'category', 'error']
+
+# Files written by the tools themselves (montages, result_index.html); never inputs
+OUTPUT_PREFIX = 'result_'
+
+# Scanning only needs the scalars, so visualization-only stages are skipped
+SCAN_OUTPUTS = 'area+category'
+
+# Result cache and pipeline options of the current worker process, set up by _init_worker
+_cache = None
+_options = {}
+
+
+def find_images(directory, extensions=IMAGE_EXTENSIONS, recursive=False, exclude=()):
+    """Find all image files in a directory, sorted for a stable input order
+    
+    Generated files (named OUTPUT_PREFIX...) are skipped, and so is
+    anything at or below a path in exclude (e.g. an output directory
+    inside the scanned one), so re-running a tool never reads its own
+    outputs back in.
+    """
+    image_files = []
+    
+    for ext in extensions:
+        pattern = os.path.join(directory, '**', ext) if recursive else os.path.join(directory, ext)
+        image_files.extend(glob.glob(pattern, recursive=recursive))
+    
+    excluded = [os.path.abspath(path) for path in exclude]
+    
+    def is_input(path):
+        if os.path.basename(path).startswith(OUTPUT_PREFIX):
+            return False
+        path = os.path.abspath(path)
+        return not any(path == root or path.startswith(root + os.sep) for root in excluded)
+    
+    return sorted(set(filter(is_input, image_files)))
+
+
+def _init_worker(cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES, options=None):
+    """Open the result cache and set pipeline options for this worker process"""
+    global _cache, _options
+    _cache = ResultCache(cache_dir, cache_bytes) if cache_dir else None
+    _options = dict(options or {})
+
+
+def analyze_file(image_path):
+    """Default worker: run the pipeline and keep only the scalar results
+    
+    Honours the native/tile_size/decode options given to scan_images.
+    Only scalars leave this function, so stage buffers are reused per thread.
+    """
+    if _options.get('tile_size'):
+        results = run_tiled(image_path, tile_size=_options['tile_size'], outputs=SCAN_OUTPUTS)
+    else:
+        results = run_pipeline(image_path, outputs=SCAN_OUTPUTS, cache=_cache,
+                               native=_options.get('native', False), workspace=thread_workspace(),
+                               decode=_options.get('decode', DEFAULT_DECODE))
+    
+    return _scalars(results)
+
+
+def _scalars(results):
+    return {
+        'tumor_area_cm2': float(results.tumor_area_cm2),
+        'category': results.category
+    }
+
+
+def _run_worker(worker, item):
+    """Call worker on one file, turning any failure into an error record"""
+    index, image_path = item
+    record = {'index': index, 'path': image_path, 'error': None}
+    
+    try:
+        record.update(worker(image_path))
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    
+    return record
+
+
+def _scan_prefetched(image_paths, native=False, decode=DEFAULT_DECODE):
+    """Single-worker scan that decodes the next files on a reader thread
+    
+    Gives the same records as analyze_file, but the next images are
+    loaded while the current one runs through the pipeline.
+    """
+    workspace = thread_workspace()
+    images = iter_gray_images(image_paths, native, decode)
+    for index, (image_path, gray, error) in enumerate(images):
+        record = {'index': index, 'path': image_path, 'error': None}
+        try:
+            if error is not None:
+                raise error
+            record.update(_scalars(run_pipeline(gray, outputs=SCAN_OUTPUTS, native=native,
+                                                workspace=workspace)))
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+        yield record
+
+
+def scan_images(image_paths, workers=None, chunksize=8, worker=analyze_file, threads=False,
+                cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES, native=False, tile_size=None,
+                decode=DEFAULT_DECODE):
+    """Process files across a process pool, yielding records in input order
+    
+    worker must be a picklable (module-level) function taking a path and
+    returning a dict. A failing file yields a record with 'error' set
+    instead of stopping the run. workers=1 runs in the calling process.
+    With threads=True a thread pool is used instead, which avoids pickling
+    and scales because OpenCV releases the GIL; worker must then be
+    thread-safe (the default analyze_file is). cache_dir enables the
+    on-disk result cache for analyze_file; native and tile_size select
+    native-resolution (optionally tiled) processing, and decode how files
+    are read (see load_gray_image). With workers=1 and the default worker
+    (no cache or tiles), the next files are decoded on a reader thread.
+    """
+    options = {'native': native, 'tile_size': tile_size, 'decode': decode}
+    items = enumerate(image_paths)
+    task = partial(_run_worker, worker)
+    
+    if workers == 1 or threads:
+        _init_worker(cache_dir, cache_bytes, options)
+    
+    if workers == 1:
+        if worker is analyze_file and not (cache_dir or tile_size):
+            yield from _scan_prefetched(image_paths, native, decode)
+            return
+        for item in items:
+            yield task(item)
+        return
+    
+    if threads:
+        yield from map_threaded(task, items, max_workers=workers)
+        return
+    
+    with Pool(processes=workers, initializer=_init_worker,
+              initargs=(cache_dir, cache_bytes, options)) as pool:
+        # imap keeps input order while streaming results as chunks finish
+        for record in pool.imap(task, items, chunksize=chunksize):
+            yield record
+
+
+def map_threaded(func, items, max_workers=None):
+    """Ordered thread-pool map that keeps only a few tasks per thread in flight"""
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    window = max_workers * 4
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_threaded(images, max_workers=None, **params):
+    """Run the stateless pipeline over many images on a thread pool
+    
+    Yields PipelineResult objects in input order. params are forwarded to
+    run_pipeline (threshold, min_area, pixel_w, pixel_h).
+    """
+    yield from map_threaded(partial(run_pipeline, **params), images, max_workers=max_workers)
+
+
+class ResultWriter:
+    """Streams result records to a CSV or JSONL file, flushing each row
+    
+    With append=True rows are added to an existing file (the CSV header is
+    only written when the file is new or empty).
+    """
+    
+    def __init__(self, output_path, fields=RESULT_FIELDS, append=False):
+        self.output_path = output_path
+        self.fields = fields
+        self.jsonl = output_path.lower().endswith(('.jsonl', '.json'))
+        self.file = open(output_path, 'a' if append else 'w', newline='', encoding='utf-8')
+        
+        if not self.jsonl:
+            self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+    
+    def write(self, record):
+        if self.jsonl:
+            self.file.write(json.dumps({k: record.get(k) for k in self.fields}) + '\n')
+        else:
+            self.writer.writerow(record)
+        self.file.flush()
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    """Command line entry point for batch scanning"""
+    parser = argparse.ArgumentParser(description="Batch brain tumor detection over a directory")
+    parser.add_argument('directory', help="Directory containing MRI images")
+    parser.add_argument('-o', '--output', default='results.csv',
+                        help="Output file (.csv or .jsonl)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all cores)")
+    parser.add_argument('-c', '--chunksize', type=int, default=8,
+                        help="Files dispatched to a worker at a time")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="Search subdirectories too")
+    parser.add_argument('-t', '--threads', action='store_true',
+                        help="Use a thread pool instead of processes")
+    parser.add_argument('--native', action='store_true',
+                        help="Process at native resolution (pixel size scaled to match)")
+    parser.add_argument('--tile-size', type=int,
+                        help="Process at native resolution in tiles of this size (bounded memory)")
+    parser.add_argument('--fast-decode', action='store_true',
+                        help="Decode straight to grayscale, at reduced scale for large JPEGs")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="Reuse results from an on-disk cache in DIR")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // 2**20,
+                        help="Cache size limit in MB (least recently used entries are evicted)")
+    args = parser.parse_args(argv)
+    
+    image_files = find_images(args.directory, recursive=args.recursive, exclude=[args.output])
+    if not image_files:
+        print("No image files found")
+        return 1
+    
+    print(f"Found {len(image_files)} image files, using {args.workers} workers")
+    
+    errors = 0
+    with ResultWriter(args.output) as writer:
+        for record in scan_images(image_files, workers=args.workers,
+                                  chunksize=args.chunksize, threads=args.threads,
+                                  cache_dir=args.cache, cache_bytes=args.cache_size * 2**20,
+                                  native=args.native, tile_size=args.tile_size,
+                                  decode='fast' if args.fast_decode else 'exact'):
+            writer.write(record)
+            if record['error']:
+                errors += 1
+                print(f"   Error processing {record['path']}: {record['error']}")
+    
+    print(f"Processed {len(image_files)} files ({errors} errors), results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+Per-stage benchmark for BrainTumorDetector
+
+Times every pipeline stage on the bundled mri_sample_* images and on
+synthetic phantoms, reports throughput, p50/p99 latency and the peak RSS
+of each case (measured in a fresh process), and
+can save a JSON baseline or fail when a run is slower than a saved one.
+GUI view-switch latency is measured as well, on an off-screen canvas,
+and so are the bytes each stage allocates with and without a Workspace,
+the time a fresh interpreter needs to import the detection modules, the
+speed and agreement of every watershed backend, the cost of
+morphological reconstruction against an iterate-until-stable reference,
+and the time saved by the fast (grayscale, reduced-scale) image decode
+and by prefetching files on a reader thread.
+
+Usage:
+    python brain_tumor_benchmark.py --save baseline.json
+    python brain_tumor_benchmark.py --compare baseline.json --tolerance 0.25
+    python brain_tumor_benchmark.py --imports-only --import-budget-ms 400
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from brain_tumor_core import (
+    MORPH_KERNEL, MORPHOLOGY_METHODS, WATERSHED_BACKENDS, BrainTumorDetector, Workspace,
+    _watershed_labels, binarize, iter_gray_images, load_gray_image, morphology_tumor_mask,
+    run_pipeline
+)
+from brain_tumor_components import reconstruct_iterative
+from brain_tumor_instrumentation import Instrumentation
+
+STAGES = [
+    'load_image',
+    'create_binary_image',
+    'watershed_segmentation',
+    'morphological_processing',
+    'threshold_segmentation',
+    'calculate_tumor_area',
+]
+
+PHANTOM_SIZES = [200, 512, 1024, 2048, 4096]
+
+# Import targets timed in a fresh interpreter; 'cv2+numpy' is the floor
+IMPORT_TARGETS = {
+    'cv2+numpy': 'import cv2, numpy',
+    'brain_tumor_core': 'import brain_tumor_core',
+    'brain_tumor_detection': 'import brain_tumor_detection',
+}
+
+# Modules the headless core must not pull in at import time
+HEAVY_MODULES = ('matplotlib', 'skimage', 'scipy', 'tkinter', 'PIL')
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed,
+                  'heavy': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+# Runs one case in a fresh interpreter, whose peak RSS is then that case's alone
+_RSS_PROBE = """
+import json
+import cv2
+from brain_tumor_benchmark import BrainTumorDetector, peak_rss_mb, time_stages
+gray = cv2.imread({image_path!r}, cv2.IMREAD_GRAYSCALE) if {full_resolution!r} else None
+time_stages(BrainTumorDetector(), {image_path!r}, gray)
+print(json.dumps(peak_rss_mb()))
+"""
+
+
+def make_phantom(size, seed=0):
+    """Synthetic MRI-like slice: noisy head ellipse with a bright lesion"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((size, size), dtype=np.uint8)
+    center = (size // 2, size // 2)
+    
+    cv2.ellipse(image, center, (int(size * 0.4), int(size * 0.45)), 0, 0, 360, 110, -1)
+    cv2.circle(image, (int(size * 0.6), int(size * 0.4)), max(size // 12, 3), 235, -1)
+    
+    noise = rng.normal(0, 12, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far (it never goes down)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def case_peak_rss_mb(image_path, full_resolution=False):
+    """Peak RSS of one pipeline run on image_path, in a fresh interpreter
+    
+    ru_maxrss only ever grows, so measured in the benchmark process it
+    would show the largest case so far. full_resolution processes the
+    file's grayscale pixels unresized, like bench_case with gray.
+    """
+    code = _RSS_PROBE.format(image_path=os.path.abspath(image_path), full_resolution=full_resolution)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def time_stages(detector, image_path, gray=None):
+    """Run the pipeline once, timing each stage
+    
+    If gray is given it replaces the loaded image, so stages after
+    load_image run at the phantom's full resolution.
+    """
+    timings = {}
+    
+    start = time.perf_counter()
+    detector.load_image(image_path)
+    timings['load_image'] = time.perf_counter() - start
+    
+    if gray is not None:
+        detector.gray_image = gray
+    
+    for stage in STAGES[1:]:
+        start = time.perf_counter()
+        getattr(detector, stage)()
+        timings[stage] = time.perf_counter() - start
+    
+    return timings
+
+
+def summarize(samples):
+    """Latency percentiles (ms) and throughput for one list of timings"""
+    samples = np.asarray(samples)
+    return {
+        'p50_ms': float(np.percentile(samples, 50) * 1000),
+        'p99_ms': float(np.percentile(samples, 99) * 1000),
+        'mean_ms': float(samples.mean() * 1000),
+        'throughput_per_s': float(1.0 / samples.mean()) if samples.mean() > 0 else float('inf')
+    }
+
+
+def bench_case(image_path, gray=None, repeat=20, warmup=2):
+    """Benchmark all stages on one input
+    
+    If gray is given it must be the file's grayscale pixels (as for the
+    phantoms), so the RSS probe can read it back unresized.
+    """
+    detector = BrainTumorDetector()
+    samples = {stage: [] for stage in STAGES}
+    totals = []
+    
+    for i in range(warmup + repeat):
+        timings = time_stages(detector, image_path, gray)
+        if i < warmup:
+            continue
+        for stage, seconds in timings.items():
+            samples[stage].append(seconds)
+        totals.append(sum(timings.values()))
+    
+    result = {stage: summarize(samples[stage]) for stage in STAGES}
+    result['total'] = summarize(totals)
+    result['peak_rss_mb'] = case_peak_rss_mb(image_path, full_resolution=gray is not None)
+    return result
+
+
+def bench_redraw(image_path, repeat=20):
+    """Latency of the GUI view switch, drawn on an off-screen Agg canvas
+    
+    'new_result' is showing a new result (which pre-renders every view),
+    'switch' a toggle between views of the current result.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from brain_tumor_views import VIEWS, ViewRenderer
+    
+    results = BrainTumorDetector().process_complete_pipeline(image_path)
+    fig = Figure(figsize=(8, 4), dpi=100)
+    renderer = ViewRenderer(fig, fig.subplots(1, 2), FigureCanvasAgg(fig))
+    renderer.set_results(results)
+    
+    new_result, switch = [], []
+    for i in range(repeat):
+        start = time.perf_counter()
+        renderer.set_results(results)
+        new_result.append(time.perf_counter() - start)
+        for view in range(len(VIEWS)):
+            switch.append(renderer.show(view) / 1000)
+    
+    return {'new_result': summarize(new_result), 'switch': summarize(switch)}
+
+
+def bench_allocations(image_path, warmup=2):
+    """Bytes allocated per stage in steady state, without and with a Workspace"""
+    was_tracing = tracemalloc.is_tracing()
+    report = {}
+    
+    try:
+        for name, workspace in (('default', None), ('workspace', Workspace())):
+            instrumentation = Instrumentation(track_allocations=True)
+            detector = BrainTumorDetector(instrumentation=instrumentation, workspace=workspace)
+            for i in range(warmup + 1):
+                instrumentation.reset()
+                time_stages(detector, image_path)
+            report[name] = {stage: instrumentation.timings[stage]['bytes_allocated']
+                            for stage in STAGES}
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    
+    return report
+
+
+def bench_watershed(image_files, repeat=20, phantom_size=512):
+    """Time every watershed backend and compare its labels with skimage's
+    
+    Cases are the binary images of image_files, which is what the pipeline
+    feeds the watershed, and a grayscale phantom, whose gradient leaves
+    many pixels unlabeled and so exercises the actual flooding. Agreement
+    is the fraction of pixels labeled like the skimage backend.
+    """
+    cases = {os.path.basename(path): binarize(load_gray_image(path)) for path in image_files}
+    cases[f'phantom_gray_{phantom_size}'] = make_phantom(phantom_size)
+    
+    report = {}
+    for case, image in cases.items():
+        reference = _watershed_labels(image, backend='skimage')
+        report[case] = {}
+        for backend in WATERSHED_BACKENDS:
+            samples = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                labels = _watershed_labels(image, backend=backend)
+                samples.append(time.perf_counter() - start)
+            report[case][backend] = {**summarize(samples),
+                                     'agreement': float(np.mean(labels == reference))}
+    return report
+
+
+def iterative_tumor_mask(binary_image):
+    """morphology_tumor_mask's reconstruction done with the iterative reference"""
+    opened = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, MORPH_KERNEL)
+    reconstructed = reconstruct_iterative(opened, binary_image)
+    dilated = cv2.dilate(reconstructed, MORPH_KERNEL)
+    return reconstruct_iterative(dilated, reconstructed, method='erosion')
+
+
+def bench_morphology(image_files, repeat=20, sizes=(1024,)):
+    """Time each morphology method and the iterative reconstruction reference
+    
+    'matches_reference' tells whether the reconstruct method gave exactly
+    the reference mask; 'approximate' is the older close/open chain.
+    """
+    cases = {os.path.basename(path): binarize(load_gray_image(path)) for path in image_files}
+    for size in sizes:
+        cases[f'phantom_{size}'] = binarize(make_phantom(size))
+    
+    methods = {method: (lambda binary, method=method: morphology_tumor_mask(binary, method=method))
+               for method in MORPHOLOGY_METHODS}
+    methods['iterative'] = iterative_tumor_mask
+    
+    report = {}
+    for case, binary in cases.items():
+        report[case] = {}
+        for name, function in methods.items():
+            samples = []
+            # The iterative reference is slow; a few runs are enough
+            for i in range(repeat if name != 'iterative' else min(repeat, 3)):
+                start = time.perf_counter()
+                mask = function(binary)
+                samples.append(time.perf_counter() - start)
+            report[case][name] = summarize(samples)
+            if name == 'iterative':
+                report[case]['matches_reference'] = bool(np.array_equal(
+                    morphology_tumor_mask(binary), mask))
+    return report
+
+
+def bench_decode(image_files, repeat=20, sizes=(1024, 4096)):
+    """Time load_gray_image with the exact and the fast decode
+    
+    Cases are image_files plus color JPEG phantoms of the given sizes,
+    where the fast path can decode at reduced scale. 'max_abs_diff' is the
+    largest gray level difference between the two decoded images.
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = {os.path.basename(path): path for path in image_files}
+        for size in sizes:
+            path = os.path.join(tmp_dir, f'phantom_{size}.jpg')
+            cv2.imwrite(path, cv2.cvtColor(make_phantom(size), cv2.COLOR_GRAY2BGR),
+                        [cv2.IMWRITE_JPEG_QUALITY, 95])
+            cases[f'phantom_jpeg_{size}'] = path
+        
+        for case, path in cases.items():
+            report[case] = {}
+            for decode in ('exact', 'fast'):
+                samples = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    gray = load_gray_image(path, decode=decode)
+                    samples.append(time.perf_counter() - start)
+                report[case][decode] = summarize(samples)
+                report[case][f'{decode}_image'] = gray
+            
+            exact, fast = report[case].pop('exact_image'), report[case].pop('fast_image')
+            report[case]['max_abs_diff'] = int(np.abs(exact.astype(np.int16) - fast).max())
+            report[case]['speedup'] = report[case]['exact']['p50_ms'] / report[case]['fast']['p50_ms']
+    return report
+
+
+def bench_prefetch(image_files, repeat=5):
+    """Per-image time of sequential load + pipeline, without and with a prefetching reader
+    
+    Scanning needs only the area, like brain_tumor_batch; the file list
+    is image_files repeated repeat times.
+    """
+    paths = list(image_files) * repeat
+    
+    start = time.perf_counter()
+    for path in paths:
+        run_pipeline(load_gray_image(path), outputs="area+category")
+    sequential = (time.perf_counter() - start) / len(paths)
+    
+    start = time.perf_counter()
+    for path, gray, error in iter_gray_images(paths):
+        run_pipeline(gray, outputs="area+category")
+    prefetched = (time.perf_counter() - start) / len(paths)
+    
+    return {'sequential_ms': sequential * 1000, 'prefetched_ms': prefetched * 1000,
+            'images': len(paths)}
+
+
+def time_import(statement, cwd=None):
+    """(seconds, heavy modules loaded) for one import in a fresh interpreter"""
+    code = _IMPORT_PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True, cwd=cwd or os.path.dirname(os.path.abspath(__file__)))
+    probe = json.loads(output.stdout.strip().splitlines()[-1])
+    return probe['seconds'], probe['heavy']
+
+
+def bench_imports(repeat=5, targets=IMPORT_TARGETS):
+    """Cold import time of each target, plus the heavy modules it loaded"""
+    report = {}
+    for name, statement in targets.items():
+        samples = []
+        for i in range(repeat):
+            seconds, heavy = time_import(statement)
+            samples.append(seconds)
+        report[name] = {**summarize(samples), 'min_ms': min(samples) * 1000,
+                        'heavy_modules': heavy}
+    return report
+
+
+def check_import_budget(imports, budget_ms, module='brain_tumor_core'):
+    """Problems with the headless core import: over budget_ms or loading heavy modules"""
+    problems = []
+    timing = imports[module]
+    if timing['heavy_modules']:
+        problems.append(f"{module} imports {', '.join(timing['heavy_modules'])}")
+    if budget_ms is not None and timing['p50_ms'] > budget_ms:
+        problems.append(f"{module} import takes {timing['p50_ms']:.1f} ms "
+                        f"(budget {budget_ms:.1f} ms)")
+    return problems
+
+
+def run_benchmarks(image_files=None, sizes=PHANTOM_SIZES, repeat=20, warmup=2):
+    """Benchmark the sample images and phantoms, returning a JSON-able report"""
+    import skimage
+    
+    if image_files is None:
+        image_files = sorted(glob.glob('mri_sample_*'))
+    
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'skimage': skimage.__version__,
+            'repeat': repeat
+        },
+        'cases': {}
+    }
+    
+    for image_file in image_files:
+        report['cases'][os.path.basename(image_file)] = bench_case(image_file, repeat=repeat, warmup=warmup)
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            phantom = make_phantom(size)
+            phantom_path = os.path.join(tmp_dir, f'phantom_{size}.png')
+            cv2.imwrite(phantom_path, phantom)
+            report['cases'][f'phantom_{size}'] = bench_case(phantom_path, gray=phantom,
+                                                            repeat=repeat, warmup=warmup)
+    
+    if image_files:
+        report['redraw'] = bench_redraw(image_files[0], repeat=repeat)
+        report['allocations'] = bench_allocations(image_files[0], warmup=warmup)
+        report['watershed'] = bench_watershed(image_files, repeat=repeat)
+        report['morphology'] = bench_morphology(image_files, repeat=repeat)
+        report['decode'] = bench_decode(image_files, repeat=repeat)
+        report['prefetch'] = bench_prefetch(image_files)
+    
+    report['imports'] = bench_imports()
+    report['process_peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def compare(report, baseline, tolerance=0.25, metric='p50_ms', min_delta_ms=0.5):
+    """Stages that got slower than baseline by more than tolerance (a fraction)
+    
+    Slowdowns smaller than min_delta_ms are ignored, since sub-millisecond
+    stages are dominated by timer noise.
+    """
+    regressions = []
+    
+    for case, stages in baseline['cases'].items():
+        if case not in report['cases']:
+            continue
+        for stage in STAGES + ['total']:
+            if stage not in stages:
+                continue
+            before = stages[stage][metric]
+            after = report['cases'][case][stage][metric]
+            if after > before * (1 + tolerance) and after - before > min_delta_ms:
+                regressions.append((case, stage, before, after))
+    
+    for kind, timing in baseline.get('redraw', {}).items():
+        if kind not in report.get('redraw', {}):
+            continue
+        before = timing[metric]
+        after = report['redraw'][kind][metric]
+        if after > before * (1 + tolerance) and after - before > min_delta_ms:
+            regressions.append(('gui_redraw', kind, before, after))
+    
+    for module, timing in baseline.get('imports', {}).items():
+        if module not in report.get('imports', {}):
+            continue
+        before = timing[metric]
+        after = report['imports'][module][metric]
+        if after > before * (1 + tolerance) and after - before > min_delta_ms:
+            regressions.append(('import', module, before, after))
+    
+    return regressions
+
+
+def print_imports(imports):
+    print("\nCold import")
+    print(f"   {'module':<26}{'p50 ms':>10}{'min ms':>10}  heavy modules")
+    for module, s in imports.items():
+        heavy = ', '.join(s['heavy_modules']) or '-'
+        print(f"   {module:<26}{s['p50_ms']:>10.1f}{s['min_ms']:>10.1f}  {heavy}")
+
+
+def print_report(report):
+    """Human-readable table of p50/p99 latency per stage"""
+    for case, stages in report['cases'].items():
+        print(f"\n{case}  (peak RSS {stages['peak_rss_mb']:.1f} MB in a fresh process)")
+        print(f"   {'stage':<26}{'p50 ms':>10}{'p99 ms':>10}{'per s':>10}")
+        for stage in STAGES + ['total']:
+            s = stages[stage]
+            print(f"   {stage:<26}{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['throughput_per_s']:>10.1f}")
+    
+    if 'allocations' in report:
+        print("\nBytes allocated per image")
+        print(f"   {'stage':<26}{'default':>10}{'workspace':>10}")
+        for stage in STAGES:
+            print(f"   {stage:<26}{report['allocations']['default'][stage]:>10}"
+                  f"{report['allocations']['workspace'][stage]:>10}")
+    
+    if 'redraw' in report:
+        print("\nGUI view redraw")
+        for kind, s in report['redraw'].items():
+            print(f"   {kind:<26}{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['throughput_per_s']:>10.1f}")
+    
+    if 'watershed' in report:
+        print("\nWatershed backends")
+        print(f"   {'case':<26}{'backend':<10}{'p50 ms':>10}{'agreement':>11}")
+        for case, backends in report['watershed'].items():
+            for backend, s in backends.items():
+                print(f"   {case:<26}{backend:<10}{s['p50_ms']:>10.3f}{s['agreement']:>11.4f}")
+    
+    if 'morphology' in report:
+        print("\nMorphology (p50 ms)")
+        names = list(MORPHOLOGY_METHODS) + ['iterative']
+        print(f"   {'case':<26}" + ''.join(f"{name:>13}" for name in names) + "  exact")
+        for case, methods in report['morphology'].items():
+            print(f"   {case:<26}" + ''.join(f"{methods[name]['p50_ms']:>13.3f}" for name in names)
+                  + f"  {'yes' if methods['matches_reference'] else 'NO'}")
+    
+    if 'decode' in report:
+        print("\nImage decode (p50 ms)")
+        print(f"   {'case':<26}{'exact':>10}{'fast':>10}{'speedup':>10}{'max diff':>10}")
+        for case, s in report['decode'].items():
+            print(f"   {case:<26}{s['exact']['p50_ms']:>10.3f}{s['fast']['p50_ms']:>10.3f}"
+                  f"{s['speedup']:>9.1f}x{s['max_abs_diff']:>10}")
+    
+    if 'prefetch' in report:
+        s = report['prefetch']
+        print(f"\nLoad + pipeline per image: {s['sequential_ms']:.3f} ms sequential, "
+              f"{s['prefetched_ms']:.3f} ms with prefetching ({s['images']} images)")
+    
+    if 'imports' in report:
+        print_imports(report['imports'])
+
+
+def main(argv=None):
+    """Command line entry point for the benchmark"""
+    parser = argparse.ArgumentParser(description="Per-stage BrainTumorDetector benchmark")
+    parser.add_argument('--repeat', type=int, default=20, help="Timed runs per case")
+    parser.add_argument('--warmup', type=int, default=2, help="Untimed runs per case")
+    parser.add_argument('--sizes', type=int, nargs='*', default=PHANTOM_SIZES,
+                        help="Phantom sizes in pixels (square)")
+    parser.add_argument('--save', metavar='JSON', help="Write the report as a baseline")
+    parser.add_argument('--compare', metavar='JSON', help="Fail if slower than this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Allowed slowdown as a fraction (0.25 = 25%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help="Ignore slowdowns smaller than this many ms")
+    parser.add_argument('--import-budget-ms', type=float,
+                        help="Fail if importing brain_tumor_core takes longer than this")
+    parser.add_argument('--imports-only', action='store_true',
+                        help="Only time the module imports")
+    args = parser.parse_args(argv)
+    
+    if args.imports_only:
+        imports = bench_imports()
+        print_imports(imports)
+        problems = check_import_budget(imports, args.import_budget_ms)
+        for problem in problems:
+            print(f"IMPORT BUDGET: {problem}")
+        return 1 if problems else 0
+    
+    report = run_benchmarks(sizes=args.sizes, repeat=args.repeat, warmup=args.warmup)
+    print_report(report)
+    print(f"\nPeak RSS of the whole benchmark process: {report['process_peak_rss_mb']:.1f} MB")
+    
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save}")
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, min_delta_ms=args.min_delta_ms)
+        if regressions:
+            print(f"\nREGRESSIONS (> {args.tolerance:.0%} slower than {args.compare}):")
+            for case, stage, before, after in regressions:
+                print(f"   {case} / {stage}: {before:.3f} ms -> {after:.3f} ms")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    
+    problems = check_import_budget(report['imports'], args.import_budget_ms)
+    for problem in problems:
+        print(f"IMPORT BUDGET: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Persistent content-addressed cache for pipeline results
+
+Entries are keyed on a hash of the image bytes plus every parameter that
+affects the output, stored as .npz files and evicted least-recently-used
+once the cache grows past its size limit.
+"""
+
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from brain_tumor_components import RegionStats
+
+# Bump when a stage changes in a way that alters results for the same parameters
+# (2: tumor mask by true morphological reconstruction)
+CACHE_VERSION = 2
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+REGION_FIELDS = RegionStats.__slots__
+
+
+def default_cache_dir():
+    """Per-user cache directory (honours XDG_CACHE_HOME)"""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'brain_tumor_detection')
+
+
+def cache_key(image_bytes, params, outputs):
+    """Content hash of the image plus the parameters and outputs requested"""
+    digest = hashlib.sha256()
+    digest.update(image_bytes)
+    digest.update(json.dumps({'version': CACHE_VERSION, 'params': params,
+                              'outputs': list(outputs)}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _pack(results):
+    """Flatten a results dict into arrays for np.savez"""
+    arrays = {}
+    for key, value in results.items():
+        if value is None:
+            continue
+        if key == 'regions':
+            for field in REGION_FIELDS:
+                arrays[f'regions.{field}'] = np.asarray(getattr(value, field))
+        else:
+            arrays[key] = np.asarray(value)
+    arrays['_keys'] = np.array(list(results))
+    return arrays
+
+
+def _unpack(npz):
+    """Rebuild a results dict from a loaded .npz entry"""
+    results = {}
+    for key in npz['_keys']:
+        key = str(key)
+        if key == 'regions':
+            if 'regions.mask' in npz:
+                fields = {f: npz[f'regions.{f}'] for f in REGION_FIELDS}
+                fields['total_area_px'] = int(fields['total_area_px'])
+                fields['total_area_cm2'] = float(fields['total_area_cm2'])
+                results[key] = RegionStats(**fields)
+            else:
+                results[key] = None
+        elif key not in npz:
+            results[key] = None
+        elif npz[key].ndim == 0:
+            results[key] = npz[key].item()
+        else:
+            results[key] = npz[key]
+    return results
+
+
+class ResultCache:
+    """On-disk LRU cache of pipeline results shared across runs and processes"""
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # The index records size and last access of each entry for eviction
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.cache_dir, 'index.sqlite'),
+                                   timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS entries '
+                             '(key TEXT PRIMARY KEY, size INTEGER, last_access REAL)')
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npz')
+
+    def get(self, key):
+        """Cached results for key, or None"""
+        try:
+            with np.load(self._path(key), allow_pickle=False) as npz:
+                results = _unpack(npz)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock, self._db:
+            self._db.execute('UPDATE entries SET last_access = ? WHERE key = ?',
+                             (time.time(), key))
+            self.hits += 1
+        return results
+
+    def put(self, key, results):
+        """Store results under key and evict old entries if over the limit"""
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **_pack(results))
+        data = buffer.getvalue()
+
+        # Write to a temp file and rename so readers never see a partial entry
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                             (key, len(data), time.time()))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        with self._lock, self._db:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            rows = self._db.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total -= size
+
+    def size_bytes(self):
+        """Total size of cached entries"""
+        with self._lock:
+            return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock, self._db:
+            for (key,) in self._db.execute('SELECT key FROM entries').fetchall():
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._db.execute('DELETE FROM entries')
+
+    def close(self):
+        self._db.close()
@@ -1,11 +1,29 @@
+import os
+import queue
+import sqlite3
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
-from brain_tumor_detection import BrainTumorDetector
+from brain_tumor_core import DEFAULT_TUNING, BrainTumorDetector
+from brain_tumor_cache import ResultCache
+from brain_tumor_instrumentation import Instrumentation, format_summary
+from brain_tumor_batch import find_images
+from brain_tumor_worker import PipelineWorker, make_thumbnail
+from brain_tumor_views import ViewRenderer
+
+# How often the Tk loop checks the worker for new events (ms)
+POLL_INTERVAL_MS = 50
+
+# Slider movements within this time (ms) are merged into one re-run
+TUNE_DELAY_MS = 60
+
+# Slider ranges: (parameter, label, low, high)
+TUNING_SLIDERS = (
+    ('threshold', 'Threshold', 0.05, 0.95),
+    ('kernel_size', 'Kernel', 3, 31),
+    ('min_area', 'Min area', 0, 1000),
+)
 
 class CompactBrainTumorGUI:
     def __init__(self, root):
@@ -19,11 +37,28 @@ class CompactBrainTumorGUI:
         # Make window resizable
         self.root.resizable(True, True)
         
-        self.detector = BrainTumorDetector()
+        # Reopening a study is served from the on-disk result cache
+        try:
+            cache = ResultCache()
+        except (OSError, sqlite3.Error):
+            cache = None
+        self.detector = BrainTumorDetector(cache=cache, instrumentation=Instrumentation())
         self.results = None
         self.current_view = 0  # Track which image set we're showing
         
+        # The pipeline runs on a worker thread; the Tk loop polls its events
+        self.worker = PipelineWorker(self.detector)
+        self.current_job = None
+        self.current_path = None  # Image the sliders re-run
+        self.current_item = None  # Its folder list item, if any
+        self.tuning = dict(DEFAULT_TUNING)
+        self._tune_after = None
+        self.folder_results = {}  # Tree item id -> (path, results dict)
+        self.thumbnails = {}  # Tree item id -> PhotoImage (Tk needs the reference kept)
+        
         self.setup_gui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(POLL_INTERVAL_MS, self.poll_worker)
     
     def setup_gui(self):
         # Configure root grid weights
@@ -48,7 +83,24 @@ class CompactBrainTumorGUI:
             command=self.load_image,
             width=15
         )
-        self.load_btn.pack(side=tk.LEFT, padx=(0, 10))
+        self.load_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.folder_btn = ttk.Button(
+            control_frame, 
+            text="Load Folder", 
+            command=self.load_folder,
+            width=12
+        )
+        self.folder_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        self.cancel_btn = ttk.Button(
+            control_frame, 
+            text="Cancel", 
+            command=self.cancel_processing,
+            width=8,
+            state=tk.DISABLED
+        )
+        self.cancel_btn.pack(side=tk.LEFT, padx=(0, 10))
         
         # View selection buttons
         ttk.Label(control_frame, text="View:").pack(side=tk.LEFT, padx=(10, 5))
@@ -69,6 +121,10 @@ class CompactBrainTumorGUI:
         )
         self.view_btn2.pack(side=tk.LEFT, padx=2)
         
+        # Progress of the running job
+        self.progress = ttk.Progressbar(control_frame, mode='determinate', maximum=1.0, length=150)
+        self.progress.pack(side=tk.RIGHT, padx=(10, 0))
+        
         # Image display frame
         image_frame = ttk.LabelFrame(main_container, text="Image Analysis", padding="5")
         image_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(0, 5))
@@ -81,14 +137,15 @@ class CompactBrainTumorGUI:
         
         # Create subplots
         self.axes = self.fig.subplots(1, 2)
-        for ax in self.axes:
-            ax.axis('off')
         
         # Canvas for matplotlib
         self.canvas = FigureCanvasTkAgg(self.fig, image_frame)
         canvas_widget = self.canvas.get_tk_widget()
         canvas_widget.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
+        # Persistent image artists, laid out once and switched by blitting
+        self.view_renderer = ViewRenderer(self.fig, self.axes, self.canvas)
+        
         # Results panel
         results_frame = ttk.LabelFrame(main_container, text="Analysis Results", padding="5")
         results_frame.grid(row=1, column=1, sticky=(tk.N, tk.S, tk.E, tk.W))
@@ -120,11 +177,53 @@ class CompactBrainTumorGUI:
         text_scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
         self.results_text.configure(yscrollcommand=text_scrollbar.set)
         
+        # Folder results, filled in as each image finishes
+        self.folder_list = ttk.Treeview(
+            results_frame,
+            columns=('area', 'category'),
+            height=5,
+            selectmode='browse'
+        )
+        self.folder_list.heading('#0', text='Image')
+        self.folder_list.heading('area', text='cm²')
+        self.folder_list.heading('category', text='Category')
+        self.folder_list.column('#0', width=110)
+        self.folder_list.column('area', width=50, anchor=tk.E)
+        self.folder_list.column('category', width=80)
+        self.folder_list.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        self.folder_list.bind('<<TreeviewSelect>>', self.on_folder_select)
+        
+        # Tall enough rows for the thumbnails
+        ttk.Style(self.root).configure('Treeview', rowheight=52)
+        
+        # Parameter sliders; only the stages a change affects are re-run
+        tuning_frame = ttk.LabelFrame(main_container, text="Parameters", padding="5")
+        tuning_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        
+        self.tuning_vars = {}
+        self.tuning_labels = {}
+        for column, (name, label, low, high) in enumerate(TUNING_SLIDERS):
+            tuning_frame.columnconfigure(column * 3 + 1, weight=1)
+            ttk.Label(tuning_frame, text=f"{label}:").grid(row=0, column=column * 3, padx=(10, 2))
+            
+            self.tuning_vars[name] = tk.DoubleVar(value=DEFAULT_TUNING[name])
+            ttk.Scale(
+                tuning_frame,
+                from_=low,
+                to=high,
+                variable=self.tuning_vars[name],
+                command=lambda value, name=name: self.on_tuning_change(name)
+            ).grid(row=0, column=column * 3 + 1, sticky=(tk.W, tk.E))
+            
+            self.tuning_labels[name] = ttk.Label(tuning_frame, width=5)
+            self.tuning_labels[name].grid(row=0, column=column * 3 + 2, padx=(2, 5))
+            self.update_tuning_label(name)
+        
         # Status bar
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
         status_bar = ttk.Label(main_container, textvariable=self.status_var, relief=tk.SUNKEN)
-        status_bar.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+        status_bar.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
     
     def load_image(self):
         """Load and process MRI image"""
@@ -136,23 +235,167 @@ class CompactBrainTumorGUI:
         if not file_path:
             return
         
+        self.current_item = None
+        self.start_job([file_path], self.job_params())
+    
+    def load_folder(self):
+        """Process every image in a folder, listing results as they arrive"""
+        folder = filedialog.askdirectory(title="Select MRI Folder")
+        
+        if not folder:
+            return
+        
+        image_paths = find_images(folder)
+        if not image_paths:
+            messagebox.showinfo("No images", f"No MRI images found in {folder}")
+            return
+        
+        self.folder_list.delete(*self.folder_list.get_children())
+        self.folder_results.clear()
+        self.thumbnails.clear()
+        self.current_item = None
+        self.start_job(image_paths, self.job_params())
+    
+    def start_job(self, image_paths, params=None):
+        """Hand image_paths to the worker, replacing any running job"""
+        if self.worker.busy:
+            self.worker.cancel()
+        
+        self.current_job = self.worker.submit(image_paths, params)
+        self.progress['value'] = 0
+        self.cancel_btn.config(state=tk.NORMAL)
+        self.status_var.set(f"Processing {len(image_paths)} image(s)...")
+    
+    def job_params(self):
+        """Slider values for a new job, or None to run the default (cacheable) pipeline"""
+        return None if self.tuning == DEFAULT_TUNING else dict(self.tuning)
+    
+    def update_tuning_label(self, name):
+        """Snap a slider to a valid value and show it"""
+        value = self.tuning_vars[name].get()
+        if name == 'threshold':
+            value = round(value, 2)
+            text = f"{value:.2f}"
+        elif name == 'kernel_size':
+            value = int(value) // 2 * 2 + 1  # Odd diameters only
+            text = str(value)
+        else:
+            value = int(round(value / 10) * 10)
+            text = str(value)
+        
+        self.tuning[name] = value
+        self.tuning_labels[name].config(text=text)
+    
+    def on_tuning_change(self, name):
+        """Slider moved: re-run the current image once the slider settles"""
+        previous = self.tuning[name]
+        self.update_tuning_label(name)
+        if self.tuning[name] == previous or self.current_path is None:
+            return
+        
+        if self._tune_after is not None:
+            self.root.after_cancel(self._tune_after)
+        self._tune_after = self.root.after(TUNE_DELAY_MS, self.apply_tuning)
+    
+    def apply_tuning(self):
+        """Re-run the current image with the slider values (incrementally)"""
+        self._tune_after = None
+        if self.current_path is not None:
+            self.start_job([self.current_path], dict(self.tuning))
+    
+    def cancel_processing(self):
+        """Stop the running job after its current stage"""
+        self.worker.cancel()
+        self.status_var.set("Cancelling...")
+    
+    def poll_worker(self):
+        """Apply the worker's events to the UI; rescheduled on the Tk loop"""
         try:
-            self.status_var.set("Processing image...")
-            self.root.update()
-            
-            # Process the image
-            self.results = self.detector.process_complete_pipeline(file_path)
-            
-            # Update displays
-            self.update_quick_results()
-            self.change_view(0)  # Start with first view
-            self.update_detailed_results()
-            
-            self.status_var.set(f"Analysis complete - {self.results['category']}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred: {str(e)}")
-            self.status_var.set("Error occurred")
+            while True:
+                event = self.worker.events.get_nowait()
+                if event[1] == self.current_job:
+                    self.handle_event(event)
+        except queue.Empty:
+            pass
+        
+        self.root.after(POLL_INTERVAL_MS, self.poll_worker)
+    
+    def handle_event(self, event):
+        """Update progress, results or errors for one worker event"""
+        kind = event[0]
+        
+        if kind == 'progress':
+            _, _, fraction, message = event
+            self.progress['value'] = fraction
+            self.status_var.set(f"Processing... {os.path.basename(message)}")
+        
+        elif kind == 'result':
+            _, _, index, total, path, results = event
+            if total > 1:
+                self.add_folder_item(path, results)
+            elif self.current_item is not None and self.folder_results[self.current_item][0] == path:
+                # Re-run of a folder image with new parameters
+                self.folder_results[self.current_item] = (path, results)
+                self.folder_list.item(self.current_item, values=(
+                    f"{results['tumor_area_cm2']:.3f}", results['category']))
+            # Show the first result straight away; later ones are picked from the list
+            if index == 0:
+                self.show_results(results, path)
+            self.status_var.set(
+                f"{index + 1}/{total} - {results['category']} | {format_summary(results['instrumentation'])}"
+            )
+        
+        elif kind == 'error':
+            _, _, index, total, path, message = event
+            if total > 1:
+                self.folder_list.insert('', tk.END, text=os.path.basename(path), values=('', 'Error'))
+            else:
+                messagebox.showerror("Error", f"An error occurred: {message}")
+            self.status_var.set(f"Error occurred: {os.path.basename(path)}")
+        
+        elif kind == 'done':
+            _, _, cancelled = event
+            self.current_job = None
+            self.cancel_btn.config(state=tk.DISABLED)
+            if cancelled:
+                self.status_var.set("Cancelled")
+            else:
+                self.progress['value'] = 1.0
+    
+    def add_folder_item(self, path, results):
+        """Append one finished image, with thumbnail, to the folder list"""
+        thumbnail = tk.PhotoImage(data=make_thumbnail(results['original']))
+        item = self.folder_list.insert(
+            '', tk.END,
+            text=os.path.basename(path),
+            image=thumbnail,
+            values=(f"{results['tumor_area_cm2']:.3f}", results['category'])
+        )
+        self.thumbnails[item] = thumbnail
+        self.folder_results[item] = (path, results)
+        if self.current_item is None:
+            self.current_item = item
+    
+    def on_folder_select(self, event=None):
+        """Show the results of the image selected in the folder list"""
+        for item in self.folder_list.selection():
+            if item in self.folder_results:
+                self.current_item = item
+                self.show_results(*self.folder_results[item][::-1])
+    
+    def show_results(self, results, path=None):
+        """Display one results dict; path is the image the sliders re-run"""
+        self.results = results
+        if path is not None:
+            self.current_path = path
+        self.update_quick_results()
+        self.view_renderer.set_results(results)
+        self.update_detailed_results()
+    
+    def on_close(self):
+        """Stop the worker before closing the window"""
+        self.worker.stop()
+        self.root.destroy()
     
     def change_view(self, view_index):
         """Change which images are displayed"""
@@ -161,29 +404,9 @@ class CompactBrainTumorGUI:
         
         self.current_view = view_index
         
-        # Clear axes
-        for ax in self.axes:
-            ax.clear()
-            ax.axis('off')
-        
-        if view_index == 0:
-            # Show Original and Binary
-            self.axes[0].imshow(self.results['original'], cmap='gray')
-            self.axes[0].set_title('Original Grayscale MRI', fontsize=10)
-            
-            self.axes[1].imshow(self.results['binary'], cmap='gray')
-            self.axes[1].set_title('Binary Image', fontsize=10)
-            
-        elif view_index == 1:
-            # Show Watershed and Morphological Tumor
-            self.axes[0].imshow(self.results['watershed'], cmap='viridis')
-            self.axes[0].set_title('Watershed Segmentation', fontsize=10)
-            
-            self.axes[1].imshow(self.results['morphology_tumor'], cmap='gray')
-            self.axes[1].set_title('Tumor Detection\n(White = Tumor)', fontsize=10)
-        
-        self.fig.tight_layout()
-        self.canvas.draw()
+        # View 0: Original & Binary, view 1: Watershed & Tumor (see brain_tumor_views.VIEWS)
+        redraw_ms = self.view_renderer.show(view_index)
+        self.status_var.set(f"View redraw {redraw_ms:.1f} ms")
     
     def update_quick_results(self):
         """Update the quick results display"""
@@ -222,9 +445,10 @@ Classification: {self.results['category']}
 PROCESSING STEPS:
 {'='*25}
 ✓ Grayscale conversion
-✓ Binary thresholding (60%)
+✓ Binary thresholding ({self.tuning['threshold']:.0%})
 ✓ Watershed segmentation
-✓ Morphological operations
+✓ Morphological operations ({self.tuning['kernel_size']}px disk)
+✓ Otsu segmentation (min area {self.tuning['min_area']} px)
 ✓ Tumor detection
 
 CLASSIFICATION CRITERIA:
@@ -251,7 +475,7 @@ NAVIGATION:
   Shows segmentation and 
   final tumor detection
 """
-        
+
         self.results_text.insert(1.0, text_content)
         self.results_text.config(state=tk.DISABLED)
 
@@ -0,0 +1,224 @@
+"""
+Connected-component analysis shared by the detection stages
+
+One labeling pass gives the filtered mask (via a label lookup table), the
+total area and per-region statistics. Binary morphological reconstruction
+works on whole components too: a mask component is either flooded
+completely from a marker pixel or not at all.
+"""
+
+import cv2
+import numpy as np
+
+# Rows looked up per np.take call when there are too many labels for cv2.LUT,
+# which bounds the temporary index array np.take makes from the int32 labels
+LOOKUP_ROWS = 16
+
+
+class RegionStats:
+    """Per-region statistics of a binary mask
+    
+    areas_px, areas_cm2: (R,) arrays
+    bboxes: (R, 4) array of x, y, width, height
+    centroids: (R, 2) array of x, y
+    mask: binary mask keeping only the listed regions (255 = region)
+    """
+    __slots__ = ('areas_px', 'areas_cm2', 'bboxes', 'centroids', 'mask',
+                 'total_area_px', 'total_area_cm2')
+    
+    def __init__(self, areas_px, areas_cm2, bboxes, centroids, mask,
+                 total_area_px, total_area_cm2):
+        self.areas_px = areas_px
+        self.areas_cm2 = areas_cm2
+        self.bboxes = bboxes
+        self.centroids = centroids
+        self.mask = mask
+        self.total_area_px = total_area_px
+        self.total_area_cm2 = total_area_cm2
+    
+    def __len__(self):
+        return len(self.areas_px)
+    
+    def __repr__(self):
+        return f"RegionStats(regions={len(self)}, total_area_cm2={self.total_area_cm2:.4f})"
+    
+    def as_records(self):
+        """One dict per region, e.g. for CSV/JSON lesion reports"""
+        return [
+            {
+                'area_px': int(self.areas_px[i]),
+                'area_cm2': float(self.areas_cm2[i]),
+                'bbox': tuple(int(v) for v in self.bboxes[i]),
+                'centroid': tuple(float(v) for v in self.centroids[i])
+            }
+            for i in range(len(self))
+        ]
+
+
+def filter_by_area(labels, stats, min_area, out=None):
+    """Mask of components with area >= min_area, built with one lookup-table pass
+    
+    Nothing image-sized is allocated besides out (if not given): with up
+    to 256 labels they are narrowed into out and mapped in place with
+    cv2.LUT, otherwise np.take runs over a few rows at a time.
+    """
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False  # Background (label 0)
+    
+    lut = np.where(keep, 255, 0).astype(np.uint8)
+    if out is None:
+        out = np.empty(labels.shape, dtype=np.uint8)
+    
+    if len(lut) <= 256:
+        np.copyto(out, labels, casting='unsafe')
+        return cv2.LUT(out, np.pad(lut, (0, 256 - len(lut))), dst=out), keep
+    
+    # mode='clip' lets take write straight into out (labels are always in range)
+    for start in range(0, labels.shape[0], LOOKUP_ROWS):
+        rows = slice(start, start + LOOKUP_ROWS)
+        np.take(lut, labels[rows], out=out[rows], mode='clip')
+    return out, keep
+
+
+def analyze_components(binary_image, min_area=0, pixel_w=1.0, pixel_h=1.0, connectivity=8,
+                       labels=None, out=None):
+    """Label a binary mask once and return RegionStats for regions >= min_area
+    
+    labels (int32) and out (uint8, the region mask) are optional buffers of
+    the image's shape to write into.
+    """
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        binary_image, labels=labels, connectivity=connectivity, ltype=cv2.CV_32S
+    )
+    
+    if min_area > 0:
+        mask, keep = filter_by_area(labels, stats, min_area, out)
+    else:
+        # Every foreground component is kept, so the mask is just the foreground
+        keep = np.ones(num_labels, dtype=bool)
+        keep[0] = False
+        _, mask = cv2.threshold(binary_image, 0, 255, cv2.THRESH_BINARY, dst=out)
+    
+    region_stats = stats[keep]
+    areas_px = region_stats[:, cv2.CC_STAT_AREA]
+    total_area_px = int(areas_px.sum())
+    
+    return RegionStats(
+        areas_px=areas_px,
+        areas_cm2=areas_px * pixel_w * pixel_h,
+        bboxes=region_stats[:, :cv2.CC_STAT_AREA],
+        centroids=centroids[keep],
+        mask=mask,
+        total_area_px=total_area_px,
+        total_area_cm2=total_area_px * pixel_w * pixel_h
+    )
+
+
+def remove_small_objects(binary_image, min_area=50, connectivity=8, instrumentation=None,
+                         labels=None, out=None):
+    """Drop components smaller than min_area (equivalent to bwareaopen)
+    
+    If instrumentation is given, the number of labels found
+    and components filtered out are added to it. labels and out are
+    optional buffers as in analyze_components.
+    """
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        binary_image, labels=labels, connectivity=connectivity, ltype=cv2.CV_32S
+    )
+    mask, keep = filter_by_area(labels, stats, min_area, out)
+    
+    if instrumentation is not None:
+        instrumentation.count('labels_found', num_labels - 1)
+        instrumentation.count('components_filtered', num_labels - 1 - int(keep.sum()))
+    
+    return mask
+
+
+def _flood_from(image, seeds, connectivity, flood=None):
+    """Mask of the 255 components of image containing a seed pixel
+    
+    The components are flood-filled into flood, a (H + 2, W + 2) uint8
+    buffer as cv2.floodFill wants it; the returned view is its interior
+    (255 = filled). One seed per seed component is enough for
+    8-connectivity: the first point of each contour. 4-connected
+    components can share an 8-connected contour, so then every contour
+    point is tried.
+    """
+    height, width = image.shape
+    if flood is None:
+        flood = np.zeros((height + 2, width + 2), dtype=np.uint8)
+    else:
+        flood.fill(0)
+    filled = flood[1:-1, 1:-1]
+    
+    approximation = cv2.CHAIN_APPROX_SIMPLE if connectivity == 8 else cv2.CHAIN_APPROX_NONE
+    contours, _ = cv2.findContours(seeds, cv2.RETR_LIST, approximation)
+    flags = connectivity | cv2.FLOODFILL_MASK_ONLY | (255 << 8)
+    
+    for contour in contours:
+        points = contour[:1] if connectivity == 8 else contour
+        for x, y in points[:, 0]:
+            if not filled[y, x]:
+                cv2.floodFill(image, flood, (int(x), int(y)), 0, flags=flags)
+    return filled
+
+
+def reconstruct_by_dilation(marker, mask, connectivity=8, seeds=None, flood=None, out=None):
+    """Binary reconstruction of mask from marker (equivalent to imreconstruct)
+    
+    Keeps every component of mask containing a nonzero marker pixel, which
+    is exactly where iterated geodesic dilation of the marker would end up.
+    Each such component is flood-filled once from a marker pixel, so the
+    cost is one pass over the kept components instead of one full-image
+    pass per pixel of propagation. seeds and out (uint8, the image's
+    shape) and flood (uint8, two pixels larger each way) are optional
+    buffers to write into.
+    """
+    seeds = cv2.bitwise_and(marker, mask, dst=seeds)
+    filled = _flood_from(mask, seeds, connectivity, flood)
+    
+    if out is None:
+        return filled.copy()
+    np.copyto(out, filled)
+    return out
+
+
+def reconstruct_by_erosion(marker, mask, connectivity=8, seeds=None, flood=None, out=None):
+    """Binary reconstruction by erosion, the dual of reconstruct_by_dilation
+    
+    Same as imcomplement(imreconstruct(imcomplement(marker), imcomplement(mask))):
+    a background component of mask stays background if marker is zero
+    anywhere in it, and is filled otherwise. Buffers as in
+    reconstruct_by_dilation; out also holds the complement of mask.
+    """
+    # Seeds: background of both marker and mask
+    seeds = cv2.bitwise_not(cv2.bitwise_or(marker, mask, dst=seeds), dst=seeds)
+    inverse = cv2.bitwise_not(mask, dst=out)
+    
+    reached = _flood_from(inverse, seeds, connectivity, flood)
+    return cv2.bitwise_not(reached, dst=inverse)
+
+
+def reconstruct_iterative(marker, mask, method='dilation', connectivity=8):
+    """Reference reconstruction: elementary geodesic steps until nothing changes
+    
+    Works for grayscale images as well, but needs one full-image pass per
+    pixel of propagation distance; it exists to validate the fast binary
+    versions above.
+    """
+    shape = cv2.MORPH_RECT if connectivity == 8 else cv2.MORPH_CROSS
+    kernel = cv2.getStructuringElement(shape, (3, 3))
+    
+    if method == 'dilation':
+        step, limit = cv2.dilate, np.minimum
+    elif method == 'erosion':
+        step, limit = cv2.erode, np.maximum
+    else:
+        raise ValueError(f"Unknown reconstruction method: {method!r}")
+    
+    result = limit(marker, mask)
+    while True:
+        grown = limit(step(result, kernel), mask)
+        if np.array_equal(grown, result):
+            return result
+        result = grown
@@ -0,0 +1,1165 @@
+"""
+Headless core of the brain tumor detection pipeline
+
+Only OpenCV and NumPy (plus the standard library and this project's small
+helper modules) are imported eagerly, so batch workers and services start
+quickly. scikit-image is loaded the first time the watershed stage runs;
+plotting and GUI code live in brain_tumor_detection and the GUI modules.
+"""
+
+import functools
+import io
+import itertools
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from brain_tumor_components import (
+    analyze_components, reconstruct_by_dilation, reconstruct_by_erosion, remove_small_objects
+)
+from brain_tumor_cache import cache_key
+from brain_tumor_instrumentation import instrumented
+
+
+def classify_tumor_area(tumor_cm2):
+    """Classify a tumor by its area in cm²"""
+    if tumor_cm2 == 0:
+        return "No Tumor"
+    elif tumor_cm2 <= 2.37:
+        return "Benign Tumor"
+    else:
+        return "Malignant Tumor"
+
+
+def otsu_thresholds(gray_stack):
+    """Vectorized Otsu threshold for a stack of uint8 images (same as cv2 THRESH_OTSU)
+    
+    Follows OpenCV's reference implementation; IPP builds can break exact
+    ties between levels differently.
+    """
+    n = gray_stack.shape[0]
+    flat = gray_stack.reshape(n, -1)
+    
+    # One histogram per image from a single bincount over offset pixel values
+    offsets = (np.arange(n, dtype=np.int64) * 256)[:, None]
+    hist = np.bincount((flat + offsets).ravel(), minlength=n * 256).reshape(n, 256)
+    scale = 1.0 / flat.shape[1]
+    mu = (hist @ np.arange(256, dtype=np.float64)) * scale
+    
+    # Same recurrence as OpenCV's getThreshVal_Otsu_8u, run across the whole
+    # batch at once so ties resolve identically to cv2.threshold
+    eps = np.finfo(np.float32).eps
+    q1 = np.zeros(n)
+    mu1 = np.zeros(n)
+    max_sigma = np.zeros(n)
+    max_val = np.zeros(n, dtype=np.uint8)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(256):
+            p_i = hist[:, i] * scale
+            mu1 *= q1
+            q1 += p_i
+            q2 = 1.0 - q1
+            valid = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1.0 - eps)
+            mu1 = np.where(valid, (mu1 + i * p_i) / q1, mu1)
+            mu2 = (mu - q1 * mu1) / q2
+            sigma = q1 * q2 * (mu2 - mu1) * (mu2 - mu1)
+            better = valid & (sigma > max_sigma)
+            max_sigma[better] = sigma[better]
+            max_val[better] = i
+            
+    return max_val
+
+
+# Pixel size for area calculation (same as MATLAB)
+PIXEL_W = 0.0508
+PIXEL_H = 0.0508
+
+# Resize target and morphology structuring element (disk of radius 5)
+IMAGE_SIZE = (200, 200)
+KERNEL_SIZE = (11, 11)
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, KERNEL_SIZE)
+
+# morphology_tumor_mask methods: MATLAB's reconstruction, or the older local
+# approximation by closings and openings
+MORPHOLOGY_METHODS = ('reconstruct', 'approximate')
+DEFAULT_MORPHOLOGY = 'reconstruct'
+
+# Watershed implementations selectable per run (see _watershed_labels)
+WATERSHED_BACKENDS = ('skimage', 'opencv', 'flood')
+DEFAULT_WATERSHED_BACKEND = 'skimage'
+
+# Image decoding: 'exact' decodes in color, resizes, then converts to gray like
+# MATLAB; 'fast' decodes grayscale directly (see load_gray_image)
+DECODE_MODES = ('exact', 'fast')
+DEFAULT_DECODE = 'exact'
+
+# JPEG decoders can scale by 1/8, 1/4 or 1/2 while decoding (largest first)
+_REDUCED_GRAYSCALE = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                      (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+# 4-connected neighbourhood, the connectivity of skimage's default watershed
+CROSS_KERNEL = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+
+def pipeline_params(threshold=0.6, min_area=50, pixel_w=PIXEL_W, pixel_h=PIXEL_H,
+                    native=False, pixel_spacing=None, watershed_backend=DEFAULT_WATERSHED_BACKEND,
+                    decode=DEFAULT_DECODE, morphology=DEFAULT_MORPHOLOGY):
+    """Every parameter that affects pipeline output, e.g. for cache keys"""
+    return {
+        'threshold': threshold,
+        'min_area': min_area,
+        'pixel_w': pixel_w,
+        'pixel_h': pixel_h,
+        'image_size': None if native else list(IMAGE_SIZE),
+        'pixel_spacing': list(pixel_spacing) if pixel_spacing else None,
+        'kernel': ['ellipse'] + list(KERNEL_SIZE),
+        'morphology': morphology,
+        'watershed_backend': watershed_backend,
+        'decode': decode
+    }
+
+
+def native_pixel_size(shape, pixel_w=PIXEL_W, pixel_h=PIXEL_H, pixel_spacing=None):
+    """Pixel size (cm) of an image processed at native resolution
+    
+    pixel_w/pixel_h describe the 200x200 grid, so a native image covering
+    the same field of view has proportionally smaller pixels. An explicit
+    pixel_spacing (width, height in cm, e.g. from the scanner) wins.
+    """
+    if pixel_spacing is not None:
+        return pixel_spacing
+        
+    height, width = shape[:2]
+    return pixel_w * IMAGE_SIZE[0] / width, pixel_h * IMAGE_SIZE[1] / height
+
+
+def resized_pixel_size(shape, pixel_spacing):
+    """Pixel size (cm) after resizing an image of shape to IMAGE_SIZE
+    
+    pixel_spacing (width, height in cm) is the size of the image's own
+    pixels; the 200x200 grid covers the same field of view with fewer,
+    larger pixels.
+    """
+    height, width = shape[:2]
+    return pixel_spacing[0] * width / IMAGE_SIZE[0], pixel_spacing[1] * height / IMAGE_SIZE[1]
+
+
+def _check_spacing(native, pixel_spacing):
+    if pixel_spacing is not None and not native:
+        raise ValueError("pixel_spacing describes native pixels and needs native=True; "
+                         "for 200x200 runs pass pixel_w/pixel_h (see resized_pixel_size)")
+
+
+class Workspace:
+    """Reusable stage buffers, so repeated images of one shape allocate nothing
+    
+    Buffers are created on first use and reused by every later image of the
+    same shape (another shape reallocates them). Arrays returned by stages
+    run with a workspace are these buffers and are overwritten by the next
+    image: copy anything that has to outlive it. A workspace must not be
+    shared between threads.
+    """
+    
+    def __init__(self):
+        self._buffers = {}
+    
+    def buffer(self, name, shape, dtype=np.uint8):
+        """The buffer called name, (re)allocated if its shape or dtype differs"""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+    
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+
+_thread_state = threading.local()
+
+
+def thread_workspace():
+    """The calling thread's own Workspace, created on first use"""
+    workspace = getattr(_thread_state, 'workspace', None)
+    if workspace is None:
+        workspace = _thread_state.workspace = Workspace()
+    return workspace
+
+
+def _buffer(workspace, name, shape, dtype=np.uint8):
+    """Workspace buffer, or None (let OpenCV allocate) without a workspace"""
+    if workspace is None:
+        return None
+    return workspace.buffer(name, shape, dtype)
+
+
+# Stateless pipeline functions. These never touch shared state, so one set of
+# parameters can serve any number of threads; BrainTumorDetector wraps them.
+
+def load_gray_image(image_path, native=False, workspace=None, decode=DEFAULT_DECODE):
+    """Load an MRI image resized to 200x200 grayscale (or at native resolution)
+    
+    decode='fast' reads the file as grayscale, and a JPEG at least twice
+    the target size is scaled down by 2, 4 or 8 inside the decoder, so most
+    of the full-resolution decode is skipped. Grayscale files give the same
+    image as 'exact'; for color files and reduced JPEG decodes pixels can
+    differ slightly.
+    """
+    if _fast_decode(decode):
+        try:
+            with open(image_path, 'rb') as f:
+                flag = _fast_decode_flag(f, native)
+        except OSError:
+            flag = cv2.IMREAD_GRAYSCALE
+        gray = cv2.imread(image_path, flag)
+        if gray is None:
+            raise ValueError(f"Could not load image: {image_path}")
+        return _fit_gray(gray, native, workspace)
+    
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image: {image_path}")
+    
+    return _to_gray(image, native, workspace)
+
+
+def decode_gray_image(data, native=False, workspace=None, decode=DEFAULT_DECODE):
+    """Like load_gray_image, for an encoded image held in memory (e.g. an upload)"""
+    if _fast_decode(decode):
+        flag = _fast_decode_flag(io.BytesIO(data), native)
+    else:
+        flag = cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag) if len(data) else None
+    if image is None:
+        raise ValueError("Could not decode image data")
+    
+    if image.ndim == 2:
+        return _fit_gray(image, native, workspace)
+    return _to_gray(image, native, workspace)
+
+
+def _fast_decode(decode):
+    if decode not in DECODE_MODES:
+        raise ValueError(f"Unknown decode mode: {decode!r}")
+    return decode == 'fast'
+
+
+def jpeg_size(stream):
+    """(width, height) from the header of a JPEG file object, or None if it is not a JPEG"""
+    if stream.read(2) != b'\xff\xd8':
+        return None
+    
+    while True:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        while marker[1] == 0xFF:  # Fill bytes before a marker
+            marker = marker[1:] + stream.read(1)
+            if len(marker) < 2:
+                return None
+        code = marker[1]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:  # Markers without a segment
+            continue
+        
+        length = int.from_bytes(stream.read(2), 'big')
+        # Start-of-frame segments (SOF0-SOF15 except DHT, JPG and DAC) hold the size
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            frame = stream.read(5)
+            if len(frame) < 5:
+                return None
+            return int.from_bytes(frame[3:5], 'big'), int.from_bytes(frame[1:3], 'big')
+        if length < 2:
+            return None
+        stream.seek(length - 2, io.SEEK_CUR)
+
+
+def _fast_decode_flag(stream, native=False):
+    """Grayscale imread flag, reduced by the largest factor that keeps a JPEG above IMAGE_SIZE"""
+    if not native:
+        size = jpeg_size(stream)
+        if size is not None:
+            for factor, flag in _REDUCED_GRAYSCALE:
+                if size[0] >= factor * IMAGE_SIZE[0] and size[1] >= factor * IMAGE_SIZE[1]:
+                    return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def _fit_gray(gray, native=False, workspace=None):
+    # Resize to 200x200 (same as MATLAB)
+    if native:
+        return gray
+    return cv2.resize(gray, IMAGE_SIZE, dst=_buffer(workspace, 'gray', IMAGE_SIZE[::-1]))
+
+
+def iter_gray_images(image_paths, native=False, decode=DEFAULT_DECODE, prefetch=2):
+    """(path, gray image, error) for each file, decoded ahead on a reader thread
+    
+    While the caller runs the pipeline on one image, the reader thread
+    loads and decodes up to prefetch more (OpenCV releases the GIL while
+    decoding). A file that cannot be loaded yields (path, None, error)
+    instead of stopping the iteration.
+    """
+    loaded = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    end = object()
+    
+    def read():
+        for path in image_paths:
+            if stop.is_set():
+                return
+            try:
+                loaded.put((path, load_gray_image(path, native, decode=decode), None))
+            except Exception as e:
+                loaded.put((path, None, e))
+        loaded.put(end)
+    
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = loaded.get()
+            if item is end:
+                return
+            yield item
+    finally:
+        # Unblock the reader if the caller stopped early
+        stop.set()
+        while reader.is_alive():
+            try:
+                loaded.get_nowait()
+            except queue.Empty:
+                reader.join(0.01)
+
+
+def _to_gray(image, native=False, workspace=None):
+    # Resize to 200x200 (same as MATLAB)
+    if not native:
+        image = cv2.resize(image, IMAGE_SIZE,
+                           dst=_buffer(workspace, 'color', IMAGE_SIZE[::-1] + image.shape[2:]))
+    
+    # Convert to grayscale
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=_buffer(workspace, 'gray', image.shape[:2]))
+
+
+@functools.lru_cache(maxsize=None)
+def binary_cutoff(threshold):
+    """Smallest gray level g with g / 255 > threshold, compared in float32
+    
+    Thresholding the uint8 image at this level gives exactly the result of
+    normalizing to float32 and comparing, without the float copy.
+    """
+    levels = np.arange(256, dtype=np.float32) / np.float32(255.0)
+    return int(np.count_nonzero(levels <= np.float32(threshold)))
+
+
+def binarize(gray_image, threshold=0.6, out=None):
+    """Binary image using threshold (equivalent to imbinarize)
+    
+    gray_image may be one image or an (N, H, W) stack; out is an optional
+    uint8 array of the same shape to write into.
+    """
+    # gray / 255 > threshold  <=>  gray >= binary_cutoff(threshold)
+    cutoff = binary_cutoff(threshold)
+    
+    if gray_image.ndim == 2:
+        _, binary = cv2.threshold(gray_image, cutoff - 1, 255, cv2.THRESH_BINARY, dst=out)
+        return binary
+    
+    # Stacks are thresholded as one tall image
+    if out is None:
+        out = np.empty(gray_image.shape, dtype=np.uint8)
+    cv2.threshold(gray_image.reshape(-1, gray_image.shape[-1]), cutoff - 1, 255,
+                  cv2.THRESH_BINARY, dst=out.reshape(-1, out.shape[-1]))
+    return out
+
+
+def _flood_skimage(gradient, markers, workspace=None):
+    """Reference backend: scikit-image's priority-flood watershed"""
+    # scikit-image is only needed here, so it is not imported with the core
+    from skimage.segmentation import watershed
+    
+    return watershed(gradient, markers)
+
+
+def _flood_opencv(gradient, markers, workspace=None):
+    """cv2.watershed on the gradient saturated to uint8
+    
+    OpenCV marks the image frame and the lines between basins with -1, so
+    it runs on a copy padded by one pixel and line pixels get label 1.
+    Unlabeled pixels always have gradients within the 8-bit marker band.
+    """
+    height, width = gradient.shape
+    padded_shape = (height + 2, width + 2)
+    
+    gradient_u8 = cv2.convertScaleAbs(gradient, dst=_buffer(workspace, 'gradient_u8', gradient.shape))
+    image = cv2.copyMakeBorder(gradient_u8, 1, 1, 1, 1, cv2.BORDER_REPLICATE,
+                               dst=_buffer(workspace, 'gradient_padded', padded_shape))
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR,
+                         dst=_buffer(workspace, 'gradient_bgr', padded_shape + (3,)))
+    labels = cv2.copyMakeBorder(markers, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0,
+                                dst=_buffer(workspace, 'markers_padded', padded_shape, np.int32))
+    
+    cv2.watershed(image, labels)
+    labels = labels[1:-1, 1:-1]
+    labels[labels == -1] = 1
+    return labels
+
+
+def _flood_two_labels(gradient, markers, workspace=None):
+    """Watershed specialised for the two marker labels the pipeline uses
+    
+    With a binary input every pixel is already a marker (Sobel magnitudes
+    of a 0/255 image are 0 or at least 255), so the markers are returned
+    as they are. Otherwise both labels grow by 4-connected geodesic
+    dilation through the unlabeled pixels, one gradient level at a time,
+    which matches the priority flood up to ties between the two fronts.
+    """
+    unlabeled = markers == 0
+    if not unlabeled.any():
+        return markers
+    
+    levels = np.ceil(gradient)
+    first = (markers == 1).view(np.uint8)
+    second = (markers == 2).view(np.uint8)
+    free = unlabeled.view(np.uint8)
+    
+    for level in np.unique(levels[unlabeled]):
+        allowed = free & (levels <= level).view(np.uint8)
+        while True:
+            reach_first = cv2.dilate(first, CROSS_KERNEL) & allowed
+            reach_second = cv2.dilate(second, CROSS_KERNEL) & allowed
+            reach_second &= 1 ^ reach_first
+            grown = reach_first | reach_second
+            if not grown.any():
+                break
+            first |= reach_first
+            second |= reach_second
+            allowed ^= grown
+            free ^= grown
+    
+    labels = markers.copy()
+    labels[first.view(bool)] = 1
+    labels[second.view(bool)] = 2
+    return labels
+
+
+_WATERSHED_FLOODS = {
+    'skimage': _flood_skimage,
+    'opencv': _flood_opencv,
+    'flood': _flood_two_labels,
+}
+
+
+def _watershed_labels(binary_image, workspace=None, backend=DEFAULT_WATERSHED_BACKEND):
+    """Sobel gradient + marker watershed on a binary image
+    
+    The gradient is taken straight from the 0/255 image in float32. The
+    watershed only depends on the ordering of gradient values, so the
+    marker thresholds are scaled by 255 instead of normalizing the image.
+    backend is one of WATERSHED_BACKENDS.
+    """
+    try:
+        flood = _WATERSHED_FLOODS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown watershed backend: {backend!r}") from None
+    
+    shape = binary_image.shape
+    
+    # Sobel filters (equivalent to MATLAB's fspecial('sobel'))
+    sobel_x = cv2.Sobel(binary_image, cv2.CV_32F, 1, 0, ksize=3,
+                        dst=_buffer(workspace, 'sobel_x', shape, np.float32))
+    sobel_y = cv2.Sobel(binary_image, cv2.CV_32F, 0, 1, ksize=3,
+                        dst=_buffer(workspace, 'sobel_y', shape, np.float32))
+    
+    # Gradient magnitude
+    gradient_magnitude = cv2.magnitude(sobel_x, sobel_y,
+                                       magnitude=_buffer(workspace, 'gradient', shape, np.float32))
+    
+    # Watershed markers: flat regions (< 0.1) and strong edges (> 0.8)
+    markers = _buffer(workspace, 'markers', shape, np.int32)
+    if markers is None:
+        markers = np.empty(shape, dtype=np.int32)
+    selected = _buffer(workspace, 'marker_mask', shape, bool)
+    markers.fill(0)
+    np.copyto(markers, 1, where=np.less(gradient_magnitude, 0.1 * 255, out=selected))
+    np.copyto(markers, 2, where=np.greater(gradient_magnitude, 0.8 * 255, out=selected))
+    
+    # Apply watershed
+    return flood(gradient_magnitude, markers, workspace)
+
+
+def watershed_image(binary_image, workspace=None, backend=DEFAULT_WATERSHED_BACKEND):
+    """Watershed segmentation of a binary image, scaled for visualization"""
+    labels = _watershed_labels(binary_image, workspace, backend)
+    
+    out = _buffer(workspace, 'watershed', binary_image.shape)
+    if out is None:
+        out = np.empty(binary_image.shape, dtype=np.uint8)
+    return np.multiply(labels, 127, out=out, casting='unsafe')
+
+
+def disk_kernel(size):
+    """Disk structuring element of odd diameter size (11 is strel('disk',5))"""
+    if size < 1 or size % 2 == 0:
+        raise ValueError(f"Kernel size must be a positive odd number, got {size}")
+    if (size, size) == KERNEL_SIZE:
+        return MORPH_KERNEL
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+
+def morphology_tumor_mask(binary_image, workspace=None, method=DEFAULT_MORPHOLOGY, kernel=MORPH_KERNEL):
+    """Morphological operations that isolate the tumor (white areas)
+    
+    'reconstruct' follows the MATLAB script step by step:
+        recon = imreconstruct(imopen(bw, se), bw)
+        tumor = imcomplement(imreconstruct(imcomplement(imdilate(recon, se)),
+                                           imcomplement(recon)))
+    'approximate' replaces both reconstructions by closings and openings.
+    It gives larger masks and only looks at a fixed neighbourhood of each
+    pixel. brain_tumor_tiled computes the same reconstruction tile by tile.
+    kernel is the structuring element se (by default the disk of radius 5).
+    """
+    if method not in MORPHOLOGY_METHODS:
+        raise ValueError(f"Unknown morphology method: {method!r}")
+    
+    shape = binary_image.shape
+    first = _buffer(workspace, 'morph_a', shape)
+    second = _buffer(workspace, 'morph_b', shape)
+    
+    # Opening operation (equivalent to imopen)
+    opened = cv2.morphologyEx(binary_image, cv2.MORPH_OPEN, kernel, dst=first)
+    
+    if method == 'reconstruct':
+        seeds = _buffer(workspace, 'recon_seeds', shape)
+        flood = _buffer(workspace, 'recon_flood', (shape[0] + 2, shape[1] + 2))
+        
+        # Components of the binary image that survive the opening (imreconstruct)
+        reconstructed = reconstruct_by_dilation(opened, binary_image, seeds=seeds, flood=flood,
+                                                out=second)
+        dilated = cv2.dilate(reconstructed, kernel, dst=first, iterations=1)
+        
+        # Fill the holes of the reconstruction that the dilation covers completely
+        return reconstruct_by_erosion(dilated, reconstructed, seeds=seeds, flood=flood,
+                                      out=_buffer(workspace, 'tumor', shape))
+    
+    # Reconstruction (approximated using closing and opening)
+    reconstructed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel, dst=second)
+    
+    # Dilation
+    dilated = cv2.dilate(reconstructed, kernel, dst=first, iterations=1)
+    
+    # Final reconstruction and complement operations
+    # This approximates the MATLAB morphological reconstruction
+    complement = cv2.bitwise_not(dilated, dst=first)
+    final_recon = cv2.morphologyEx(complement, cv2.MORPH_CLOSE, kernel, dst=second)
+    
+    # Final tumor mask (white areas represent tumor)
+    return cv2.bitwise_not(final_recon, dst=_buffer(workspace, 'tumor', shape))
+
+
+def otsu_segmentation(gray_image, min_area=50, instrumentation=None, workspace=None):
+    """Otsu thresholding with small object removal"""
+    shape = gray_image.shape
+    
+    # Otsu thresholding (equivalent to graythresh + imbinarize)
+    _, otsu_image = cv2.threshold(
+        gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+        dst=_buffer(workspace, 'otsu', shape)
+    )
+    
+    # Remove small objects (equivalent to bwareaopen)
+    return remove_small_objects(otsu_image, min_area=min_area, instrumentation=instrumentation,
+                                labels=_buffer(workspace, 'labels', shape, np.int32),
+                                out=_buffer(workspace, 'threshold', shape))
+
+
+def tumor_regions(tumor_mask, pixel_w=PIXEL_W, pixel_h=PIXEL_H, workspace=None):
+    """Per-lesion area (cm²), bounding box and centroid of the tumor mask"""
+    shape = tumor_mask.shape
+    return analyze_components(tumor_mask, pixel_w=pixel_w, pixel_h=pixel_h,
+                              labels=_buffer(workspace, 'labels', shape, np.int32),
+                              out=_buffer(workspace, 'regions', shape))
+
+
+def tumor_area(tumor_mask, pixel_w=PIXEL_W, pixel_h=PIXEL_H, regions=None):
+    """Tumor area in cm² and its classification"""
+    if regions is None:
+        regions = tumor_regions(tumor_mask, pixel_w, pixel_h)
+        
+    tumor_cm2 = regions.total_area_cm2
+    
+    return tumor_cm2, classify_tumor_area(tumor_cm2)
+
+
+class PipelineResult:
+    """Immutable result of one pipeline run
+    
+    Image arrays are marked read-only so a result can be shared freely
+    between threads.
+    """
+    __slots__ = ('original', 'binary', 'watershed', 'morphology_tumor',
+                 'threshold', 'tumor_area_cm2', 'category', 'regions')
+    
+    def __init__(self, original, binary, watershed, morphology_tumor,
+                 threshold, tumor_area_cm2, category, regions=None):
+        for name, value in zip(self.__slots__, (original, binary, watershed, morphology_tumor,
+                                                threshold, tumor_area_cm2, category, regions)):
+            if isinstance(value, np.ndarray):
+                # Read-only view, so the caller's own array stays writeable
+                value = value.view()
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("PipelineResult is immutable")
+    
+    def __delattr__(self, name):
+        raise AttributeError("PipelineResult is immutable")
+    
+    def __repr__(self):
+        return f"PipelineResult(tumor_area_cm2={self.tumor_area_cm2!r}, category={self.category!r})"
+    
+    def as_dict(self):
+        """Same layout as the dict returned by process_complete_pipeline"""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+# Stage dependency graph: stage -> (input stages, function(*inputs, params)).
+# 'original' is the loaded grayscale image and has no dependencies.
+# p['workspace'] is an optional Workspace for the stage buffers.
+PIPELINE_STAGES = {
+    'binary': (('original',), lambda gray, p: binarize(
+        gray, p['threshold'], out=_buffer(p['workspace'], 'binary', gray.shape))),
+    'watershed': (('binary',), lambda binary, p: watershed_image(
+        binary, p['workspace'], p['watershed_backend'])),
+    'morphology_tumor': (('binary',), lambda binary, p: morphology_tumor_mask(binary, p['workspace'])),
+    'threshold': (('original',), lambda gray, p: otsu_segmentation(
+        gray, p['min_area'], workspace=p['workspace'])),
+    'regions': (('morphology_tumor',), lambda mask, p: tumor_regions(
+        mask, p['pixel_w'], p['pixel_h'], p['workspace'])),
+    'tumor_area': (('morphology_tumor', 'regions'),
+                   lambda mask, regions, p: tumor_area(mask, regions=regions)),
+}
+
+# Result keys and the stage that produces each of them
+OUTPUT_STAGES = {
+    'original': 'original',
+    'binary': 'binary',
+    'watershed': 'watershed',
+    'morphology_tumor': 'morphology_tumor',
+    'threshold': 'threshold',
+    'tumor_area_cm2': 'tumor_area',
+    'category': 'tumor_area',
+    'regions': 'regions',
+}
+
+# Shorthand output names, e.g. outputs="area+category"
+OUTPUT_ALIASES = {
+    'area': 'tumor_area_cm2',
+    'tumor': 'morphology_tumor',
+}
+
+ALL_OUTPUTS = tuple(OUTPUT_STAGES)
+
+
+def parse_outputs(outputs=None):
+    """Normalize an outputs selection to a tuple of result keys
+    
+    outputs may be None (everything), a '+'-separated string such as
+    "area+category", or an iterable of result keys.
+    """
+    if outputs is None:
+        return ALL_OUTPUTS
+    if isinstance(outputs, str):
+        outputs = outputs.split('+')
+        
+    keys = []
+    for name in outputs:
+        key = OUTPUT_ALIASES.get(name.strip(), name.strip())
+        if key not in OUTPUT_STAGES:
+            raise ValueError(f"Unknown pipeline output: {name!r}")
+        if key not in keys:
+            keys.append(key)
+            
+    return tuple(keys)
+
+
+def resolve_stages(outputs=None):
+    """Stages needed for the requested outputs, in dependency order"""
+    ordered = []
+    
+    def visit(stage):
+        if stage in ordered or stage == 'original':
+            return
+        for dependency in PIPELINE_STAGES[stage][0]:
+            visit(dependency)
+        ordered.append(stage)
+        
+    for key in parse_outputs(outputs):
+        visit(OUTPUT_STAGES[key])
+        
+    return ordered
+
+
+def _image_bytes(image):
+    """Raw bytes identifying an input image (file contents or array data)"""
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            return f.read()
+    return repr((image.shape, image.dtype.str)).encode() + np.ascontiguousarray(image).tobytes()
+
+
+def run_pipeline(image, threshold=0.6, min_area=50, pixel_w=PIXEL_W, pixel_h=PIXEL_H,
+                 outputs=None, cache=None, native=False, pixel_spacing=None, workspace=None,
+                 watershed_backend=DEFAULT_WATERSHED_BACKEND, decode=DEFAULT_DECODE):
+    """Reentrant version of process_complete_pipeline
+    
+    image is a file path or an already loaded 200x200 grayscale array.
+    Safe to call concurrently from many threads. Only the stages needed
+    for outputs are run; fields of the result that were not needed are None.
+    With a ResultCache, identical inputs and parameters are computed once
+    (only the requested outputs are stored, so other fields may be None).
+    With native=True the image is not resized and the pixel size is scaled
+    to match (see native_pixel_size); arrays are then used as given.
+    With a Workspace (one per thread), stages write into its buffers and the
+    result's arrays are only valid until the workspace is used again.
+    watershed_backend selects the watershed implementation (WATERSHED_BACKENDS)
+    and decode how a file is read (DECODE_MODES, see load_gray_image).
+    pixel_spacing requires native=True (ValueError otherwise).
+    """
+    _check_spacing(native, pixel_spacing)
+    params = {'threshold': threshold, 'min_area': min_area,
+              'pixel_w': pixel_w, 'pixel_h': pixel_h, 'watershed_backend': watershed_backend}
+    
+    if cache is not None:
+        outputs = parse_outputs(outputs)
+        key = cache_key(_image_bytes(image),
+                        pipeline_params(**params, native=native, pixel_spacing=pixel_spacing,
+                                        decode=decode), outputs)
+        cached = cache.get(key)
+        if cached is not None:
+            return PipelineResult(**{**dict.fromkeys(PipelineResult.__slots__), **cached})
+    
+    params['workspace'] = workspace
+    if isinstance(image, str):
+        values = {'original': load_gray_image(image, native, workspace, decode)}
+    else:
+        values = {'original': image}
+    if native:
+        params['pixel_w'], params['pixel_h'] = native_pixel_size(
+            values['original'].shape, pixel_w, pixel_h, pixel_spacing)
+        
+    for stage in resolve_stages(outputs):
+        dependencies, function = PIPELINE_STAGES[stage]
+        values[stage] = function(*[values[name] for name in dependencies], params)
+        
+    area, category = values.get('tumor_area', (None, None))
+    
+    result = PipelineResult(
+        original=values['original'],
+        binary=values.get('binary'),
+        watershed=values.get('watershed'),
+        morphology_tumor=values.get('morphology_tumor'),
+        threshold=values.get('threshold'),
+        tumor_area_cm2=area,
+        category=category,
+        regions=values.get('regions')
+    )
+    
+    if cache is not None:
+        cache.put(key, {name: getattr(result, name) for name in outputs})
+        
+    return result
+
+
+# Detector stages in pipeline order: (method, parameters it takes, stages it
+# reads). process_incremental reruns a stage only when one of these changed.
+TUNABLE_STAGES = (
+    ('load_image', ('image_path',), ()),
+    ('create_binary_image', ('threshold',), ('load_image',)),
+    ('watershed_segmentation', (), ('create_binary_image',)),
+    ('morphological_processing', ('kernel_size',), ('create_binary_image',)),
+    ('threshold_segmentation', ('min_area',), ('load_image',)),
+    ('calculate_tumor_area', (), ('morphological_processing',)),
+)
+
+# Parameter values process_complete_pipeline runs with
+DEFAULT_TUNING = {'threshold': 0.6, 'kernel_size': KERNEL_SIZE[0], 'min_area': 50}
+
+
+class BrainTumorDetector:
+    def __init__(self, cache=None, instrumentation=None, workspace=None,
+                 watershed_backend=DEFAULT_WATERSHED_BACKEND, decode=DEFAULT_DECODE):
+        self.original_image = None
+        self.gray_image = None
+        self.binary_image = None
+        self.watershed_image = None
+        self.morphology_tumor = None
+        self.threshold_image = None
+        self.tumor_regions = None
+        
+        # Pixel size for area calculation (same as MATLAB)
+        self.pixel_w = PIXEL_W
+        self.pixel_h = PIXEL_H
+        
+        # Native-resolution mode: no resize, pixel size scaled to the image
+        self.native_resolution = False
+        self.pixel_spacing = None
+        
+        # Optional ResultCache consulted by process_complete_pipeline
+        self.cache = cache
+        
+        # Optional Instrumentation recording per-stage timings and counters
+        self.instrumentation = instrumentation
+        
+        # Optional Workspace: stages reuse its buffers, so each image
+        # overwrites the arrays returned for the previous one
+        self.workspace = workspace
+        
+        # Watershed implementation, one of WATERSHED_BACKENDS
+        self.watershed_backend = watershed_backend
+        
+        # How image files are decoded, one of DECODE_MODES
+        self.decode = decode
+        
+        # Memoized stages for process_incremental: stage -> (key, version, output)
+        self._stage_memo = {}
+        self._stage_versions = itertools.count()
+        self.recomputed = []
+    
+    @instrumented
+    def load_image(self, image_path):
+        """Load and preprocess the MRI image
+        
+        With decode='fast' the file is read as grayscale and original_image
+        is None.
+        """
+        if _fast_decode(self.decode):
+            self.original_image = None
+            self.gray_image = load_gray_image(image_path, self.native_resolution, self.workspace,
+                                              self.decode)
+            return self.gray_image
+        
+        # Read image
+        self.original_image = cv2.imread(image_path)
+        if self.original_image is None:
+            raise ValueError("Could not load image")
+            
+        # Resize to 200x200 (same as MATLAB)
+        if not self.native_resolution:
+            self.original_image = cv2.resize(
+                self.original_image, IMAGE_SIZE,
+                dst=_buffer(self.workspace, 'color', IMAGE_SIZE[::-1] + self.original_image.shape[2:])
+            )
+        
+        # Convert to grayscale
+        self.gray_image = cv2.cvtColor(
+            self.original_image, cv2.COLOR_BGR2GRAY,
+            dst=_buffer(self.workspace, 'gray', self.original_image.shape[:2])
+        )
+        
+        return self.gray_image
+    
+    @instrumented
+    def create_binary_image(self, threshold=0.6):
+        """Create binary image using threshold (equivalent to imbinarize)"""
+        if self.gray_image is None:
+            raise ValueError("No image loaded")
+        
+        self.binary_image = binarize(self.gray_image, threshold,
+                                     out=_buffer(self.workspace, 'binary', self.gray_image.shape))
+        
+        return self.binary_image
+    
+    @instrumented
+    def watershed_segmentation(self):
+        """Apply Sobel filter and watershed segmentation"""
+        if self.binary_image is None:
+            raise ValueError("Binary image not created")
+        
+        self.watershed_image = watershed_image(self.binary_image, self.workspace,
+                                               self.watershed_backend)
+        
+        return self.watershed_image
+    
+    @instrumented
+    def morphological_processing(self, kernel_size=KERNEL_SIZE[0]):
+        """Apply morphological operations to detect tumor (white areas)"""
+        if self.binary_image is None:
+            raise ValueError("Binary image not created")
+        
+        self.morphology_tumor = morphology_tumor_mask(self.binary_image, self.workspace,
+                                                      kernel=disk_kernel(kernel_size))
+        
+        return self.morphology_tumor
+    
+    @instrumented
+    def threshold_segmentation(self, min_area=50):
+        """Apply Otsu thresholding for segmentation"""
+        if self.gray_image is None:
+            raise ValueError("No image loaded")
+        
+        self.threshold_image = otsu_segmentation(self.gray_image, min_area=min_area,
+                                                 instrumentation=self.instrumentation,
+                                                 workspace=self.workspace)
+        
+        return self.threshold_image
+    
+    @instrumented
+    def calculate_tumor_area(self):
+        """Calculate tumor area and classify"""
+        if self.morphology_tumor is None:
+            raise ValueError("Morphological processing not completed")
+            
+        # One labeling pass gives both the total area and per-lesion stats
+        self.tumor_regions = tumor_regions(self.morphology_tumor, *self.effective_pixel_size(),
+                                           workspace=self.workspace)
+        if self.instrumentation is not None:
+            self.instrumentation.count('tumor_regions', len(self.tumor_regions))
+            
+        return tumor_area(self.morphology_tumor, regions=self.tumor_regions)
+    
+    def effective_pixel_size(self):
+        """Pixel width/height (cm) for the currently loaded image"""
+        _check_spacing(self.native_resolution, self.pixel_spacing)
+        if not self.native_resolution or self.gray_image is None:
+            return self.pixel_w, self.pixel_h
+        return native_pixel_size(self.gray_image.shape, self.pixel_w, self.pixel_h,
+                                 self.pixel_spacing)
+    
+    def process_complete_pipeline(self, image_path, outputs=None):
+        """Run the complete tumor detection pipeline
+        
+        outputs selects the result keys to compute (e.g. "area+category");
+        stages that none of them depend on are skipped. With instrumentation
+        attached, the per-stage timings and counters are added under
+        'instrumentation'.
+        """
+        outputs = parse_outputs(outputs)
+        stages = resolve_stages(outputs)
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+        self._stage_memo.clear()
+        
+        if self.cache is not None:
+            key = cache_key(_image_bytes(image_path),
+                            pipeline_params(pixel_w=self.pixel_w, pixel_h=self.pixel_h,
+                                            native=self.native_resolution,
+                                            pixel_spacing=self.pixel_spacing,
+                                            watershed_backend=self.watershed_backend,
+                                            decode=self.decode), outputs)
+            cached = self.cache.get(key)
+            if self.instrumentation is not None:
+                self.instrumentation.count('cache_hits' if cached is not None else 'cache_misses')
+            if cached is not None:
+                self._restore_state(cached)
+                if outputs == ALL_OUTPUTS:
+                    self._remember_stages(image_path, cached['tumor_area_cm2'], cached['category'])
+                return self._with_instrumentation(cached)
+                
+        # Clear results from a previous image so skipped stages never leak
+        self.binary_image = None
+        self.watershed_image = None
+        self.morphology_tumor = None
+        self.threshold_image = None
+        self.tumor_regions = None
+        tumor_area, category = None, None
+        
+        # Load image
+        self.load_image(image_path)
+        
+        # Create binary image
+        if 'binary' in stages:
+            self.create_binary_image()
+        
+        # Watershed segmentation
+        if 'watershed' in stages:
+            self.watershed_segmentation()
+        
+        # Morphological processing (main tumor detection)
+        if 'morphology_tumor' in stages:
+            self.morphology_tumor = self.morphological_processing()
+        
+        # Threshold segmentation
+        if 'threshold' in stages:
+            self.threshold_segmentation()
+        
+        # Calculate tumor area
+        if 'tumor_area' in stages or 'regions' in stages:
+            tumor_area, category = self.calculate_tumor_area()
+        
+        results = {
+            'original': self.gray_image,
+            'binary': self.binary_image,
+            'watershed': self.watershed_image,
+            'morphology_tumor': self.morphology_tumor,
+            'threshold': self.threshold_image,
+            'tumor_area_cm2': tumor_area,
+            'category': category,
+            'regions': self.tumor_regions
+        }
+        results = {key: results[key] for key in outputs}
+        
+        if self.cache is not None:
+            self.cache.put(key, results)
+        
+        # Every stage ran with the default parameters, so slider changes
+        # from here on only rerun what they affect
+        if outputs == ALL_OUTPUTS:
+            self._remember_stages(image_path, tumor_area, category)
+        
+        return self._with_instrumentation(results)
+    
+    def process_incremental(self, image_path, threshold=DEFAULT_TUNING['threshold'],
+                            kernel_size=DEFAULT_TUNING['kernel_size'],
+                            min_area=DEFAULT_TUNING['min_area']):
+        """Run every stage, reusing stage outputs whose inputs have not changed
+        
+        Each stage's output is memoized under its own parameters and the
+        versions of the stages it reads (TUNABLE_STAGES). Moving the
+        threshold reruns binarization and what follows without reloading
+        the image; changing min_area reruns only the Otsu segmentation. The
+        stages that ran are listed in self.recomputed. Returns the same dict
+        as process_complete_pipeline (the result cache is not used).
+        """
+        params = {'image_path': image_path, 'threshold': threshold,
+                  'kernel_size': kernel_size, 'min_area': min_area}
+        # Thresholds between the same two gray levels give the same binary image
+        keys = dict(params, threshold=binary_cutoff(threshold))
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+        self.recomputed = []
+        
+        for stage, names, inputs in TUNABLE_STAGES:
+            key = (tuple(keys[name] for name in names),
+                   tuple(self._stage_memo[name][1] for name in inputs))
+            memo = self._stage_memo.get(stage)
+            if memo is not None and memo[0] == key:
+                continue
+            
+            # Forget the old output first, so a stage interrupted by an
+            # exception is never mistaken for an up-to-date one
+            self._stage_memo.pop(stage, None)
+            output = getattr(self, stage)(*(params[name] for name in names))
+            self._stage_memo[stage] = (key, next(self._stage_versions), output)
+            self.recomputed.append(stage)
+        
+        tumor_area, category = self._stage_memo['calculate_tumor_area'][2]
+        return self._with_instrumentation({
+            'original': self.gray_image,
+            'binary': self.binary_image,
+            'watershed': self.watershed_image,
+            'morphology_tumor': self.morphology_tumor,
+            'threshold': self.threshold_image,
+            'tumor_area_cm2': tumor_area,
+            'category': category,
+            'regions': self.tumor_regions
+        })
+    
+    def _remember_stages(self, image_path, tumor_area, category):
+        """Memoize the current per-image state as stage outputs for the default parameters"""
+        params = dict(DEFAULT_TUNING, image_path=image_path,
+                      threshold=binary_cutoff(DEFAULT_TUNING['threshold']))
+        outputs = {'calculate_tumor_area': (tumor_area, category)}
+        
+        self._stage_memo.clear()
+        for stage, names, inputs in TUNABLE_STAGES:
+            key = (tuple(params[name] for name in names),
+                   tuple(self._stage_memo[name][1] for name in inputs))
+            self._stage_memo[stage] = (key, next(self._stage_versions), outputs.get(stage))
+    
+    def _with_instrumentation(self, results):
+        """Add the instrumentation snapshot to a results dict, if enabled"""
+        if self.instrumentation is not None:
+            results = dict(results, instrumentation=self.instrumentation.snapshot())
+        return results
+    
+    def _restore_state(self, results):
+        """Set per-image state from cached results, as if the pipeline had run"""
+        self.original_image = None
+        self.gray_image = results.get('original')
+        self.binary_image = results.get('binary')
+        self.watershed_image = results.get('watershed')
+        self.morphology_tumor = results.get('morphology_tumor')
+        self.threshold_image = results.get('threshold')
+        self.tumor_regions = results.get('regions')
+    
+    def load_images(self, image_paths):
+        """Load and preprocess many MRI images into one (N, 200, 200) stack"""
+        gray_stack = np.empty((len(image_paths),) + IMAGE_SIZE[::-1], dtype=np.uint8)
+        
+        for i, image_path in enumerate(image_paths):
+            gray_stack[i] = load_gray_image(image_path, decode=self.decode)
+        
+        return gray_stack
+    
+    def create_binary_batch(self, gray_stack, threshold=0.6):
+        """Binary images for a whole (N, H, W) stack in one comparison"""
+        return binarize(gray_stack, threshold)
+    
+    def threshold_segmentation_batch(self, gray_stack, min_area=50):
+        """Otsu thresholding for a whole stack (thresholds computed vectorized)"""
+        thresholds = otsu_thresholds(gray_stack)
+        otsu_stack = (gray_stack > thresholds[:, None, None]).astype(np.uint8) * 255
+        
+        # Small object removal is inherently per image
+        for i in range(otsu_stack.shape[0]):
+            otsu_stack[i] = remove_small_objects(otsu_stack[i], min_area=min_area)
+            
+        return otsu_stack
+    
+    def calculate_tumor_area_batch(self, tumor_stack):
+        """Tumor areas (cm²) and categories for a stack of tumor masks"""
+        # Every foreground pixel belongs to some non-background component
+        tumor_pixels = np.count_nonzero(tumor_stack.reshape(tumor_stack.shape[0], -1), axis=1)
+        tumor_cm2 = tumor_pixels * self.pixel_w * self.pixel_h
+        categories = [classify_tumor_area(area) for area in tumor_cm2]
+        
+        return tumor_cm2, categories
+    
+    def process_batch(self, images, outputs=None):
+        """Run the pipeline on many images at once
+        
+        images is either a list of file paths or a stacked (N, 200, 200)
+        uint8 grayscale array. Per-image state on the detector is untouched.
+        outputs selects result keys the same way as process_complete_pipeline.
+        """
+        outputs = parse_outputs(outputs)
+        stages = resolve_stages(outputs)
+        results = dict.fromkeys(ALL_OUTPUTS)
+        
+        if isinstance(images, np.ndarray):
+            if images.ndim != 3 or images.dtype != np.uint8:
+                raise ValueError("Expected a (N, H, W) uint8 grayscale stack")
+            gray_stack = images
+        else:
+            gray_stack = self.load_images(list(images))
+        results['original'] = gray_stack
+        
+        if 'binary' in stages:
+            results['binary'] = self.create_binary_batch(gray_stack)
+            
+        # Watershed and morphology are inherently per image
+        for stage, function in (
+                ('watershed', functools.partial(watershed_image, backend=self.watershed_backend)),
+                ('morphology_tumor', morphology_tumor_mask)):
+            if stage in stages:
+                stack = np.empty_like(results['binary'])
+                for i in range(stack.shape[0]):
+                    stack[i] = function(results['binary'][i])
+                results[stage] = stack
+                
+        if 'threshold' in stages:
+            results['threshold'] = self.threshold_segmentation_batch(gray_stack)
+            
+        if 'tumor_area' in stages:
+            results['tumor_area_cm2'], results['category'] = \
+                self.calculate_tumor_area_batch(results['morphology_tumor'])
+                
+        if 'regions' in stages:
+            results['regions'] = [tumor_regions(mask, self.pixel_w, self.pixel_h)
+                                  for mask in results['morphology_tumor']]
+                
+        return {key: results[key] for key in outputs}
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Load generator for brain_tumor_service.py
+
+Opens --concurrency keep-alive connections to a running service and posts
+the given images round-robin, then reports latency percentiles,
+throughput and how many requests were rejected with 503.
+
+Usage:
+    python brain_tumor_loadgen.py mri_sample_*.jpg --port 8765 -n 500 -c 32
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+import time
+
+import numpy as np
+
+from brain_tumor_service import DEFAULT_PORT
+
+
+async def post_image(reader, writer, host, data, mask=False):
+    """POST one image on an open connection; returns (status, headers, payload)"""
+    path = '/analyze?mask=1' if mask else '/analyze'
+    writer.write((f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Type: application/octet-stream\r\n"
+                  f"Content-Length: {len(data)}\r\n\r\n").encode('latin-1') + data)
+    await writer.drain()
+    
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, json.loads(body) if body else None
+
+
+async def run_load(images, host='127.0.0.1', port=DEFAULT_PORT, requests=100, concurrency=8,
+                   mask=False):
+    """Post requests images over concurrency connections and summarize the results
+    
+    images is a list of encoded image bytes, sent round-robin. Returns a
+    report dict; report['responses'] lists (request index, status, payload).
+    """
+    counter = itertools.count()
+    latencies, responses = [], []
+    
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while True:
+                index = next(counter)
+                if index >= requests:
+                    return
+                start = time.perf_counter()
+                status, headers, payload = await post_image(
+                    reader, writer, host, images[index % len(images)], mask)
+                latencies.append(time.perf_counter() - start)
+                responses.append((index, status, payload))
+        finally:
+            writer.close()
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    
+    statuses = [status for _, status, _ in responses]
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'requests': len(responses),
+        'ok': statuses.count(200),
+        'rejected': statuses.count(503),
+        'errors': len(statuses) - statuses.count(200) - statuses.count(503),
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0.0,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0.0,
+        'throughput_per_s': len(responses) / elapsed if elapsed > 0 else float('inf'),
+        'responses': sorted(responses, key=lambda r: r[0])
+    }
+
+
+def main(argv=None):
+    """Command line entry point for the load generator"""
+    parser = argparse.ArgumentParser(description="Load generator for the detection service")
+    parser.add_argument('images', nargs='+', help="Image files to post (round-robin)")
+    parser.add_argument('--host', default='127.0.0.1', help="Service host")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Service port")
+    parser.add_argument('-n', '--requests', type=int, default=200, help="Total requests")
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help="Open connections")
+    parser.add_argument('--mask', action='store_true', help="Ask for tumor masks too")
+    args = parser.parse_args(argv)
+    
+    images = []
+    for path in args.images:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    
+    report = asyncio.run(run_load(images, args.host, args.port, args.requests,
+                                  args.concurrency, args.mask))
+    
+    print(f"Requests: {report['requests']} ({report['ok']} ok, {report['rejected']} rejected, "
+          f"{report['errors']} errors)")
+    print(f"Latency: p50 {report['p50_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+    print(f"Throughput: {report['throughput_per_s']:.1f} requests/s")
+    return 0 if report['errors'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Fast result montages and HTML report for batch runs
+
+Each image's grayscale, binary, watershed, tumor and threshold panels are
+tiled straight into one OpenCV canvas with titles and the area/category
+drawn as text, then PNG-encoded. That is a few milliseconds per image
+instead of a matplotlib figure and savefig, so montages are cheap enough
+to render for every image in parallel workers. An index.html lists every
+result with its montage. Matplotlib stays for the interactive viewer and
+the GUI.
+
+Usage:
+    python brain_tumor_report.py scans/ -o report/ --workers 8
+"""
+
+import argparse
+import html
+import os
+import sys
+from functools import partial
+
+import cv2
+import numpy as np
+
+from brain_tumor_batch import find_images, scan_images
+from brain_tumor_core import run_pipeline
+
+# (results key, title, OpenCV colormap or None for grayscale), in grid order
+PANELS = (
+    ('original', 'Original', None),
+    ('binary', 'Binary', None),
+    ('watershed', 'Watershed', cv2.COLORMAP_VIRIDIS),
+    ('morphology_tumor', 'Tumor (White)', None),
+    ('threshold', 'Threshold', None),
+)
+
+GRID_COLUMNS = 3
+TITLE_HEIGHT = 28
+HEADER_HEIGHT = 40
+MARGIN = 12
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+# Montages are mostly flat regions, so fast compression without row filters still
+# compresses well and encodes about 3x faster than the default settings
+PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FILTER_NONE]
+
+
+def render_panel(image, colormap=None, scale=2):
+    """BGR uint8 panel scaled to its min/max like imshow, enlarged by an integer factor"""
+    image = cv2.normalize(np.asarray(image), None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    if scale != 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    if colormap is None:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return cv2.applyColorMap(image, colormap)
+
+
+def _put_text(canvas, text, origin, size=0.6, thickness=1):
+    cv2.putText(canvas, text, origin, FONT, size, (0, 0, 0), thickness, cv2.LINE_AA)
+
+
+def _summary_lines(results):
+    area = results.get('tumor_area_cm2')
+    category = results.get('category')
+    return [f"Area: {area:.4f} cm^2" if area is not None else "Area: -",
+            f"Type: {category}" if category is not None else "Type: -"]
+
+
+def render_montage(results, title='', scale=2):
+    """One BGR canvas with every result panel in a 2x3 grid and the area/category as text
+    
+    Panels missing from results (stages that were skipped) are left blank.
+    """
+    shape = next(np.shape(results[key]) for key, _, _ in PANELS if results.get(key) is not None)
+    panel_h, panel_w = shape[0] * scale, shape[1] * scale
+    cell_h, cell_w = TITLE_HEIGHT + panel_h, panel_w
+    rows = -(-(len(PANELS) + 1) // GRID_COLUMNS)
+    
+    canvas = np.full((HEADER_HEIGHT + rows * (cell_h + MARGIN) + MARGIN,
+                      GRID_COLUMNS * (cell_w + MARGIN) + MARGIN, 3), 255, dtype=np.uint8)
+    _put_text(canvas, title, (MARGIN, HEADER_HEIGHT - 14), size=0.7, thickness=2)
+    
+    def cell_origin(index):
+        row, column = divmod(index, GRID_COLUMNS)
+        return HEADER_HEIGHT + row * (cell_h + MARGIN), MARGIN + column * (cell_w + MARGIN)
+    
+    for index, (key, panel_title, colormap) in enumerate(PANELS):
+        y, x = cell_origin(index)
+        _put_text(canvas, panel_title, (x, y + TITLE_HEIGHT - 9))
+        if results.get(key) is not None:
+            canvas[y + TITLE_HEIGHT:y + cell_h, x:x + cell_w] = render_panel(results[key], colormap, scale)
+    
+    # Results text in the last cell
+    y, x = cell_origin(len(PANELS))
+    for i, line in enumerate(_summary_lines(results)):
+        _put_text(canvas, line, (x, y + TITLE_HEIGHT + panel_h // 3 + 30 * i), size=0.65)
+    
+    return canvas
+
+
+def montage_name(image_path, root=None):
+    """File name of an image's montage, e.g. result_mri_sample_1.png
+    
+    With root, the name comes from the path relative to root with the
+    separators replaced (a/scan.png -> result_a__scan.png), so images with
+    the same name in different subfolders do not overwrite each other.
+    """
+    name = os.path.relpath(image_path, root) if root is not None else os.path.basename(image_path)
+    name = os.path.splitext(name)[0].replace(os.sep, '__')
+    if os.altsep:
+        name = name.replace(os.altsep, '__')
+    return f"result_{name}.png"
+
+
+def save_montage(image_path, output_dir='.', scale=2, root=None):
+    """Batch worker: run the pipeline on one image and write its montage
+    
+    Returns the scalars and the montage path, like the other scan_images
+    workers. root is the input directory (see montage_name).
+    """
+    results = run_pipeline(image_path).as_dict()
+    output = os.path.join(output_dir, montage_name(image_path, root))
+    
+    ok, png = cv2.imencode('.png', render_montage(results, f"Results for {image_path}", scale),
+                           PNG_PARAMS)
+    if not ok:
+        raise ValueError(f"Could not encode montage for {image_path}")
+    with open(output, 'wb') as f:
+        f.write(png.tobytes())
+    
+    return {
+        'tumor_area_cm2': float(results['tumor_area_cm2']),
+        'category': results['category'],
+        'output': output
+    }
+
+
+def write_index(records, index_path, title="Brain Tumor Detection Results"):
+    """Write an HTML page listing every record with a link to its montage"""
+    base = os.path.dirname(os.path.abspath(index_path))
+    rows = []
+    for record in records:
+        path = html.escape(str(record['path']))
+        if record.get('error'):
+            rows.append(f"<tr><td>{record['index'] + 1}</td><td>{path}</td>"
+                        f"<td colspan=\"3\" class=\"error\">{html.escape(record['error'])}</td></tr>")
+            continue
+        href = html.escape(os.path.relpath(os.path.abspath(record['output']), base).replace(os.sep, '/'))
+        rows.append(f"<tr><td>{record['index'] + 1}</td><td>{path}</td>"
+                    f"<td>{record['tumor_area_cm2']:.4f}</td><td>{html.escape(record['category'])}</td>"
+                    f"<td><a href=\"{href}\"><img src=\"{href}\" loading=\"lazy\" width=\"300\"></a></td></tr>")
+    
+    page = f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; }}
+td, th {{ border-bottom: 1px solid #ddd; padding: 4px 12px; text-align: left; vertical-align: middle; }}
+.error {{ color: #b00; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<table>
+<tr><th>#</th><th>Image</th><th>Area (cm&sup2;)</th><th>Category</th><th>Montage</th></tr>
+{chr(10).join(rows)}
+</table>
+</body>
+</html>
+"""
+    with open(index_path, 'w', encoding='utf-8') as f:
+        f.write(page)
+
+
+def build_report(image_paths, output_dir, workers=None, threads=False, scale=2, on_record=None,
+                 root=None):
+    """Render a montage per image in parallel workers and write output_dir/index.html
+    
+    Records arrive in input order; on_record(record) is called for each.
+    Montages are named by their path relative to root (see montage_name).
+    Returns the records.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    records = []
+    for record in scan_images(image_paths, workers=workers, chunksize=1, threads=threads,
+                              worker=partial(save_montage, output_dir=output_dir, scale=scale,
+                                             root=root)):
+        records.append(record)
+        if on_record is not None:
+            on_record(record)
+    
+    write_index(records, os.path.join(output_dir, 'index.html'))
+    return records
+
+
+def main(argv=None):
+    """Command line entry point for the report renderer"""
+    parser = argparse.ArgumentParser(description="Render result montages and an HTML index")
+    parser.add_argument('directory', help="Directory containing MRI images")
+    parser.add_argument('-o', '--output', default='report', help="Output directory")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all cores)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Search subdirectories too")
+    parser.add_argument('-t', '--threads', action='store_true',
+                        help="Use a thread pool instead of processes")
+    parser.add_argument('--scale', type=int, default=2, help="Panel enlargement factor")
+    args = parser.parse_args(argv)
+    
+    image_files = find_images(args.directory, recursive=args.recursive, exclude=[args.output])
+    if not image_files:
+        print("No image files found")
+        return 1
+    
+    def on_record(record):
+        if record['error']:
+            print(f"   Error processing {record['path']}: {record['error']}")
+    
+    records = build_report(image_files, args.output, args.workers, args.threads, args.scale, on_record,
+                           root=args.directory)
+    errors = sum(1 for record in records if record['error'])
+    print(f"Rendered {len(records) - errors} montages ({errors} errors), "
+          f"index at {os.path.join(args.output, 'index.html')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
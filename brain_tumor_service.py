@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Local HTTP inference service
+
+Keeps the detector warm in one long-running process so integrations do not
+pay Python startup and imports per image. Concurrent uploads are collected
+into micro-batches (up to --max-batch images or --max-wait-ms, whichever
+comes first) and run on an executor, so the event loop only does I/O.
+When more than --max-queue images are waiting the service answers 503
+with a Retry-After hint instead of queueing without bound.
+
+Endpoints:
+    POST /analyze[?mask=1]  body: an encoded image (PNG, JPEG, BMP, TIFF)
+        -> {"tumor_area_cm2": ..., "category": ..., "mask_png": "<base64>"}
+    GET /health
+        -> {"queue_depth": ..., "batches": ..., "images": ..., "rejected": ...}
+
+Usage:
+    python brain_tumor_service.py --port 8765 --max-batch 16 --max-wait-ms 5
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+
+from brain_tumor_core import BrainTumorDetector, decode_gray_image
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 64 * 2**20
+
+# One detector per worker process (the batch methods keep no per-image state)
+_detector = None
+
+
+def analyze_batch(payloads, masks):
+    """Decode uploaded images and run the batch pipeline on them at once
+    
+    masks[i] asks for the tumor mask of payloads[i]. Returns one record per
+    payload, {'tumor_area_cm2', 'category'[, 'mask_png']} or {'error': ...}
+    for an image that could not be decoded or processed. One bad image
+    never fails the others in its batch: if the batch run fails, the images
+    are run one at a time to find it.
+    """
+    global _detector
+    if _detector is None:
+        _detector = BrainTumorDetector()
+    
+    records = [None] * len(payloads)
+    grays, decoded = [], []
+    for i, data in enumerate(payloads):
+        try:
+            grays.append(decode_gray_image(data))
+            decoded.append(i)
+        except ValueError as e:
+            records[i] = {'error': str(e)}
+        except Exception as e:
+            records[i] = {'error': f"{type(e).__name__}: {e}"}
+    
+    if grays:
+        outputs = 'area+category+tumor' if any(masks) else 'area+category'
+        try:
+            batches = [(decoded, _detector.process_batch(np.stack(grays), outputs))]
+        except Exception:
+            batches = []
+            for i, gray in zip(decoded, grays):
+                try:
+                    batches.append(([i], _detector.process_batch(gray[np.newaxis], outputs)))
+                except Exception as e:
+                    records[i] = {'error': f"{type(e).__name__}: {e}"}
+        
+        for indices, results in batches:
+            for j, i in enumerate(indices):
+                try:
+                    records[i] = _result_record(results, j, masks[i])
+                except Exception as e:
+                    records[i] = {'error': f"{type(e).__name__}: {e}"}
+    
+    return records
+
+
+def _result_record(results, j, mask):
+    """Response record for image j of a process_batch result"""
+    record = {'tumor_area_cm2': float(results['tumor_area_cm2'][j]),
+              'category': results['category'][j]}
+    if mask:
+        ok, png = cv2.imencode('.png', results['morphology_tumor'][j])
+        if not ok:
+            raise ValueError("Could not encode tumor mask")
+        record['mask_png'] = base64.b64encode(png.tobytes()).decode('ascii')
+    return record
+
+
+class ServiceBusy(Exception):
+    """The request queue is full; retry_after is a hint in seconds"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Queue full, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class MicroBatcher:
+    """Collects single-image requests into batches run on an executor
+    
+    Up to max_concurrent batches run at once; meanwhile new requests wait
+    in a queue of at most max_queue images, beyond which submit raises
+    ServiceBusy.
+    """
+    
+    def __init__(self, executor, process=analyze_batch, max_batch=16, max_wait_ms=5.0,
+                 max_queue=64, max_concurrent=1):
+        self.executor = executor
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent = max_concurrent
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks = set()
+        
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.batch_seconds = None  # Moving average of batch run time
+    
+    async def submit(self, data, mask=False):
+        """Queue one image and wait for its record"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((data, mask, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ServiceBusy(self.retry_after()) from None
+        return await future
+    
+    def retry_after(self):
+        """Seconds until the current queue has probably drained"""
+        batch_seconds = self.batch_seconds if self.batch_seconds is not None else 1.0
+        batches = self.queue.qsize() / self.max_batch / self.max_concurrent
+        return max(1, math.ceil(batches * batch_seconds))
+    
+    async def _collect(self):
+        """Wait for one request, then gather more until the batch is full or max_wait passes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def run(self):
+        """Batching loop; runs until cancelled"""
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+    
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            start = loop.time()
+            records = await loop.run_in_executor(
+                self.executor, self.process,
+                [data for data, _, _ in batch], [mask for _, mask, _ in batch]
+            )
+            elapsed = loop.time() - start
+            
+            self.batches += 1
+            self.images += len(batch)
+            if self.batch_seconds is None:
+                self.batch_seconds = elapsed
+            else:
+                self.batch_seconds = 0.8 * self.batch_seconds + 0.2 * elapsed
+            
+            for (_, _, future), record in zip(batch, records):
+                if not future.done():
+                    future.set_result(record)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+    
+    def stats(self):
+        return {'queue_depth': self.queue.qsize(), 'batches': self.batches,
+                'images': self.images, 'rejected': self.rejected}
+
+
+class HTTPError(Exception):
+    """A request that gets an error response"""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader):
+    """(method, path, query, headers, body) of the next request, or None at EOF"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    
+    try:
+        method, target, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Malformed request line") from None
+    
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    
+    try:
+        length = int(headers.get('content-length', 0) or 0)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length") from None
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Image too large")
+    body = await reader.readexactly(length) if length else b''
+    
+    url = urlsplit(target)
+    return method.upper(), url.path, parse_qs(url.query), headers, body
+
+
+def write_response(writer, status, payload, headers=None, keep_alive=True):
+    """Send a JSON response"""
+    body = json.dumps(payload).encode()
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+             "Content-Type: application/json",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+
+class DetectionService:
+    """asyncio HTTP front end for a MicroBatcher"""
+    
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, max_batch=16, max_wait_ms=5.0,
+                 max_queue=64, workers=None, processes=False):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(self.workers)
+        self.batcher_options = {'max_batch': max_batch, 'max_wait_ms': max_wait_ms,
+                                'max_queue': max_queue, 'max_concurrent': self.workers}
+        self.batcher = None
+        self.server = None
+        self._batch_task = None
+    
+    async def start(self):
+        """Start listening; with port=0 the chosen port is stored in self.port"""
+        self.batcher = MicroBatcher(self.executor, **self.batcher_options)
+        self._batch_task = asyncio.create_task(self.batcher.run())
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self._batch_task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one (keep-alive) connection"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as e:
+                    write_response(writer, e.status, {'error': str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                
+                method, path, query, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, payload, extra = await self.route(method, path, query, body)
+                write_response(writer, status, payload, extra, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def route(self, method, path, query, body):
+        """(status, payload, extra headers) for one request"""
+        if path == '/health' and method == 'GET':
+            return HTTPStatus.OK, self.batcher.stats(), None
+        
+        if path != '/analyze':
+            return HTTPStatus.NOT_FOUND, {'error': f"Unknown path: {path}"}, None
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': "Use POST"}, {'Allow': 'POST'}
+        
+        mask = query.get('mask', ['0'])[0].lower() in ('1', 'true', 'yes')
+        try:
+            record = await self.batcher.submit(body, mask)
+        except ServiceBusy as e:
+            return (HTTPStatus.SERVICE_UNAVAILABLE, {'error': str(e)},
+                    {'Retry-After': str(e.retry_after)})
+        except Exception as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}, None
+        
+        if 'error' in record:
+            return HTTPStatus.BAD_REQUEST, record, None
+        return HTTPStatus.OK, record, None
+
+
+async def serve(service):
+    await service.start()
+    print(f"Listening on http://{service.host}:{service.port} "
+          f"({service.workers} workers, batches of up to {service.batcher.max_batch})")
+    async with service.server:
+        await service.server.serve_forever()
+
+
+def main(argv=None):
+    """Command line entry point for the service"""
+    parser = argparse.ArgumentParser(description="Local brain tumor detection HTTP service")
+    parser.add_argument('--host', default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument('--max-batch', type=int, default=16, help="Largest micro-batch")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help="Longest time a request waits for its batch to fill")
+    parser.add_argument('--max-queue', type=int, default=64,
+                        help="Waiting images beyond which requests get 503 + Retry-After")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Batches run at once (default: all cores)")
+    parser.add_argument('--processes', action='store_true',
+                        help="Run batches in worker processes instead of threads")
+    args = parser.parse_args(argv)
+    
+    service = DetectionService(args.host, args.port, args.max_batch, args.max_wait_ms,
+                               args.max_queue, args.workers, args.processes)
+    try:
+        asyncio.run(serve(service))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Parameter sweeps over binary threshold, structuring element and min_area
+
+Each image is decoded and converted to grayscale once. Every threshold is
+applied in one broadcast comparison (thresholds that round to the same
+gray level share a binary image), each binary image is reused for every
+kernel size, and the Otsu mask is labeled once for all min_area values.
+The result is tumor area as a function of (threshold, kernel size), Otsu
+area as a function of min_area, and Dice/IoU for both wherever a
+ground-truth mask is available.
+
+Usage:
+    python brain_tumor_sweep.py scans/ -o sweep.csv --plot sweep.png
+    python brain_tumor_sweep.py scans/ --masks masks/ --thresholds 0.5 0.55 0.6 --kernels 7 9 11
+"""
+
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from brain_tumor_batch import ResultWriter, find_images, map_threaded
+from brain_tumor_components import reconstruct_by_dilation, reconstruct_by_erosion
+from brain_tumor_core import (
+    PIXEL_H, PIXEL_W, binary_cutoff, disk_kernel, load_gray_image, native_pixel_size
+)
+
+DEFAULT_THRESHOLDS = tuple(np.round(np.arange(0.3, 0.901, 0.05), 2))
+DEFAULT_KERNEL_SIZES = (3, 5, 7, 9, 11, 13, 15, 17, 21)
+DEFAULT_MIN_AREAS = (0, 10, 25, 50, 100, 200, 400)
+
+SWEEP_FIELDS = ['path', 'stage', 'threshold', 'kernel_size', 'min_area',
+                'area_cm2', 'dice', 'iou']
+
+
+def _overlap(intersection, pixels, truth_pixels):
+    """Dice and IoU from overlap counts; two empty masks agree perfectly"""
+    sizes = pixels + truth_pixels
+    union = sizes - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dice = np.where(sizes > 0, 2 * intersection / sizes, 1.0)
+        iou = np.where(union > 0, intersection / union, 1.0)
+    return dice, iou
+
+
+def sweep_tumor(gray_image, thresholds, kernel_sizes, truth=None):
+    """Tumor pixels for every (threshold, kernel size), and Dice/IoU against truth
+    
+    Equivalent to morphology_tumor_mask(binarize(gray, t), kernel=disk_kernel(k))
+    for each pair. The opening is replaced by its erosion half: a component
+    of the binary image contains an opened pixel exactly when it contains
+    an eroded one, which is all the reconstruction looks at. Kernel sizes
+    are nested disks, so once an erosion is empty every larger kernel
+    gives an empty mask as well. Returns (pixels, dice, iou) arrays of
+    shape (T, K); dice and iou are None without a truth mask.
+    """
+    cutoffs = np.array([binary_cutoff(float(t)) for t in thresholds])
+    levels, level_index = np.unique(cutoffs, return_inverse=True)
+    
+    # Every distinct threshold in one broadcast comparison
+    binaries = (gray_image[None] >= levels[:, None, None]).view(np.uint8)
+    binaries *= 255
+    
+    order = np.argsort(kernel_sizes)
+    kernels = [disk_kernel(int(kernel_sizes[k])) for k in order]
+    shape = gray_image.shape
+    seeds = np.empty(shape, dtype=np.uint8)
+    flood = np.empty((shape[0] + 2, shape[1] + 2), dtype=np.uint8)
+    eroded = np.empty(shape, dtype=np.uint8)
+    dilated = np.empty(shape, dtype=np.uint8)
+    reconstructed = np.empty(shape, dtype=np.uint8)
+    tumor = np.empty(shape, dtype=np.uint8)
+    truth_image = truth.view(np.uint8) * 255 if truth is not None else None
+    
+    pixels = np.zeros((len(levels), len(kernel_sizes)), dtype=np.int64)
+    intersection = np.zeros_like(pixels)
+    for i, binary in enumerate(binaries):
+        for k, kernel in zip(order, kernels):
+            cv2.erode(binary, kernel, dst=eroded)
+            if not cv2.countNonZero(eroded):
+                break
+            reconstruct_by_dilation(eroded, binary, seeds=seeds, flood=flood, out=reconstructed)
+            cv2.dilate(reconstructed, kernel, dst=dilated)
+            reconstruct_by_erosion(dilated, reconstructed, seeds=seeds, flood=flood, out=tumor)
+            
+            pixels[i, k] = cv2.countNonZero(tumor)
+            if truth_image is not None:
+                overlap = cv2.bitwise_and(tumor, truth_image, dst=eroded)
+                intersection[i, k] = cv2.countNonZero(overlap)
+    
+    pixels = pixels[level_index]
+    if truth is None:
+        return pixels, None, None
+    dice, iou = _overlap(intersection[level_index], pixels, np.count_nonzero(truth))
+    return pixels, dice, iou
+
+
+def sweep_otsu(gray_image, min_areas, truth=None):
+    """Otsu foreground pixels for every min_area, and Dice/IoU against truth
+    
+    The Otsu mask is labeled once; removing components below min_area
+    then only needs their areas. Returns (pixels, dice, iou) arrays of
+    shape (M,); dice and iou are None without a truth mask.
+    """
+    _, otsu_image = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        otsu_image, connectivity=8, ltype=cv2.CV_32S
+    )
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    kept = areas[None, :] >= np.asarray(min_areas)[:, None]
+    pixels = kept @ areas
+    
+    if truth is None:
+        return pixels, None, None
+    
+    # Truth pixels inside each component
+    inside = np.bincount(labels[truth], minlength=num_labels)[1:]
+    dice, iou = _overlap(kept @ inside, pixels, np.count_nonzero(truth))
+    return pixels, dice, iou
+
+
+def sweep_image(gray_image, thresholds=DEFAULT_THRESHOLDS, kernel_sizes=DEFAULT_KERNEL_SIZES,
+                min_areas=DEFAULT_MIN_AREAS, truth=None, pixel_w=PIXEL_W, pixel_h=PIXEL_H):
+    """Areas (cm²) over the whole parameter grid for one grayscale image
+    
+    truth is an optional boolean ground-truth mask of the image's shape.
+    Returns a dict of arrays: 'tumor_area_cm2' (T, K), 'otsu_area_cm2'
+    (M,) and, with truth, 'tumor_dice'/'tumor_iou' (T, K) and
+    'otsu_dice'/'otsu_iou' (M,).
+    """
+    tumor_pixels, tumor_dice, tumor_iou = sweep_tumor(gray_image, thresholds, kernel_sizes, truth)
+    otsu_pixels, otsu_dice, otsu_iou = sweep_otsu(gray_image, min_areas, truth)
+    
+    result = {
+        'tumor_area_cm2': tumor_pixels * pixel_w * pixel_h,
+        'otsu_area_cm2': otsu_pixels * pixel_w * pixel_h
+    }
+    if truth is not None:
+        result.update(tumor_dice=tumor_dice, tumor_iou=tumor_iou,
+                      otsu_dice=otsu_dice, otsu_iou=otsu_iou)
+    return result
+
+
+def find_masks(image_paths, mask_dir):
+    """Ground-truth mask path for each image with one in mask_dir (same file stem)"""
+    stems = {}
+    for path in find_images(mask_dir):
+        stems[os.path.splitext(os.path.basename(path))[0]] = path
+    
+    masks = {}
+    for image_path in image_paths:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        if stem in stems:
+            masks[image_path] = stems[stem]
+    return masks
+
+
+def load_truth(mask_path, shape):
+    """Boolean ground-truth mask resized (nearest neighbour) to shape"""
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if mask is None:
+        raise ValueError(f"Could not load mask: {mask_path}")
+    if mask.shape != shape:
+        mask = cv2.resize(mask, shape[::-1], interpolation=cv2.INTER_NEAREST)
+    return mask > 0
+
+
+def sweep_file(image_path, mask_path=None, native=False, pixel_spacing=None, **grid):
+    """sweep_image for an image file, decoding it once (pixel_spacing needs native)"""
+    if pixel_spacing is not None and not native:
+        raise ValueError("pixel_spacing describes native pixels and needs native=True")
+    gray = load_gray_image(image_path, native)
+    pixel_w, pixel_h = PIXEL_W, PIXEL_H
+    if native:
+        pixel_w, pixel_h = native_pixel_size(gray.shape, pixel_spacing=pixel_spacing)
+    
+    truth = load_truth(mask_path, gray.shape) if mask_path else None
+    return sweep_image(gray, truth=truth, pixel_w=pixel_w, pixel_h=pixel_h, **grid)
+
+
+def sweep_dataset(image_paths, thresholds=DEFAULT_THRESHOLDS, kernel_sizes=DEFAULT_KERNEL_SIZES,
+                  min_areas=DEFAULT_MIN_AREAS, masks=None, workers=None, native=False,
+                  pixel_spacing=None):
+    """Sweep every image on a thread pool and stack the per-image grids
+    
+    masks maps image paths to ground-truth mask files (see find_masks).
+    Returns the parameter axes, 'paths', per-image arrays with a leading
+    image axis ('tumor_area_cm2' is (N, T, K)) and the Dice/IoU arrays
+    for the images that have a mask, listed in 'mask_paths'.
+    """
+    image_paths = list(image_paths)
+    masks = masks or {}
+    grid = {'thresholds': thresholds, 'kernel_sizes': kernel_sizes, 'min_areas': min_areas}
+    
+    def sweep(path):
+        return sweep_file(path, masks.get(path), native, pixel_spacing, **grid)
+    
+    results = list(map_threaded(sweep, image_paths, max_workers=workers))
+    
+    report = {
+        'thresholds': np.asarray(thresholds, dtype=np.float64),
+        'kernel_sizes': np.asarray(kernel_sizes),
+        'min_areas': np.asarray(min_areas),
+        'paths': image_paths,
+        'mask_paths': [path for path in image_paths if path in masks],
+        'tumor_area_cm2': np.stack([r['tumor_area_cm2'] for r in results]),
+        'otsu_area_cm2': np.stack([r['otsu_area_cm2'] for r in results]),
+    }
+    for key in ('tumor_dice', 'tumor_iou', 'otsu_dice', 'otsu_iou'):
+        scored = [r[key] for r in results if key in r]
+        report[key] = np.stack(scored) if scored else None
+    
+    return report
+
+
+def iter_sweep_records(report):
+    """Long-format rows (SWEEP_FIELDS) of a sweep_dataset report"""
+    scored = {path: i for i, path in enumerate(report['mask_paths'])}
+    
+    for n, path in enumerate(report['paths']):
+        m = scored.get(path)
+        for t, threshold in enumerate(report['thresholds']):
+            for k, kernel_size in enumerate(report['kernel_sizes']):
+                yield {
+                    'path': path, 'stage': 'tumor', 'threshold': float(threshold),
+                    'kernel_size': int(kernel_size),
+                    'area_cm2': float(report['tumor_area_cm2'][n, t, k]),
+                    'dice': float(report['tumor_dice'][m, t, k]) if m is not None else None,
+                    'iou': float(report['tumor_iou'][m, t, k]) if m is not None else None
+                }
+        for a, min_area in enumerate(report['min_areas']):
+            yield {
+                'path': path, 'stage': 'threshold', 'min_area': int(min_area),
+                'area_cm2': float(report['otsu_area_cm2'][n, a]),
+                'dice': float(report['otsu_dice'][m, a]) if m is not None else None,
+                'iou': float(report['otsu_iou'][m, a]) if m is not None else None
+            }
+
+
+def best_parameters(report):
+    """(threshold, kernel_size, mean Dice) with the highest mean tumor Dice, or None"""
+    if report['tumor_dice'] is None:
+        return None
+    mean_dice = report['tumor_dice'].mean(axis=0)
+    t, k = np.unravel_index(np.argmax(mean_dice), mean_dice.shape)
+    return float(report['thresholds'][t]), int(report['kernel_sizes'][k]), float(mean_dice[t, k])
+
+
+def plot_curves(report, output_path):
+    """Save mean area (and Dice) versus parameter curves as an image"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    
+    scored = report['tumor_dice'] is not None
+    fig = Figure(figsize=(15 if scored else 10, 4.5))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(1, 3 if scored else 2)
+    
+    mean_area = report['tumor_area_cm2'].mean(axis=0)
+    for k, kernel_size in enumerate(report['kernel_sizes']):
+        axes[0].plot(report['thresholds'], mean_area[:, k], marker='.', label=f'{kernel_size}px')
+    axes[0].set_xlabel('Binary threshold')
+    axes[0].set_ylabel('Mean tumor area (cm²)')
+    axes[0].legend(title='Kernel', fontsize=8)
+    
+    axes[1].plot(report['min_areas'], report['otsu_area_cm2'].mean(axis=0), marker='.')
+    axes[1].set_xlabel('min_area (pixels)')
+    axes[1].set_ylabel('Mean Otsu area (cm²)')
+    
+    if scored:
+        mean_dice = report['tumor_dice'].mean(axis=0)
+        for k, kernel_size in enumerate(report['kernel_sizes']):
+            axes[2].plot(report['thresholds'], mean_dice[:, k], marker='.', label=f'{kernel_size}px')
+        axes[2].set_xlabel('Binary threshold')
+        axes[2].set_ylabel('Mean Dice')
+        axes[2].legend(title='Kernel', fontsize=8)
+    
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=100)
+
+
+def main(argv=None):
+    """Command line entry point for parameter sweeps"""
+    parser = argparse.ArgumentParser(description="Sweep threshold, kernel size and min_area")
+    parser.add_argument('directory', help="Directory containing MRI images")
+    parser.add_argument('-o', '--output', default='sweep.csv', help="Output file (.csv or .jsonl)")
+    parser.add_argument('--masks', metavar='DIR',
+                        help="Ground-truth masks named like the images, for Dice/IoU")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS,
+                        help="Binary thresholds (fractions of 255)")
+    parser.add_argument('--kernels', type=int, nargs='+', default=DEFAULT_KERNEL_SIZES,
+                        help="Disk diameters in pixels (odd)")
+    parser.add_argument('--min-areas', type=int, nargs='+', default=DEFAULT_MIN_AREAS,
+                        help="Otsu small-object limits in pixels")
+    parser.add_argument('--plot', metavar='PNG', help="Save area/Dice curves to this image")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Images swept in parallel (default: all cores)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Search subdirectories too")
+    parser.add_argument('--native', action='store_true', help="Sweep at native resolution")
+    args = parser.parse_args(argv)
+    
+    image_files = find_images(args.directory, recursive=args.recursive,
+                              exclude=[args.plot] if args.plot else [])
+    if not image_files:
+        print("No image files found")
+        return 1
+    masks = find_masks(image_files, args.masks) if args.masks else {}
+    
+    grid_points = len(args.thresholds) * len(args.kernels) + len(args.min_areas)
+    print(f"Sweeping {len(image_files)} images over {grid_points} parameter settings "
+          f"({len(masks)} with ground truth)")
+    
+    report = sweep_dataset(image_files, args.thresholds, args.kernels, args.min_areas,
+                           masks=masks, workers=args.workers, native=args.native)
+    
+    with ResultWriter(args.output, fields=SWEEP_FIELDS) as writer:
+        for record in iter_sweep_records(report):
+            writer.write(record)
+    print(f"Results saved to {args.output}")
+    
+    if args.plot:
+        plot_curves(report, args.plot)
+        print(f"Curves saved to {args.plot}")
+    
+    best = best_parameters(report)
+    if best is not None:
+        print(f"Best mean Dice {best[2]:.3f} at threshold {best[0]}, kernel {best[1]}px")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Tiled native-resolution processing for very large slices
+
+The tumor mask is the same morphological reconstruction as a full-image
+run, computed tile by tile. The opening and dilation are local, so each
+tile is read with a halo covering their erode/dilate passes. The two
+reconstructions are not: they keep or fill whole connected components.
+Components are therefore labelled per tile, joined across tile edges with
+union-find, and each whole component is then kept or filled. Only the
+tile edges and the reconstruction (one bit per pixel) are held between
+passes, so peak memory stays bounded by the tile size (plus the output
+mask, which may itself be a np.memmap).
+"""
+
+import cv2
+import numpy as np
+
+from brain_tumor_core import (
+    KERNEL_SIZE, MORPH_KERNEL, PIXEL_H, PIXEL_W, PipelineResult, binarize, classify_tumor_area,
+    load_gray_image, native_pixel_size, parse_outputs
+)
+
+# The opening needs an erode and a dilate pass of context, the final dilation one
+OPEN_HALO = 2 * (max(KERNEL_SIZE) // 2)
+DILATE_HALO = max(KERNEL_SIZE) // 2
+
+# Outputs that are exactly tile-decomposable
+TILED_OUTPUTS = ('original', 'binary', 'morphology_tumor', 'tumor_area_cm2', 'category')
+
+DEFAULT_TILE_SIZE = 1024
+
+
+def iter_tiles(shape, tile_size=DEFAULT_TILE_SIZE, halo=OPEN_HALO):
+    """Yield (core, padded) slices covering an image of the given shape
+    
+    core is the part of the output a tile is responsible for, padded the
+    region read from the input (core grown by halo, clipped to the image).
+    """
+    height, width = shape[:2]
+    
+    for y0 in range(0, height, tile_size):
+        y1 = min(y0 + tile_size, height)
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            core = (slice(y0, y1), slice(x0, x1))
+            padded = (slice(max(y0 - halo, 0), min(y1 + halo, height)),
+                      slice(max(x0 - halo, 0), min(x1 + halo, width)))
+            yield core, padded
+
+
+def _core_offset(core, padded):
+    """Slices of core within the padded array read for it"""
+    return (slice(core[0].start - padded[0].start, core[0].stop - padded[0].start),
+            slice(core[1].start - padded[1].start, core[1].stop - padded[1].start))
+
+
+class _TiledComponents:
+    """8-connected components of a mask that is only ever seen one tile at a time
+    
+    add() labels each tile's mask and records which of its components
+    contain a marker pixel, plus the labels along the tile's edges.
+    resolve() joins labels that touch across tile edges with union-find, so
+    a component is marked if any of its parts is. lookup() then relabels a
+    tile (labelling is deterministic) and returns which of its pixels belong
+    to marked components.
+    """
+    
+    def __init__(self, shape):
+        self.shape = shape
+        self._offsets = {}
+        self._flags = []
+        self._count = 0
+        self._rows = {}  # y -> labels of image row y along tile edges
+        self._cols = {}  # x -> labels of image column x along tile edges
+    
+    def add(self, core, mask, marker):
+        num_labels, labels = cv2.connectedComponents(mask, connectivity=8, ltype=cv2.CV_32S)
+        offset = self._offsets[core[0].start, core[1].start] = self._count
+        self._count += num_labels
+        
+        flags = np.zeros(num_labels, dtype=bool)
+        flags[labels[marker > 0]] = True
+        flags[0] = False  # Background
+        self._flags.append(flags)
+        
+        def ids(edge):
+            # Global labels along an edge (-1 = background)
+            return np.where(edge > 0, edge.astype(np.int64) + offset, -1)
+        
+        height, width = self.shape
+        (y0, y1), (x0, x1) = (core[0].start, core[0].stop), (core[1].start, core[1].stop)
+        for y, row in ((y0, labels[0]), (y1 - 1, labels[-1])):
+            self._rows.setdefault(y, np.full(width, -1, dtype=np.int64))[x0:x1] = ids(row)
+        for x, col in ((x0, labels[:, 0]), (x1 - 1, labels[:, -1])):
+            self._cols.setdefault(x, np.full(height, -1, dtype=np.int64))[y0:y1] = ids(col)
+    
+    def _edge_pairs(self, lines):
+        """Label pairs touching across each tile edge, diagonals included"""
+        for position in lines:
+            if position == 0 or position - 1 not in lines:
+                continue
+            before, after = lines[position - 1], lines[position]
+            for shift in (-1, 0, 1):
+                a = before[max(-shift, 0):len(before) - max(shift, 0)]
+                b = after[max(shift, 0):len(after) - max(-shift, 0)]
+                touching = (a >= 0) & (b >= 0)
+                yield np.stack([a[touching], b[touching]], axis=1)
+    
+    def resolve(self):
+        parent = np.arange(self._count)
+        
+        def find(label):
+            while parent[label] != label:
+                parent[label] = parent[parent[label]]
+                label = parent[label]
+            return label
+        
+        pairs = list(self._edge_pairs(self._rows)) + list(self._edge_pairs(self._cols))
+        if pairs:
+            for a, b in np.unique(np.concatenate(pairs), axis=0):
+                root_a, root_b = find(a), find(b)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+        
+        # Point every label at its root, then mark components with any marked part
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        flags = np.concatenate(self._flags)
+        marked = np.zeros(self._count, dtype=bool)
+        marked[parent[flags]] = True
+        self.marked = marked[parent]
+        self._rows = self._cols = None
+    
+    def lookup(self, core, mask):
+        """Boolean array: pixels of mask (one tile) in marked components"""
+        num_labels, labels = cv2.connectedComponents(mask, connectivity=8, ltype=cv2.CV_32S)
+        offset = self._offsets[core[0].start, core[1].start]
+        return self.marked[offset:offset + num_labels][labels]
+
+
+def tumor_mask_tiled(gray_image, threshold=0.6, tile_size=DEFAULT_TILE_SIZE,
+                     out=None, binary_out=None, keep_mask=True):
+    """Tumor mask of a large grayscale image, computed tile by tile
+    
+    Identical to morphology_tumor_mask(binarize(gray_image, threshold)).
+    gray_image may be any array-like supporting 2D slicing (e.g.
+    np.memmap). Returns (mask, tumor_pixels); mask is None when keep_mask
+    is False and no out array was given, so no full-size array is made.
+    """
+    shape = gray_image.shape[:2]
+    if out is None and keep_mask:
+        out = np.empty(shape, dtype=np.uint8)
+    
+    # imreconstruct(imopen(bw, se), bw): components of bw touched by the opening
+    objects = _TiledComponents(shape)
+    for core, padded in iter_tiles(shape, tile_size, OPEN_HALO):
+        binary = binarize(np.asarray(gray_image[padded]), threshold)
+        opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, MORPH_KERNEL)
+        offset = _core_offset(core, padded)
+        objects.add(core, binary[offset], opened[offset])
+        if binary_out is not None:
+            binary_out[core] = binary[offset]
+    objects.resolve()
+    
+    # The reconstruction, one bit per pixel per tile
+    reconstructed = {}
+    for core, _ in iter_tiles(shape, tile_size, 0):
+        binary = binarize(np.asarray(gray_image[core]), threshold)
+        reconstructed[core[0].start, core[1].start] = np.packbits(objects.lookup(core, binary))
+    
+    def read_reconstruction(region):
+        """The reconstruction (255 = kept) over region, from the tiles it overlaps"""
+        tile = np.empty((region[0].stop - region[0].start, region[1].stop - region[1].start),
+                        dtype=np.uint8)
+        for y0 in range(region[0].start // tile_size * tile_size, region[0].stop, tile_size):
+            for x0 in range(region[1].start // tile_size * tile_size, region[1].stop, tile_size):
+                core = (slice(y0, min(y0 + tile_size, shape[0])),
+                        slice(x0, min(x0 + tile_size, shape[1])))
+                overlap = (slice(max(y0, region[0].start), min(core[0].stop, region[0].stop)),
+                           slice(max(x0, region[1].start), min(core[1].stop, region[1].stop)))
+                height, width = core[0].stop - y0, core[1].stop - x0
+                bits = np.unpackbits(reconstructed[y0, x0], count=height * width)
+                tile[_core_offset(overlap, region)] = \
+                    bits.reshape(height, width)[_core_offset(overlap, core)] * 255
+        return tile
+    
+    # Filling by erosion: background components of the reconstruction stay
+    # background only where the dilated reconstruction leaves a seed pixel
+    background = _TiledComponents(shape)
+    for core, padded in iter_tiles(shape, tile_size, DILATE_HALO):
+        region = read_reconstruction(padded)
+        offset = _core_offset(core, padded)
+        seeds = cv2.bitwise_not(cv2.dilate(region, MORPH_KERNEL)[offset])
+        background.add(core, cv2.bitwise_not(region[offset]), seeds)
+    background.resolve()
+    
+    tumor_pixels = 0
+    for core, _ in iter_tiles(shape, tile_size, 0):
+        reached = background.lookup(core, cv2.bitwise_not(read_reconstruction(core)))
+        mask = np.where(reached, 0, 255).astype(np.uint8)
+        
+        tumor_pixels += int(np.count_nonzero(mask))
+        if out is not None:
+            out[core] = mask
+    
+    return out, tumor_pixels
+
+
+def run_tiled(image, tile_size=DEFAULT_TILE_SIZE, threshold=0.6, pixel_w=PIXEL_W, pixel_h=PIXEL_H,
+              pixel_spacing=None, outputs='area+category', out=None):
+    """Native-resolution pipeline for large slices, processed in tiles
+    
+    image is a file path or a 2D grayscale array (e.g. a np.memmap). Only
+    the outputs in TILED_OUTPUTS are supported; the watershed, Otsu and
+    per-region stages need the whole image at once. out may be a
+    preallocated (e.g. memory-mapped) array for the tumor mask.
+    """
+    outputs = parse_outputs(outputs)
+    unsupported = [key for key in outputs if key not in TILED_OUTPUTS]
+    if unsupported:
+        raise ValueError(f"Outputs not available in tiled mode: {', '.join(unsupported)}")
+    
+    gray = load_gray_image(image, native=True) if isinstance(image, str) else image
+    
+    binary = np.empty(gray.shape[:2], dtype=np.uint8) if 'binary' in outputs else None
+    mask, tumor_pixels = tumor_mask_tiled(
+        gray, threshold, tile_size, out=out, binary_out=binary,
+        keep_mask='morphology_tumor' in outputs
+    )
+    
+    pixel_w, pixel_h = native_pixel_size(gray.shape, pixel_w, pixel_h, pixel_spacing)
+    tumor_cm2 = tumor_pixels * pixel_w * pixel_h
+    
+    return PipelineResult(
+        original=gray if 'original' in outputs else None,
+        binary=binary,
+        watershed=None,
+        morphology_tumor=mask if 'morphology_tumor' in outputs else None,
+        threshold=None,
+        tumor_area_cm2=tumor_cm2,
+        category=classify_tumor_area(tumor_cm2)
+    )
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Pipelined processing of cine loops and video exports
+
+Frame decoding, detection and result writing run as overlapping stages
+connected by bounded queues: a decoder thread reads frames with
+cv2.VideoCapture, a thread pool runs the pipeline on several frames at
+once (OpenCV releases the GIL), and a writer thread saves per-frame area
+and category. Bounded queues keep memory flat however long the video is.
+
+Usage:
+    python brain_tumor_video.py cine.mp4 -o frames.csv
+    python brain_tumor_video.py cine.avi --workers 4 --queue-size 16
+"""
+
+import argparse
+import os
+import queue
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+from brain_tumor_core import IMAGE_SIZE, resized_pixel_size, run_pipeline
+from brain_tumor_batch import ResultWriter, map_threaded
+
+FRAME_FIELDS = ['frame', 'time_s', 'tumor_area_cm2', 'category']
+
+DEFAULT_QUEUE_SIZE = 8
+
+# Marks the end of a stage's output
+_END = object()
+
+
+def iter_video_frames(source):
+    """(index, time_s, frame) for every frame of a video file or capture device"""
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {source}")
+    
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            time_s = index / fps if fps > 0 else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            yield index, time_s, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def _produce(items, out_queue, stop):
+    """Stage thread body: put every item on out_queue, then _END (or the error)"""
+    try:
+        for item in items:
+            if stop.is_set():
+                return
+            out_queue.put(item)
+    except Exception as e:
+        out_queue.put(e)
+        return
+    out_queue.put(_END)
+
+
+def _consume(in_queue):
+    """Items from a stage queue until _END, re-raising a stage error here"""
+    while True:
+        item = in_queue.get()
+        if item is _END:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _start_stage(items, maxsize, stop):
+    """Run items on a daemon thread feeding a bounded queue"""
+    out_queue = queue.Queue(maxsize=maxsize)
+    thread = threading.Thread(target=_produce, args=(items, out_queue, stop), daemon=True)
+    thread.start()
+    return out_queue, thread
+
+
+def decode_frames(source, native=False):
+    """Decode stage: (index, time_s, gray, decoded shape) frames ready for the pipeline"""
+    for index, time_s, frame in iter_video_frames(source):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        shape = gray.shape
+        if not native:
+            gray = cv2.resize(gray, IMAGE_SIZE)
+        yield index, time_s, gray, shape
+
+
+def iter_frame_results(source, workers=None, queue_size=DEFAULT_QUEUE_SIZE, native=False,
+                       pixel_spacing=None, outputs='area+category', **params):
+    """Yield (index, time_s, PipelineResult) in frame order
+    
+    The decoder thread runs up to queue_size frames ahead of detection,
+    which keeps workers frames in flight. pixel_spacing is the size of the
+    video's own pixels, with or without native. params are forwarded to
+    run_pipeline (threshold, min_area, pixel_w, pixel_h).
+    """
+    stop = threading.Event()
+    frames, decoder = _start_stage(decode_frames(source, native), queue_size, stop)
+    
+    def analyze(item):
+        index, time_s, gray, shape = item
+        if native:
+            return index, time_s, run_pipeline(gray, outputs=outputs, native=True,
+                                               pixel_spacing=pixel_spacing, **params)
+        if pixel_spacing is not None:
+            pixel_w, pixel_h = resized_pixel_size(shape, pixel_spacing)
+            return index, time_s, run_pipeline(gray, outputs=outputs, pixel_w=pixel_w,
+                                               pixel_h=pixel_h, **params)
+        return index, time_s, run_pipeline(gray, outputs=outputs, **params)
+    
+    try:
+        yield from map_threaded(analyze, _consume(frames), max_workers=workers)
+    finally:
+        # Unblock the decoder if the consumer stopped early
+        stop.set()
+        while decoder.is_alive():
+            try:
+                frames.get_nowait()
+            except queue.Empty:
+                decoder.join(0.01)
+
+
+def analyze_video(source, on_frame=None, writer=None, queue_size=DEFAULT_QUEUE_SIZE, **options):
+    """Per-frame tumor areas of a cine loop or video
+    
+    options are passed to iter_frame_results. Rows for writer (anything
+    with a write(record) method, e.g. ResultWriter) are written on their
+    own thread so slow storage does not hold up detection; on_frame(index,
+    time_s, result) is called for each frame in order.
+    """
+    rows = queue.Queue(maxsize=queue_size)
+    write_errors = []
+    
+    def write_rows():
+        try:
+            for record in _consume(rows):
+                writer.write(record)
+        except Exception as e:
+            write_errors.append(e)
+            # Keep draining so detection never blocks on a full queue
+            for record in _consume(rows):
+                pass
+    
+    write_thread = None
+    if writer is not None:
+        write_thread = threading.Thread(target=write_rows, daemon=True)
+        write_thread.start()
+    
+    areas, categories, times = [], [], []
+    try:
+        for index, time_s, result in iter_frame_results(source, queue_size=queue_size, **options):
+            areas.append(result.tumor_area_cm2)
+            categories.append(result.category)
+            times.append(time_s)
+            if write_thread is not None:
+                rows.put({'frame': index, 'time_s': round(time_s, 4),
+                          'tumor_area_cm2': float(result.tumor_area_cm2),
+                          'category': result.category})
+            if on_frame is not None:
+                on_frame(index, time_s, result)
+    finally:
+        if write_thread is not None:
+            rows.put(_END)
+            write_thread.join()
+    
+    if write_errors:
+        raise write_errors[0]
+    
+    areas = np.asarray(areas, dtype=np.float64)
+    return {
+        'num_frames': len(areas),
+        'frame_times_s': np.asarray(times, dtype=np.float64),
+        'frame_areas_cm2': areas,
+        'categories': categories,
+        'tumor_frames': int(np.count_nonzero(areas)),
+        'max_area_cm2': float(areas.max()) if len(areas) else 0.0
+    }
+
+
+def main(argv=None):
+    """Command line entry point for video analysis"""
+    parser = argparse.ArgumentParser(description="Per-frame tumor area of a cine loop or video")
+    parser.add_argument('video', help="Video file readable by OpenCV")
+    parser.add_argument('-o', '--output', help="Per-frame results (.csv or .jsonl)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Frames processed in parallel (default: all cores)")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="Decoded frames buffered ahead of detection")
+    parser.add_argument('--native', action='store_true', help="Process frames at native resolution")
+    parser.add_argument('--spacing', type=float, nargs=2, metavar=('W', 'H'),
+                        help="Pixel spacing of the video in cm")
+    args = parser.parse_args(argv)
+    
+    writer = ResultWriter(args.output, fields=FRAME_FIELDS) if args.output else None
+    
+    def on_frame(index, time_s, result):
+        print(f"   Frame {index} ({time_s:.2f} s): {result.tumor_area_cm2:.4f} cm² ({result.category})")
+    
+    try:
+        summary = analyze_video(args.video, on_frame=on_frame, writer=writer,
+                                queue_size=args.queue_size, workers=args.workers,
+                                native=args.native, pixel_spacing=args.spacing)
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    print("\n" + "="*50)
+    print(f"Frames: {summary['num_frames']} ({summary['tumor_frames']} with tumor)")
+    print(f"Max frame area: {summary['max_area_cm2']:.4f} cm²")
+    print("="*50)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
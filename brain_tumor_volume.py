@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Streaming 3D volume processing
+
+Reads a scan series slice by slice from a memory-mapped .npy file, a raw
+volume or a multi-page TIFF, runs the per-slice detection pipeline and adds
+up the tumor volume. The whole volume is never loaded into RAM.
+
+Usage:
+    python brain_tumor_volume.py series.tiff --thickness 0.5
+    python brain_tumor_volume.py series.raw --shape 160 512 512 --dtype uint16 --thickness 0.1
+"""
+
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from brain_tumor_core import IMAGE_SIZE, resized_pixel_size, run_pipeline
+from brain_tumor_tiled import run_tiled
+from brain_tumor_batch import ResultWriter
+
+SLICE_FIELDS = ['slice', 'tumor_area_cm2', 'category']
+
+
+def iter_npy_slices(path, axis=0):
+    """Slices of a .npy volume, memory-mapped so only one slice is read at a time"""
+    volume = np.load(path, mmap_mode='r')
+    if volume.ndim != 3:
+        raise ValueError(f"Expected a 3D volume, got shape {volume.shape}")
+    
+    for i in range(volume.shape[axis]):
+        yield np.take(volume, i, axis=axis)
+
+
+def iter_raw_slices(path, shape, dtype=np.uint8, offset=0, axis=0):
+    """Slices of a headerless raw volume of the given (Z, Y, X) shape"""
+    volume = np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape), offset=offset)
+    
+    for i in range(volume.shape[axis]):
+        yield np.take(volume, i, axis=axis)
+
+
+def iter_tiff_slices(path):
+    """Pages of a multi-page TIFF, decoded one at a time"""
+    try:
+        import tifffile
+    except ImportError:
+        tifffile = None
+    
+    if tifffile is not None:
+        with tifffile.TiffFile(path) as tif:
+            for page in tif.pages:
+                yield page.asarray()
+        return
+    
+    # Fallback: OpenCV can decode a single page by index
+    for i in range(cv2.imcount(path)):
+        ok, pages = cv2.imreadmulti(path, start=i, count=1, flags=cv2.IMREAD_UNCHANGED)
+        if not ok:
+            raise ValueError(f"Could not read page {i} of {path}")
+        yield pages[0]
+
+
+def iter_volume_slices(source, shape=None, dtype=np.uint8, offset=0, axis=0):
+    """Slices of a volume given as a path (.npy, .tif/.tiff, raw) or a 3D array"""
+    if not isinstance(source, str):
+        for i in range(source.shape[axis]):
+            yield np.take(source, i, axis=axis)
+        return
+    
+    ext = os.path.splitext(source)[1].lower()
+    if ext == '.npy':
+        yield from iter_npy_slices(source, axis)
+    elif ext in ('.tif', '.tiff'):
+        yield from iter_tiff_slices(source)
+    elif shape is not None:
+        yield from iter_raw_slices(source, shape, dtype, offset, axis)
+    else:
+        raise ValueError(f"Unsupported volume format: {source} (raw volumes need a shape)")
+
+
+def to_gray_uint8(image, window=None):
+    """Convert one slice to 8-bit grayscale
+    
+    window=(low, high) maps that intensity range to 0-255 and should be
+    used for non-8-bit data so every slice is scaled the same way; without
+    it each slice is scaled by its own min/max.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if image.dtype == np.uint8 and window is None:
+        return image
+    
+    low, high = window if window is not None else (float(image.min()), float(image.max()))
+    scale = 255.0 / (high - low) if high > low else 0.0
+    return np.clip((image.astype(np.float32) - low) * scale, 0, 255).astype(np.uint8)
+
+
+def iter_slice_results(source, native=False, pixel_spacing=None, window=None, tile_size=None,
+                       outputs='area+category', **source_kwargs):
+    """Run the per-slice pipeline, yielding (index, PipelineResult) as slices stream in
+    
+    By default each slice is resized to 200x200 like a single image; with
+    native=True (or tile_size) it is processed at its own resolution.
+    pixel_spacing is the size of a slice's own pixels in either case.
+    """
+    for i, image in enumerate(iter_volume_slices(source, **source_kwargs)):
+        gray = to_gray_uint8(image, window)
+        
+        if tile_size:
+            result = run_tiled(gray, tile_size=tile_size, pixel_spacing=pixel_spacing, outputs=outputs)
+        elif native:
+            result = run_pipeline(gray, outputs=outputs, native=True, pixel_spacing=pixel_spacing)
+        elif pixel_spacing is not None:
+            pixel_w, pixel_h = resized_pixel_size(gray.shape, pixel_spacing)
+            result = run_pipeline(cv2.resize(gray, IMAGE_SIZE), outputs=outputs,
+                                  pixel_w=pixel_w, pixel_h=pixel_h)
+        else:
+            result = run_pipeline(cv2.resize(gray, IMAGE_SIZE), outputs=outputs)
+        
+        yield i, result
+
+
+def analyze_volume(source, slice_thickness_cm, on_slice=None, **options):
+    """Tumor volume (cm³) of a scan series, summed from per-slice areas
+    
+    options are passed to iter_slice_results; on_slice(index, result) is
+    called for each slice as it finishes.
+    """
+    areas = []
+    
+    for i, result in iter_slice_results(source, **options):
+        areas.append(result.tumor_area_cm2)
+        if on_slice is not None:
+            on_slice(i, result)
+    
+    areas = np.asarray(areas, dtype=np.float64)
+    return {
+        'num_slices': len(areas),
+        'slice_areas_cm2': areas,
+        'tumor_slices': int(np.count_nonzero(areas)),
+        'max_area_cm2': float(areas.max()) if len(areas) else 0.0,
+        'volume_cm3': float(areas.sum() * slice_thickness_cm)
+    }
+
+
+def main(argv=None):
+    """Command line entry point for volume analysis"""
+    parser = argparse.ArgumentParser(description="Streaming tumor volume from a scan series")
+    parser.add_argument('volume', help=".npy, .tif/.tiff or raw volume file")
+    parser.add_argument('--thickness', type=float, required=True, help="Slice thickness in cm")
+    parser.add_argument('--shape', type=int, nargs=3, metavar=('Z', 'Y', 'X'),
+                        help="Shape of a raw volume")
+    parser.add_argument('--dtype', default='uint8', help="Data type of a raw volume")
+    parser.add_argument('--offset', type=int, default=0, help="Header bytes to skip in a raw volume")
+    parser.add_argument('--native', action='store_true', help="Process slices at native resolution")
+    parser.add_argument('--tile-size', type=int, help="Process slices in tiles of this size")
+    parser.add_argument('--spacing', type=float, nargs=2, metavar=('W', 'H'),
+                        help="In-plane pixel spacing in cm")
+    parser.add_argument('--window', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+                        help="Intensity window mapped to 0-255")
+    parser.add_argument('-o', '--output', help="Per-slice results (.csv or .jsonl)")
+    args = parser.parse_args(argv)
+    
+    writer = ResultWriter(args.output, fields=SLICE_FIELDS) if args.output else None
+    
+    def on_slice(i, result):
+        print(f"   Slice {i}: {result.tumor_area_cm2:.4f} cm² ({result.category})")
+        if writer is not None:
+            writer.write({'slice': i, 'tumor_area_cm2': float(result.tumor_area_cm2),
+                          'category': result.category})
+    
+    try:
+        summary = analyze_volume(
+            args.volume, args.thickness, on_slice=on_slice,
+            native=args.native, tile_size=args.tile_size, pixel_spacing=args.spacing,
+            window=args.window, shape=args.shape, dtype=np.dtype(args.dtype), offset=args.offset
+        )
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    print("\n" + "="*50)
+    print(f"Slices: {summary['num_slices']} ({summary['tumor_slices']} with tumor)")
+    print(f"Max slice area: {summary['max_area_cm2']:.4f} cm²")
+    print(f"Tumor volume: {summary['volume_cm3']:.4f} cm³")
+    print("="*50)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Hot-folder ingestion: process scans as they are dropped into a directory
+
+The directory is polled for the image types the GUI accepts. New or
+changed files are run through BrainTumorDetector on a bounded thread pool
+(one detector per thread) and recorded in a small SQLite manifest of
+path, mtime, size and content hash together with the result and the
+pipeline parameters. After a restart the manifest is consulted first, so
+files that were already processed with the same parameters are skipped on
+a stat comparison alone; a touched or copied file whose bytes were seen
+before is matched by its hash and not run again. A file that fails is
+retried with a growing delay, up to a fixed number of attempts.
+
+Usage:
+    python brain_tumor_watch.py incoming/ -o results.csv --workers 4
+    python brain_tumor_watch.py incoming/ --once
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from brain_tumor_batch import IMAGE_EXTENSIONS, SCAN_OUTPUTS, ResultWriter, map_threaded
+from brain_tumor_cache import CACHE_VERSION
+from brain_tumor_core import DEFAULT_DECODE, BrainTumorDetector, pipeline_params
+
+WATCH_FIELDS = ['time', 'path', 'tumor_area_cm2', 'category', 'error']
+
+MANIFEST_NAME = '.brain_tumor_manifest.sqlite'
+
+# Seconds between directory polls
+DEFAULT_INTERVAL = 2.0
+
+# Files modified more recently than this (s) may still be being written
+DEFAULT_SETTLE = 1.0
+
+HASH_CHUNK = 1024 * 1024
+
+# A failed file is tried this many times in total, waiting RETRY_DELAY,
+# then twice that, ... between attempts (unless the file changes)
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30.0
+
+
+def file_digest(path):
+    """128-bit BLAKE2 hash of a file's bytes, as hex"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_image_files(directory, extensions=IMAGE_EXTENSIONS, recursive=False):
+    """(path, stat) of every image file in directory, using one scandir per folder"""
+    pending = [directory]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue  # Folder removed while we were listing
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if recursive and not entry.name.startswith('.'):
+                        pending.append(entry.path)
+                elif any(fnmatch.fnmatch(entry.name, ext) for ext in extensions):
+                    yield entry.path, entry.stat()
+            except OSError:
+                continue  # File removed while we were listing
+
+
+class Manifest:
+    """Processed files with their mtime, size, content hash and result
+    
+    Entries are kept per params (anything JSON-serialisable, e.g.
+    pipeline_params()): files processed with other parameters count as new
+    and their results are never reused. The (path, mtime, size) of every
+    entry is kept in memory with its next retry time, so a poll only needs
+    a stat per file; the table itself is one row per file.
+    """
+    
+    def __init__(self, path, params=None, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.path = path
+        self.params = json.dumps({'version': CACHE_VERSION, 'params': params}, sort_keys=True)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS files '
+                             '(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, hash TEXT, '
+                             'tumor_area_cm2 REAL, category TEXT, error TEXT, processed REAL, '
+                             'attempts INTEGER, params TEXT)')
+            # Manifests written before retries and params were tracked
+            columns = {row[1] for row in self._db.execute('PRAGMA table_info(files)')}
+            for column, kind in (('attempts', 'INTEGER'), ('params', 'TEXT')):
+                if column not in columns:
+                    self._db.execute(f'ALTER TABLE files ADD COLUMN {column} {kind}')
+            self._db.execute('CREATE INDEX IF NOT EXISTS files_hash ON files (hash)')
+        self._stats = {}
+        for path, mtime_ns, size, error, attempts, processed in self._db.execute(
+                'SELECT path, mtime_ns, size, error, attempts, processed FROM files '
+                'WHERE params = ?', (self.params,)):
+            attempts = attempts or 1
+            self._stats[path] = (mtime_ns, size, attempts,
+                                 self._retry_at(error, attempts, processed))
+    
+    def _retry_at(self, error, attempts, processed):
+        """When a failed file is due again, or None if it is done"""
+        if error is None or attempts >= self.max_attempts:
+            return None
+        return processed + self.retry_delay * 2 ** (attempts - 1)
+    
+    def is_current(self, path, stat, now=None):
+        """True if path was processed and has not changed since (a failed file until its retry)"""
+        entry = self._stats.get(path)
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            return False
+        retry_at = entry[3]
+        return retry_at is None or (time.time() if now is None else now) < retry_at
+    
+    def find(self, digest):
+        """Result of an earlier file with the same content hash and params, or None"""
+        with self._lock:
+            row = self._db.execute('SELECT tumor_area_cm2, category FROM files '
+                                   'WHERE hash = ? AND params = ? AND error IS NULL LIMIT 1',
+                                   (digest, self.params)).fetchone()
+        if row is None:
+            return None
+        return {'tumor_area_cm2': row[0], 'category': row[1]}
+    
+    def add(self, path, stat, digest, record):
+        """Record a processed file (record has the area, category and error)
+        
+        Failures of an unchanged file are counted towards max_attempts.
+        """
+        attempts = 1
+        entry = self._stats.get(path)
+        if record.get('error') and entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+            attempts = entry[2] + 1
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (path, stat.st_mtime_ns, stat.st_size, digest,
+                              record.get('tumor_area_cm2'), record.get('category'),
+                              record.get('error'), record['time'], attempts, self.params))
+        self._stats[path] = (stat.st_mtime_ns, stat.st_size, attempts,
+                             self._retry_at(record.get('error'), attempts, record['time']))
+    
+    def __len__(self):
+        return len(self._stats)
+    
+    def close(self):
+        self._db.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HotFolder:
+    """Processes every new or changed image in a directory, once
+    
+    poll() does a single pass and returns the records of the files it
+    processed; run() polls until stop is set. on_record(record) is called
+    for each processed file. The manifest defaults to a hidden file in the
+    watched directory. A file that fails is tried up to max_attempts times,
+    retry_delay seconds after the first failure and twice as long after
+    each one after that.
+    """
+    
+    def __init__(self, directory, manifest_path=None, workers=None, recursive=False,
+                 settle=DEFAULT_SETTLE, decode=DEFAULT_DECODE, on_record=None,
+                 max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.directory = directory
+        self.workers = workers or os.cpu_count() or 1
+        self.recursive = recursive
+        self.settle = settle
+        self.decode = decode
+        self.on_record = on_record
+        self.manifest = Manifest(manifest_path or os.path.join(directory, MANIFEST_NAME),
+                                 pipeline_params(decode=decode), max_attempts, retry_delay)
+        self._local = threading.local()
+    
+    def _detector(self):
+        """This thread's detector (BrainTumorDetector keeps per-image state)"""
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = self._local.detector = BrainTumorDetector(decode=self.decode)
+        return detector
+    
+    def pending(self):
+        """(path, stat) of files that are new or changed and no longer being written"""
+        now = time.time()
+        return [(path, stat) for path, stat in iter_image_files(self.directory,
+                                                                recursive=self.recursive)
+                if not self.manifest.is_current(path, stat, now)
+                and now - stat.st_mtime >= self.settle]
+    
+    def _ingest(self, item):
+        """Worker: hash one file and run the pipeline unless its content was seen before"""
+        path, stat = item
+        record = {'time': time.time(), 'path': path, 'error': None}
+        digest = None
+        try:
+            digest = file_digest(path)
+            known = self.manifest.find(digest)
+            if known is None:
+                results = self._detector().process_complete_pipeline(path, outputs=SCAN_OUTPUTS)
+                known = {'tumor_area_cm2': float(results['tumor_area_cm2']),
+                         'category': results['category']}
+            record.update(known)
+        except Exception as e:
+            record['error'] = f"{type(e).__name__}: {e}"
+        return path, stat, digest, record
+    
+    def poll(self):
+        """Process every pending file on the worker pool; returns their records"""
+        records = []
+        for path, stat, digest, record in map_threaded(self._ingest, self.pending(),
+                                                       max_workers=self.workers):
+            # A file that vanished before it was read is not recorded
+            if digest is not None or os.path.exists(path):
+                self.manifest.add(path, stat, digest, record)
+            records.append(record)
+            if self.on_record is not None:
+                self.on_record(record)
+        return records
+    
+    def run(self, interval=DEFAULT_INTERVAL, stop=None):
+        """Poll every interval seconds until stop (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self.poll()
+            stop.wait(interval)
+    
+    def close(self):
+        self.manifest.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    """Command line entry point for the hot-folder daemon"""
+    parser = argparse.ArgumentParser(description="Process MRI images as they arrive in a directory")
+    parser.add_argument('directory', help="Directory to watch")
+    parser.add_argument('-o', '--output', help="Append results to this file (.csv or .jsonl)")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help="Number of worker threads (default: all cores)")
+    parser.add_argument('-r', '--recursive', action='store_true', help="Watch subdirectories too")
+    parser.add_argument('--manifest', help=f"Manifest file (default: DIRECTORY/{MANIFEST_NAME})")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds between polls")
+    parser.add_argument('--settle', type=float, default=DEFAULT_SETTLE,
+                        help="Skip files modified in the last SETTLE seconds (still being written)")
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help="Tries per file before a failing file is given up on")
+    parser.add_argument('--fast-decode', action='store_true',
+                        help="Decode straight to grayscale, at reduced scale for large JPEGs")
+    parser.add_argument('--once', action='store_true', help="Process pending files and exit")
+    args = parser.parse_args(argv)
+    
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}")
+        return 1
+    
+    writer = ResultWriter(args.output, fields=WATCH_FIELDS, append=True) if args.output else None
+    
+    def on_record(record):
+        if record['error']:
+            print(f"   Error processing {record['path']}: {record['error']}")
+        else:
+            print(f"   {record['path']}: {record['tumor_area_cm2']:.4f} cm² ({record['category']})")
+        if writer is not None:
+            writer.write(record)
+    
+    with HotFolder(args.directory, args.manifest, args.workers, args.recursive, args.settle,
+                   'fast' if args.fast_decode else 'exact', on_record, args.max_attempts) as folder:
+        print(f"Watching {args.directory} ({len(folder.manifest)} files already processed)")
+        try:
+            if args.once:
+                folder.poll()
+            else:
+                folder.run(args.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if writer is not None:
+                writer.close()
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
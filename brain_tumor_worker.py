@@ -0,0 +1,152 @@
+"""
+Background worker that runs detection jobs off the GUI thread
+
+Jobs are processed on one daemon thread that owns its own
+BrainTumorDetector. Progress, results and errors are posted to an event
+queue which the Tk main loop polls, so the window never blocks.
+"""
+
+import base64
+import itertools
+import queue
+import threading
+
+import cv2
+
+from brain_tumor_core import BrainTumorDetector
+from brain_tumor_instrumentation import Instrumentation
+
+# Detector methods that report progress through the instrumentation callback
+STAGE_METHODS = (
+    'load_image',
+    'create_binary_image',
+    'watershed_segmentation',
+    'morphological_processing',
+    'threshold_segmentation',
+    'calculate_tumor_area',
+)
+
+THUMBNAIL_SIZE = 48
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """Base64 PNG of a small copy of image, as accepted by tk.PhotoImage(data=...)"""
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    small = cv2.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                       interpolation=cv2.INTER_AREA)
+    ok, png = cv2.imencode('.png', small)
+    if not ok:
+        raise ValueError("Could not encode thumbnail")
+    return base64.b64encode(png.tobytes()).decode('ascii')
+
+
+class ProcessingCancelled(Exception):
+    """Raised inside the worker when the current job is cancelled"""
+
+
+class PipelineWorker:
+    """Runs process_complete_pipeline for lists of files on a background thread
+    
+    Jobs submitted with params (threshold, kernel_size, min_area) use
+    process_incremental instead, so re-running the same image with new
+    parameters only recomputes the stages they affect.
+    
+    Events posted to self.events (a queue.Queue):
+        ('progress', job_id, fraction, message)
+        ('result', job_id, index, total, path, results)
+        ('error', job_id, index, total, path, message)
+        ('done', job_id, cancelled)
+    """
+    
+    def __init__(self, detector=None):
+        if detector is None:
+            detector = BrainTumorDetector()
+        if detector.instrumentation is None:
+            detector.instrumentation = Instrumentation()
+        detector.instrumentation.add_callback(self._on_stage_event)
+        
+        self.detector = detector
+        self.events = queue.Queue()
+        self._jobs = queue.Queue()
+        self._job_ids = itertools.count(1)
+        self._pending = {}
+        self._current = None
+        self._lock = threading.Lock()
+        
+        self._thread = threading.Thread(target=self._run, name='PipelineWorker', daemon=True)
+        self._thread.start()
+    
+    def submit(self, paths, params=None):
+        """Queue a job processing paths in order; returns its job id"""
+        job = {'id': next(self._job_ids), 'paths': list(paths), 'params': params,
+               'cancel': threading.Event(), 'index': 0, 'stages': 0}
+        with self._lock:
+            self._pending[job['id']] = job
+        self._jobs.put(job)
+        return job['id']
+    
+    def cancel(self):
+        """Cancel the running job and every job still waiting"""
+        with self._lock:
+            for job in self._pending.values():
+                job['cancel'].set()
+    
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._pending)
+    
+    def stop(self):
+        """Cancel everything and let the thread exit"""
+        self.cancel()
+        self._jobs.put(None)
+    
+    def _post_progress(self, job, message):
+        total = len(job['paths'])
+        fraction = (job['index'] + job['stages'] / len(STAGE_METHODS)) / total
+        self.events.put(('progress', job['id'], min(fraction, 1.0), message))
+    
+    def _on_stage_event(self, event):
+        """Instrumentation callback: report stage progress and honour cancel"""
+        job = self._current
+        if job is None or event['type'] != 'stage':
+            return
+        job['stages'] += 1
+        self._post_progress(job, event['name'])
+        if job['cancel'].is_set():
+            raise ProcessingCancelled()
+    
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            self._current = job
+            self._run_job(job)
+            self._current = None
+            with self._lock:
+                self._pending.pop(job['id'], None)
+            self.events.put(('done', job['id'], job['cancel'].is_set()))
+    
+    def _run_job(self, job):
+        total = len(job['paths'])
+        
+        for index, path in enumerate(job['paths']):
+            if job['cancel'].is_set():
+                return
+            job['index'], job['stages'] = index, 0
+            self._post_progress(job, path)
+            
+            try:
+                if job['params'] is None:
+                    results = self.detector.process_complete_pipeline(path)
+                else:
+                    results = self.detector.process_incremental(path, **job['params'])
+            except ProcessingCancelled:
+                return
+            except Exception as e:
+                self.events.put(('error', job['id'], index, total, path, str(e)))
+                continue
+            
+            self.events.put(('result', job['id'], index, total, path, results))
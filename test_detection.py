@@ -5,82 +5,876 @@ Test script for brain tumor detection
 
 import os
 import glob
+import base64
+from functools import partial
 from brain_tumor_detection import BrainTumorDetector
-import matplotlib.pyplot as plt
+from brain_tumor_detection import PipelineResult, run_pipeline, resolve_stages
+from brain_tumor_detection import Workspace, binarize
+from brain_tumor_core import WATERSHED_BACKENDS, _watershed_labels, pipeline_params
+from brain_tumor_core import MORPH_KERNEL, load_gray_image, morphology_tumor_mask, disk_kernel
+from brain_tumor_core import decode_gray_image, iter_gray_images, jpeg_size
+from brain_tumor_core import IMAGE_SIZE, resized_pixel_size
+from brain_tumor_components import (
+    analyze_components, filter_by_area, reconstruct_by_dilation, reconstruct_by_erosion,
+    reconstruct_iterative, remove_small_objects
+)
+from brain_tumor_cache import ResultCache
+from brain_tumor_archive import (
+    ENCODING_BITS, ENCODING_RAW, ENCODING_RLE, ArchiveWriter, ResultArchive, decode_image,
+    archive_images, encode_image
+)
+from brain_tumor_benchmark import (
+    STAGES, bench_allocations, bench_case, bench_imports, case_peak_rss_mb, check_import_budget,
+    compare, make_phantom
+)
+from brain_tumor_instrumentation import Instrumentation
+from brain_tumor_tiled import run_tiled, tumor_mask_tiled
+from brain_tumor_volume import analyze_volume
+from brain_tumor_video import analyze_video, iter_frame_results, iter_video_frames
+from brain_tumor_batch import find_images, scan_images, run_threaded, ResultWriter
+from brain_tumor_worker import PipelineWorker
+from brain_tumor_watch import HotFolder
+from brain_tumor_views import ViewRenderer
+from brain_tumor_service import DetectionService, analyze_batch
+from brain_tumor_loadgen import run_load
+from brain_tumor_report import (
+    PANELS, build_report, render_montage, render_panel, save_montage, write_index
+)
+from brain_tumor_sweep import (
+    best_parameters, find_masks, iter_sweep_records, plot_curves, sweep_dataset
+)
+import cv2
+import numpy as np
 
-def test_all_images():
-    """Test tumor detection on all available images"""
+def run_all_images(output_dir='.', workers=None):
+    """Run tumor detection on all images in the current directory
     
+    Writes a montage per image and result_index.html to output_dir and
+    returns the records.
+    """
     # Find all image files in current directory
-    image_extensions = ['*.jpg', '*.jpeg', '*.png']
-    image_files = []
-    
-    for ext in image_extensions:
-        image_files.extend(glob.glob(ext))
+    image_files = find_images('.', extensions=['*.jpg', '*.jpeg', '*.png'])
     
     if not image_files:
         print("No image files found in current directory")
-        return
+        return []
     
     print(f"Found {len(image_files)} image files")
     print("Testing brain tumor detection...")
     print("="*50)
     
+    # Images are processed in parallel; records arrive in input order
+    records = []
+    for record in scan_images(image_files, workers=workers, chunksize=1,
+                              worker=partial(save_montage, output_dir=output_dir)):
+        records.append(record)
+        print(f"\n{record['index'] + 1}. Processing: {record['path']}")
+        
+        if record['error']:
+            print(f"   Error processing {record['path']}: {record['error']}")
+            continue
+        
+        print(f"   Tumor Area: {record['tumor_area_cm2']:.4f} cm²")
+        print(f"   Classification: {record['category']}")
+        print(f"   Result saved as: {record['output']}")
+    
+    index_path = os.path.join(output_dir, 'result_index.html')
+    write_index(records, index_path)
+    print("\n" + "="*50)
+    print(f"Index saved as: {index_path}")
+    print("Testing completed!")
+    return records
+
+def test_all_images(tmp_path):
+    """Every sample is processed and gets a montage; nothing is written to the repo"""
+    records = run_all_images(str(tmp_path))
+    assert len(records) == len(glob.glob('mri_sample_*'))
+    assert all(record['error'] is None for record in records)
+    assert all(os.path.dirname(record['output']) == str(tmp_path) for record in records)
+    assert (tmp_path / 'result_index.html').exists()
+
+def test_montage_tiles_panels_and_indexes_results(tmp_path):
+    """Montages hold every panel at integer scale; the index links montages and lists errors"""
+    import shutil
+    
+    image_file = sorted(glob.glob('mri_sample_*'))[0]
+    results = run_pipeline(image_file).as_dict()
+    
+    canvas = render_montage(results, "title", scale=2)
+    assert canvas.dtype == np.uint8 and canvas.shape[2] == 3
+    for key, _, colormap in PANELS:
+        panel = render_panel(results[key], colormap, scale=2)
+        assert panel.shape == (400, 400, 3)
+        # Every panel appears somewhere in the canvas exactly as rendered
+        y, x = np.unravel_index(cv2.matchTemplate(canvas, panel, cv2.TM_SQDIFF).argmin(),
+                                (canvas.shape[0] - 399, canvas.shape[1] - 399))
+        assert np.array_equal(canvas[y:y + 400, x:x + 400], panel), key
+    assert np.array_equal(render_panel(results['binary'], scale=1)[..., 0], results['binary'])
+    
+    record = save_montage(image_file, output_dir=str(tmp_path))
+    assert np.isclose(record['tumor_area_cm2'], results['tumor_area_cm2'])
+    assert cv2.imread(record['output']).shape == canvas.shape
+    
+    index_path = tmp_path / "index.html"
+    write_index([{'index': 0, 'path': image_file, 'error': None, **record},
+                 {'index': 1, 'path': "<broken>.png", 'error': "ValueError: bad"}], str(index_path))
+    page = index_path.read_text(encoding='utf-8')
+    assert f'src="{os.path.basename(record["output"])}"' in page
+    assert "&lt;broken&gt;.png" in page and "ValueError: bad" in page
+    
+    # Same file name in two subfolders gets two montages
+    scans = tmp_path / "scans"
+    for folder in ("a", "b"):
+        (scans / folder).mkdir(parents=True)
+        shutil.copy(image_file, scans / folder / "scan.png")
+    records = build_report(find_images(str(scans), recursive=True), str(tmp_path / "report"),
+                           threads=True, root=str(scans))
+    outputs = [record['output'] for record in records]
+    assert [os.path.basename(output) for output in outputs] == ["result_a__scan.png", "result_b__scan.png"]
+    assert all(os.path.exists(output) for output in outputs)
+
+def test_process_batch_matches_single():
+    """Batch API gives the same masks, areas and categories as the single-image pipeline"""
+    image_files = sorted(glob.glob('mri_sample_*'))
+    batch = BrainTumorDetector().process_batch(image_files)
+    
+    assert batch['original'].shape == (len(image_files), 200, 200)
+    
+    for i, image_file in enumerate(image_files):
+        results = BrainTumorDetector().process_complete_pipeline(image_file)
+        for key in ['original', 'binary', 'watershed', 'morphology_tumor', 'threshold']:
+            assert np.array_equal(results[key], batch[key][i]), (image_file, key)
+        assert results['tumor_area_cm2'] == batch['tumor_area_cm2'][i]
+        assert results['category'] == batch['category'][i]
+
+def test_scan_images_keeps_order_and_survives_bad_files(tmp_path):
+    """Parallel scan returns records in input order and reports bad files as errors"""
+    bad_file = tmp_path / "broken.png"
+    bad_file.write_bytes(b"not an image")
+    image_files = sorted(glob.glob('mri_sample_*'))
+    paths = image_files[:3] + [str(bad_file)] + image_files[3:]
+    
+    output = tmp_path / "results.jsonl"
+    with ResultWriter(str(output)) as writer:
+        records = []
+        for record in scan_images(paths, workers=2, chunksize=2):
+            writer.write(record)
+            records.append(record)
+    
+    assert [r['path'] for r in records] == paths
+    assert records[3]['error'] is not None
+    assert all(r['error'] is None for i, r in enumerate(records) if i != 3)
+    assert len(output.read_text().splitlines()) == len(paths)
+    
+    # Outputs of earlier runs in the scanned folder are never picked up as inputs
+    import shutil
+    scans = tmp_path / "scans"
+    (scans / "report").mkdir(parents=True)
+    shutil.copy(image_files[0], scans / "scan.jpg")
+    shutil.copy(image_files[0], scans / "result_scan.png")
+    shutil.copy(image_files[0], scans / "report" / "scan.jpg")
+    assert find_images(str(scans), recursive=True, exclude=[str(scans / "report")]) == \
+        [str(scans / "scan.jpg")]
+
+def test_fast_decode_reads_gray_at_reduced_scale(tmp_path):
+    """Fast decode matches the exact path on the samples and decodes large JPEGs at reduced scale"""
+    image_files = sorted(glob.glob('mri_sample_*'))
+    for image_file in image_files:
+        exact = load_gray_image(image_file)
+        assert np.array_equal(load_gray_image(image_file, decode='fast'), exact)
+        with open(image_file, 'rb') as f:
+            assert np.array_equal(decode_gray_image(f.read(), decode='fast'), exact)
+    
+    # A 1700x1000 JPEG is decoded at 1/4 scale (425x250), then resized
+    large = cv2.resize(cv2.imread(image_files[0]), (1700, 1000))
+    large_path = str(tmp_path / "large.jpg")
+    cv2.imwrite(large_path, large)
+    with open(large_path, 'rb') as f:
+        assert jpeg_size(f) == (1700, 1000)
+    assert cv2.imread(large_path, cv2.IMREAD_REDUCED_GRAYSCALE_4).shape == (250, 425)
+    fast = load_gray_image(large_path, decode='fast')
+    assert fast.shape == (200, 200)
+    assert np.mean(np.abs(fast.astype(int) - load_gray_image(large_path))) < 2
+    assert load_gray_image(large_path, native=True, decode='fast').shape == (1000, 1700)
+    
+    # Prefetched decoding keeps order, reports bad files and matches the plain scan
+    bad_file = tmp_path / "broken.png"
+    bad_file.write_bytes(b"not an image")
+    paths = image_files[:2] + [str(bad_file)] + image_files[2:]
+    loaded = list(iter_gray_images(paths, prefetch=1))
+    assert [path for path, _, _ in loaded] == paths
+    assert loaded[2][1] is None and isinstance(loaded[2][2], ValueError)
+    assert np.array_equal(loaded[0][1], load_gray_image(paths[0]))
+    
+    records = list(scan_images(paths, workers=1, decode='fast'))
+    assert records == list(scan_images(paths, workers=2))
+    
+    # Stopping early does not leave the reader blocked
+    images = iter_gray_images(paths * 3, prefetch=1)
+    next(images)
+    images.close()
+
+def test_run_threaded_matches_detector():
+    """Stateless pipeline on a shared thread pool matches the stateful detector"""
+    image_files = sorted(glob.glob('mri_sample_*')) * 3
+    
+    for image_file, result in zip(image_files, run_threaded(image_files, max_workers=4)):
+        expected = BrainTumorDetector().process_complete_pipeline(image_file)
+        assert isinstance(result, PipelineResult)
+        assert result.tumor_area_cm2 == expected['tumor_area_cm2']
+        assert result.category == expected['category']
+        assert np.array_equal(result.morphology_tumor, expected['morphology_tumor'])
+        assert np.array_equal(result.watershed, expected['watershed'])
+        assert np.array_equal(result.threshold, expected['threshold'])
+
+def test_pipeline_result_is_immutable():
+    """Results cannot be modified once returned"""
+    result = run_pipeline(sorted(glob.glob('mri_sample_*'))[0])
+    
+    try:
+        result.category = "No Tumor"
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("PipelineResult attribute was reassigned")
+    
+    assert not result.morphology_tumor.flags.writeable
+    assert not hasattr(result, '__dict__')
+
+def test_selected_outputs_skip_unneeded_stages():
+    """Asking for area+category runs only binary, morphology and area stages"""
+    assert resolve_stages("area+category") == ['binary', 'morphology_tumor', 'regions', 'tumor_area']
+    assert resolve_stages(['threshold']) == ['threshold']
+    
+    image_file = sorted(glob.glob('mri_sample_*'))[0]
+    full = BrainTumorDetector().process_complete_pipeline(image_file)
+    
     detector = BrainTumorDetector()
+    partial = detector.process_complete_pipeline(image_file, outputs="area+category")
+    assert set(partial) == {'tumor_area_cm2', 'category'}
+    assert partial['tumor_area_cm2'] == full['tumor_area_cm2']
+    assert detector.watershed_image is None and detector.threshold_image is None
     
-    for i, image_file in enumerate(image_files, 1):
-        print(f"\n{i}. Processing: {image_file}")
+    result = run_pipeline(image_file, outputs="area+category")
+    assert result.tumor_area_cm2 == full['tumor_area_cm2']
+    assert result.watershed is None and result.threshold is None
+    
+    batch = BrainTumorDetector().process_batch([image_file], outputs="area+category")
+    assert batch['tumor_area_cm2'][0] == full['tumor_area_cm2']
+
+def test_component_analysis_matches_per_label_loop():
+    """Lookup-table filtering and vectorized stats match the old per-label loop"""
+    rng = np.random.default_rng(0)
+    noisy = (rng.random((200, 200)) > 0.7).astype(np.uint8) * 255
+    
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(noisy, connectivity=8)
+    expected = np.zeros_like(noisy)
+    for i in range(1, num_labels):
+        if stats[i, cv2.CC_STAT_AREA] >= 5:
+            expected[labels == i] = 255
+    
+    assert np.array_equal(remove_small_objects(noisy, min_area=5), expected)
+    
+    regions = analyze_components(noisy, min_area=5, pixel_w=0.5, pixel_h=0.5)
+    big = stats[1:, cv2.CC_STAT_AREA] >= 5
+    assert len(regions) == big.sum()
+    assert regions.total_area_px == np.count_nonzero(expected)
+    assert np.allclose(regions.areas_cm2, stats[1:, cv2.CC_STAT_AREA][big] * 0.25)
+    assert np.allclose(regions.centroids, centroids[1:][big])
+    assert np.array_equal(regions.bboxes, stats[1:, :4][big])
+
+def test_result_cache_hits_and_evicts(tmp_path):
+    """Repeated runs are served from the cache; old entries are evicted past the size limit"""
+    image_files = sorted(glob.glob('mri_sample_*'))
+    cache = ResultCache(str(tmp_path / "cache"))
+    
+    detector = BrainTumorDetector(cache=cache)
+    first = detector.process_complete_pipeline(image_files[0])
+    second = detector.process_complete_pipeline(image_files[0])
+    assert cache.hits == 1
+    assert second['tumor_area_cm2'] == first['tumor_area_cm2']
+    assert second['category'] == first['category']
+    assert np.array_equal(second['morphology_tumor'], first['morphology_tumor'])
+    assert np.array_equal(second['regions'].centroids, first['regions'].centroids)
+    assert np.array_equal(detector.morphology_tumor, first['morphology_tumor'])
+    
+    # A different parameter is a different entry
+    run_pipeline(image_files[0], threshold=0.5, cache=cache)
+    assert cache.hits == 1 and len(cache) == 2
+    
+    cache.max_bytes = cache.size_bytes()
+    for image_file in image_files[1:3]:
+        run_pipeline(image_file, cache=cache)
+    assert cache.size_bytes() <= cache.max_bytes
+    assert detector.process_complete_pipeline(image_files[2])['category'] == \
+        run_pipeline(image_files[2]).category
+    assert cache.hits == 2
+
+def test_archive_round_trips_results_lazily(tmp_path):
+    """Archived results decode to the original arrays; masks stay memory-mapped until read"""
+    image_files = sorted(glob.glob('mri_sample_*'))[:4]
+    detector = BrainTumorDetector()
+    expected = [detector.process_complete_pipeline(f) for f in image_files]
+    
+    with ArchiveWriter(str(tmp_path / "run"), pipeline_params()) as writer:
+        for image_file, results in zip(image_files, expected):
+            writer.add(results, image_file)
+        writer.add(run_pipeline(image_files[0], threshold=0.5, outputs="area+category"),
+                   "partial", params={'threshold': 0.5})
+    
+    archive = ResultArchive(str(tmp_path / "run"))
+    assert isinstance(archive._masks, np.memmap)
+    assert len(archive) == len(image_files) + 1
+    for results, archived in zip(expected, archive):
+        for key in ('original', 'binary', 'watershed', 'morphology_tumor', 'threshold'):
+            assert np.array_equal(archived[key], results[key]), key
+        assert archived['tumor_area_cm2'] == results['tumor_area_cm2']
+        assert archived['category'] == results['category']
+        assert np.array_equal(archived['regions'].centroids, results['regions'].centroids)
+        assert np.array_equal(archived['regions'].mask, results['regions'].mask)
+    
+    # Skipped stages come back as None; parameters are queryable columns
+    assert archive[-1]['watershed'] is None and archive[-1]['threshold'] is None
+    assert list(archive.select(threshold=0.5)) == [len(image_files)]
+    assert archive.column('param.kernel')[0] == pipeline_params()['kernel']
+    assert list(archive.select(category=expected[0]['category'], threshold=0.6)) == \
+        [i for i, r in enumerate(expected) if r['category'] == expected[0]['category']]
+    
+    # Masks are bit-packed, sparse images run-length encoded, noise kept raw
+    raw_bytes = sum(r[key].nbytes for r in expected
+                    for key in ('binary', 'watershed', 'morphology_tumor', 'threshold'))
+    assert os.path.getsize(tmp_path / "run" / "masks.bin") < raw_bytes / 4 + 4 * 200 * 200
+    sparse = np.zeros((64, 64), np.uint8)
+    sparse[10:20, 10:20] = 255
+    noise = np.random.default_rng(0).integers(0, 256, (64, 64), dtype=np.uint8)
+    speckle = np.where(noise > 127, 254, 127).astype(np.uint8)
+    for image, encoding in ((speckle, ENCODING_BITS), (sparse, ENCODING_RLE), (noise, ENCODING_RAW)):
+        stored = encode_image(image)
+        assert stored[0] == encoding
+        assert np.array_equal(decode_image(*stored, image.shape), image)
+    
+    # The regions mask equals the tumor mask and is stored once; bad files are skipped
+    bad_file = tmp_path / "broken.png"
+    bad_file.write_bytes(b"not an image")
+    count, _, errors = archive_images(image_files[:2] + [str(bad_file)], str(tmp_path / "batch"),
+                                      workers=2)
+    assert count == 2 and [path for path, _ in errors] == [str(bad_file)]
+    with ResultArchive(str(tmp_path / "batch")) as archive:
+        assert list(archive.column('path')) == image_files[:2]
+        assert np.array_equal(archive.column('regions.mask.offset'),
+                              archive.column('morphology_tumor.offset'))
+        lazy = archive[0]
+    
+    assert len(archive.column('path')) == 2
+    try:
+        lazy['binary']
+    except ValueError as e:
+        assert str(e) == "archive is closed"
+    else:
+        raise AssertionError("Reading an image from a closed archive should fail")
+
+def test_benchmark_flags_regressions(tmp_path):
+    """A stage slower than the baseline beyond tolerance is reported"""
+    phantom_path = str(tmp_path / "phantom.png")
+    cv2.imwrite(phantom_path, make_phantom(256))
+    case = bench_case(phantom_path, repeat=2, warmup=0)
+    assert set(STAGES) <= set(case) and case['total']['p50_ms'] > 0
+    
+    # Peak RSS is measured per case, so a small case after a large one is not inflated
+    large_path = str(tmp_path / "large.png")
+    cv2.imwrite(large_path, make_phantom(2048))
+    large_rss = case_peak_rss_mb(large_path, full_resolution=True)
+    assert case_peak_rss_mb(phantom_path) < large_rss
+    
+    baseline = {'cases': {'phantom': case}}
+    assert compare({'cases': {'phantom': case}}, baseline) == []
+    
+    slower = {stage: dict(stats) for stage, stats in case.items() if stage in STAGES + ['total']}
+    slower['watershed_segmentation']['p50_ms'] = case['watershed_segmentation']['p50_ms'] * 2 + 1
+    regressions = compare({'cases': {'phantom': slower}}, baseline, tolerance=0.25)
+    assert [(c, s) for c, s, _, _ in regressions] == [('phantom', 'watershed_segmentation')]
+
+def test_view_switch_blits_cached_panels():
+    """GUI views reuse the same artists and blit pixels identical to a full redraw"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    
+    results = BrainTumorDetector().process_complete_pipeline(sorted(glob.glob('mri_sample_*'))[0])
+    fig = Figure(figsize=(8, 4), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    renderer = ViewRenderer(fig, fig.subplots(1, 2), canvas)
+    images = list(renderer.images)
+    
+    renderer.set_results(results)
+    for view in [1, 0, 1]:
+        renderer.show(view)
+    assert renderer.images == images and set(renderer.rendered) == {0, 1}
+    assert renderer.titles[1].get_text() == 'Tumor Detection\n(White = Tumor)'
+    
+    blitted = np.asarray(canvas.buffer_rgba()).copy()
+    canvas.draw()
+    assert np.array_equal(blitted, np.asarray(canvas.buffer_rgba()))
+    assert len(renderer.redraw_ms) == 4
+    
+    baseline = {'cases': {}, 'redraw': {'switch': {'p50_ms': 1.0}}}
+    slower = {'cases': {}, 'redraw': {'switch': {'p50_ms': 5.0}}}
+    assert compare(slower, baseline) == [('gui_redraw', 'switch', 1.0, 5.0)]
+
+def test_workspace_reuses_buffers_without_changing_results():
+    """A Workspace gives identical outputs while reusing its buffers image after image"""
+    levels = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    for threshold in [-0.1, 0.0, 0.3, 0.6, 153 / 255, 0.75, 1.0]:
+        expected = ((levels.astype(np.float32) / 255.0) > threshold).astype(np.uint8) * 255
+        assert np.array_equal(binarize(levels, threshold), expected)
+    
+    workspace = Workspace()
+    detector = BrainTumorDetector(workspace=workspace)
+    buffers = None
+    for image_file in sorted(glob.glob('mri_sample_*')):
+        expected = BrainTumorDetector().process_complete_pipeline(image_file)
+        results = detector.process_complete_pipeline(image_file)
+        for key in ['original', 'binary', 'watershed', 'morphology_tumor', 'threshold']:
+            assert np.array_equal(results[key], expected[key]), key
+        assert results['tumor_area_cm2'] == expected['tumor_area_cm2']
         
+        arrays = [results[key] for key in ['binary', 'watershed', 'morphology_tumor', 'threshold']]
+        if buffers is not None:
+            assert all(a is b for a, b in zip(arrays, buffers))
+        buffers = arrays
+    
+    # Steady state: the thresholding, morphology and component stages allocate nothing
+    # image-sized (only contour lists, label statistics and lookup tables remain)
+    allocations = bench_allocations(sorted(glob.glob('mri_sample_*'))[0])
+    assert allocations['workspace']['create_binary_image'] < 1024
+    for stage in ['morphological_processing', 'threshold_segmentation', 'calculate_tumor_area']:
+        assert allocations['workspace'][stage] < 8192, stage
+    for stage in ['create_binary_image', 'morphological_processing', 'threshold_segmentation',
+                  'calculate_tumor_area']:
+        assert allocations['default'][stage] > 200 * 200, stage
+    
+    # More labels than cv2.LUT can index fall back to a row-blocked lookup
+    speckle = (np.random.default_rng(0).random((120, 90)) < 0.3).astype(np.uint8) * 255
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(speckle, connectivity=4)
+    assert num_labels > 256
+    keep = stats[:, cv2.CC_STAT_AREA] >= 3
+    keep[0] = False
+    assert np.array_equal(filter_by_area(labels, stats, 3)[0], np.where(keep[labels], 255, 0))
+
+def test_watershed_backends_agree():
+    """Every watershed backend reproduces skimage on the samples and nearly so on grayscale"""
+    for image_file in sorted(glob.glob('mri_sample_*')):
+        expected = BrainTumorDetector().process_complete_pipeline(image_file, outputs="watershed")
+        for backend in WATERSHED_BACKENDS:
+            detector = BrainTumorDetector(watershed_backend=backend)
+            results = detector.process_complete_pipeline(image_file, outputs="watershed")
+            assert np.array_equal(results['watershed'], expected['watershed']), backend
+    
+    # A grayscale gradient leaves pixels unlabeled, so the backends really flood
+    phantom = make_phantom(200)
+    reference = _watershed_labels(phantom, backend='skimage')
+    assert np.count_nonzero(_watershed_labels(phantom, backend='flood') == 0) == 0
+    for backend in WATERSHED_BACKENDS:
+        assert np.mean(_watershed_labels(phantom, backend=backend) == reference) > 0.99, backend
+    
+    assert run_pipeline(phantom, outputs="watershed", watershed_backend='opencv').watershed.max() == 254
+    assert pipeline_params(watershed_backend='flood') != pipeline_params()
+    try:
+        _watershed_labels(phantom, backend='bogus')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Unknown watershed backend was accepted")
+
+def test_sweep_matches_pipeline_at_every_grid_point(tmp_path):
+    """One sweep pass gives the same areas as running each parameter setting separately"""
+    image_files = sorted(glob.glob('mri_sample_*'))[:3]
+    thresholds, kernel_sizes, min_areas = (0.5, 0.6, 0.6001, 0.7), (11, 5, 15), (0, 50, 200)
+    
+    # Ground truth for the first image: the default pipeline's own mask
+    truth = run_pipeline(image_files[0], outputs="tumor").morphology_tumor
+    cv2.imwrite(str(tmp_path / (os.path.splitext(os.path.basename(image_files[0]))[0] + '.png')), truth)
+    masks = find_masks(image_files, str(tmp_path))
+    assert list(masks) == image_files[:1]
+    
+    report = sweep_dataset(image_files, thresholds, kernel_sizes, min_areas, masks=masks, workers=2)
+    assert report['tumor_area_cm2'].shape == (3, 4, 3) and report['tumor_dice'].shape == (1, 4, 3)
+    
+    for n, image_file in enumerate(image_files):
+        gray = load_gray_image(image_file)
+        for t, threshold in enumerate(thresholds):
+            binary = binarize(gray, threshold)
+            for k, size in enumerate(kernel_sizes):
+                mask = morphology_tumor_mask(binary, kernel=disk_kernel(size))
+                assert report['tumor_area_cm2'][n, t, k] == np.count_nonzero(mask) * 0.0508 * 0.0508
+        for a, min_area in enumerate(min_areas):
+            otsu = run_pipeline(gray, min_area=min_area, outputs="threshold").threshold
+            assert report['otsu_area_cm2'][n, a] == np.count_nonzero(otsu) * 0.0508 * 0.0508
+        assert report['tumor_area_cm2'][n, 1, 0] == run_pipeline(image_file).tumor_area_cm2
+    
+    assert report['tumor_dice'][0, 1, 0] == report['tumor_iou'][0, 1, 0] == 1.0
+    assert best_parameters(report)[2] == 1.0
+    
+    records = list(iter_sweep_records(report))
+    assert len(records) == 3 * (4 * 3 + 3)
+    assert sum(record['dice'] is not None for record in records) == 4 * 3 + 3
+    plot_curves(report, str(tmp_path / 'curves.png'))
+    assert os.path.getsize(tmp_path / 'curves.png') > 0
+
+def test_core_imports_stay_headless():
+    """The core loads no plotting, GUI or scikit-image modules and imports about as fast as cv2"""
+    imports = bench_imports(repeat=3, targets={'cv2+numpy': 'import cv2, numpy',
+                                               'brain_tumor_core': 'import brain_tumor_core'})
+    assert imports['brain_tumor_core']['heavy_modules'] == []
+    budget_ms = imports['cv2+numpy']['min_ms'] * 1.5 + 100
+    assert check_import_budget(imports, budget_ms) == []
+    
+    # The watershed stage still works once scikit-image is loaded on demand
+    results = run_pipeline(make_phantom(128), outputs="watershed")
+    assert results.watershed.max() > 0
+
+def test_instrumentation_records_stages_and_counters():
+    """Attached instrumentation times every stage, counts labels and feeds callbacks"""
+    events = []
+    detector = BrainTumorDetector(instrumentation=Instrumentation(callbacks=[events.append]))
+    results = detector.process_complete_pipeline(sorted(glob.glob('mri_sample_*'))[0])
+    
+    timings = results['instrumentation']['timings']
+    assert set(timings) == {'load_image', 'create_binary_image', 'watershed_segmentation',
+                            'morphological_processing', 'threshold_segmentation',
+                            'calculate_tumor_area'}
+    assert all(t['wall_ms'] >= 0 and t['cpu_ms'] >= 0 for t in timings.values())
+    
+    counters = results['instrumentation']['counters']
+    assert counters['labels_found'] >= counters['components_filtered']
+    assert counters['tumor_regions'] == len(results['regions'])
+    assert {e['type'] for e in events} == {'stage', 'counter'}
+    
+    # Without instrumentation nothing is added
+    assert 'instrumentation' not in BrainTumorDetector().process_complete_pipeline(
+        sorted(glob.glob('mri_sample_*'))[0])
+
+def test_tiled_native_matches_full_image():
+    """Tiles joined across their edges reproduce the full native-resolution mask exactly"""
+    phantom = make_phantom(900)
+    phantom[:, :300] = np.random.default_rng(1).integers(0, 256, (900, 300), dtype=np.uint8)
+    
+    full = morphology_tumor_mask(binarize(phantom))
+    for tile_size in (128, 200, 1024):
+        mask, tumor_pixels = tumor_mask_tiled(phantom, tile_size=tile_size)
+        assert np.array_equal(mask, full), tile_size
+        assert tumor_pixels == np.count_nonzero(full)
+    
+    # Components and holes spanning many small tiles are kept or filled whole
+    for image_file in sorted(glob.glob('mri_sample_*')):
+        gray = load_gray_image(image_file, native=True)
+        mask, _ = tumor_mask_tiled(gray, tile_size=37)
+        assert np.array_equal(mask, morphology_tumor_mask(binarize(gray))), image_file
+        assert run_tiled(gray, tile_size=37).tumor_area_cm2 == \
+            run_pipeline(image_file, native=True, outputs="area").tumor_area_cm2
+    
+    tiled = run_tiled(phantom, tile_size=200)
+    assert tiled.morphology_tumor is None
+    
+    # Native pixels cover the same field of view as the 200x200 grid
+    assert np.isclose(tiled.tumor_area_cm2, tumor_pixels * (0.0508 * 200 / 900) ** 2)
+    
+    # Spacing describes native pixels; on the 200x200 grid it must be converted, not dropped
+    try:
+        run_pipeline(phantom, pixel_spacing=(0.01, 0.01))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("pixel_spacing without native was ignored")
+    native = run_pipeline(phantom, native=True, pixel_spacing=(0.01, 0.01), outputs="area")
+    pixel_w, pixel_h = resized_pixel_size(phantom.shape, (0.01, 0.01))
+    resized = run_pipeline(cv2.resize(phantom, IMAGE_SIZE), pixel_w=pixel_w, pixel_h=pixel_h,
+                           outputs="area")
+    assert np.isclose(resized.tumor_area_cm2, native.tumor_area_cm2, rtol=0.05)
+
+def test_reconstruction_matches_iterative_reference():
+    """Component-based reconstruction equals iterated geodesic dilation/erosion"""
+    rng = np.random.default_rng(3)
+    images = [binarize(load_gray_image(f)) for f in sorted(glob.glob('mri_sample_*'))]
+    images.append(cv2.threshold(cv2.GaussianBlur(rng.integers(0, 256, (150, 170), dtype=np.uint8),
+                                                 (7, 7), 0), 127, 255, cv2.THRESH_BINARY)[1])
+    
+    for binary in images:
+        opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, MORPH_KERNEL)
+        for connectivity in (4, 8):
+            expected = reconstruct_iterative(opened, binary, connectivity=connectivity)
+            assert np.array_equal(reconstruct_by_dilation(opened, binary, connectivity), expected)
+        
+        reconstructed = reconstruct_by_dilation(opened, binary)
+        dilated = cv2.dilate(reconstructed, MORPH_KERNEL)
+        expected = reconstruct_iterative(dilated, reconstructed, method='erosion')
+        assert np.array_equal(reconstruct_by_erosion(dilated, reconstructed), expected)
+        
+        # The MATLAB formulation via complements gives the same tumor mask
+        complement = reconstruct_iterative(cv2.bitwise_not(dilated), cv2.bitwise_not(reconstructed))
+        assert np.array_equal(morphology_tumor_mask(binary), cv2.bitwise_not(complement))
+        assert np.array_equal(morphology_tumor_mask(binary, Workspace()), cv2.bitwise_not(complement))
+    
+    # Cached results of the other method must not be served
+    assert pipeline_params(morphology='approximate') != pipeline_params()
+
+def test_volume_streams_npy_and_tiff(tmp_path):
+    """Volume is the sum of per-slice areas times thickness for .npy and multi-page TIFF"""
+    import tifffile
+    
+    volume = np.stack([make_phantom(200, seed=i) for i in range(4)])
+    volume[0] = 0  # One empty slice
+    np.save(tmp_path / "series.npy", volume)
+    tifffile.imwrite(tmp_path / "series.tiff", volume, photometric="minisblack")
+    
+    expected = [run_pipeline(s, outputs="area").tumor_area_cm2 for s in volume]
+    
+    for name in ["series.npy", "series.tiff"]:
+        summary = analyze_volume(str(tmp_path / name), slice_thickness_cm=0.5)
+        assert summary['num_slices'] == 4
+        assert summary['tumor_slices'] == 3
+        assert np.allclose(summary['slice_areas_cm2'], expected)
+        assert np.isclose(summary['volume_cm3'], sum(expected) * 0.5)
+    
+    # Spacing applies to the 200x200 path too: 0.1 cm pixels are ~2x the default 0.0508
+    spaced = analyze_volume(str(tmp_path / "series.npy"), slice_thickness_cm=0.5,
+                            pixel_spacing=(0.1, 0.1))
+    assert np.isclose(spaced['volume_cm3'], sum(expected) * 0.5 * (0.1 / 0.0508) ** 2)
+
+def _drain_job(worker, job_id, timeout=30):
+    """Events of one worker job, up to and including its 'done' event"""
+    events = []
+    while True:
+        event = worker.events.get(timeout=timeout)
+        if event[1] == job_id:
+            events.append(event)
+            if event[0] == 'done':
+                return events
+
+def test_worker_streams_results_and_cancels(tmp_path):
+    """The GUI worker reports progress, results in order, errors, and stops on cancel"""
+    image_files = sorted(glob.glob('mri_sample_*'))
+    bad_file = tmp_path / "broken.png"
+    bad_file.write_bytes(b"not an image")
+    worker = PipelineWorker()
+    
+    try:
+        events = _drain_job(worker, worker.submit(image_files + [str(bad_file)]))
+        results = [e for e in events if e[0] == 'result']
+        assert [e[4] for e in results] == image_files
+        assert [e[0] for e in events if e[0] == 'error'] == ['error']
+        progress = [e[2] for e in events if e[0] == 'progress']
+        assert progress == sorted(progress) and progress[-1] <= 1.0
+        assert events[-1] == ('done', events[-1][1], False)
+        assert not worker.busy
+        
+        # Cancel from a stage callback so the job is mid-pipeline when it stops
+        worker.detector.instrumentation.add_callback(lambda event: worker.cancel())
+        job_id = worker.submit(image_files * 5)
+        events = _drain_job(worker, job_id)
+        assert events[-1][0] == 'done' and events[-1][2] is True
+        assert len([e for e in events if e[0] == 'result']) < len(image_files) * 5
+    finally:
+        worker.stop()
+
+def test_incremental_pipeline_reruns_only_affected_stages():
+    """Slider changes rerun only downstream stages and match a full run"""
+    image_path = sorted(glob.glob('mri_sample_*'))[0]
+    detector = BrainTumorDetector()
+    detector.process_complete_pipeline(image_path)
+    
+    results = detector.process_incremental(image_path)
+    assert detector.recomputed == []
+    
+    results = detector.process_incremental(image_path, threshold=0.5)
+    assert 'load_image' not in detector.recomputed
+    assert 'threshold_segmentation' not in detector.recomputed
+    expected = run_pipeline(image_path, threshold=0.5)
+    assert np.array_equal(results['binary'], expected.binary)
+    assert results['tumor_area_cm2'] == expected.tumor_area_cm2
+    
+    # Same gray-level cutoff, nothing to do
+    detector.process_incremental(image_path, threshold=0.501)
+    assert detector.recomputed == []
+    
+    results = detector.process_incremental(image_path, threshold=0.5, min_area=400)
+    assert detector.recomputed == ['threshold_segmentation']
+    assert np.array_equal(results['threshold'],
+                          run_pipeline(image_path, threshold=0.5, min_area=400).threshold)
+    
+    results = detector.process_incremental(image_path, threshold=0.5, kernel_size=7, min_area=400)
+    assert detector.recomputed == ['morphological_processing', 'calculate_tumor_area']
+    assert np.array_equal(results['morphology_tumor'],
+                          morphology_tumor_mask(expected.binary.copy(), kernel=disk_kernel(7)))
+    
+    # The worker uses the incremental path for jobs submitted with params
+    worker = PipelineWorker(detector)
+    try:
+        events = _drain_job(worker, worker.submit([image_path], {'threshold': 0.5, 'kernel_size': 7,
+                                                                  'min_area': 50}))
+        assert [e[0] for e in events if e[0] in ('result', 'error')] == ['result']
+        assert detector.recomputed == ['threshold_segmentation']
+    finally:
+        worker.stop()
+    
+    try:
+        disk_kernel(8)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Even kernel sizes should be rejected")
+
+def test_hot_folder_processes_each_file_once(tmp_path):
+    """New files are processed once, across restarts; known content is not re-run"""
+    import shutil
+    image_files = sorted(glob.glob('mri_sample_*'))[:2]
+    incoming = tmp_path / "incoming"
+    incoming.mkdir()
+    for image_file in image_files:
+        shutil.copy(image_file, incoming)
+    (incoming / "notes.txt").write_text("ignored")
+    manifest = str(tmp_path / "manifest.sqlite")
+    
+    with HotFolder(str(incoming), manifest, workers=2, settle=0) as folder:
+        records = sorted(folder.poll(), key=lambda r: r['path'])
+        assert [os.path.basename(r['path']) for r in records] == [os.path.basename(f) for f in image_files]
+        for record, image_file in zip(records, image_files):
+            assert record['error'] is None
+            assert record['tumor_area_cm2'] == run_pipeline(image_file).tumor_area_cm2
+        assert folder.poll() == []
+        
+        # A file still being written is left for a later poll
+        folder.settle = 60
+        (incoming / "partial.png").write_bytes(b"not yet")
+        assert folder.poll() == []
+    
+    # After a restart only the new files are picked up; a copy reuses the stored result
+    with HotFolder(str(incoming), manifest, workers=2, settle=0) as folder:
+        assert len(folder.manifest) == 2
+        shutil.copy(image_files[0], incoming / "copy.jpg")
+        folder._detector = None  # Must not be needed for known content
+        records = {os.path.basename(r['path']): r for r in folder.poll()}
+        assert set(records) == {'copy.jpg', 'partial.png'}
+        assert records['copy.jpg']['tumor_area_cm2'] == run_pipeline(image_files[0]).tumor_area_cm2
+        assert records['partial.png']['error'] is not None
+        assert folder.poll() == []  # Not due for a retry yet
+    
+    # A failure is retried up to max_attempts; a fixed file is picked up again
+    with HotFolder(str(incoming), manifest, workers=2, settle=0, retry_delay=0) as folder:
+        assert [r['error'] is not None for r in folder.poll()] == [True]
+        assert [r['error'] is not None for r in folder.poll()] == [True]
+        assert folder.poll() == []  # Third attempt failed, given up
+        shutil.copy(image_files[1], incoming / "partial.png")
+        assert [r['error'] for r in folder.poll()] == [None]
+    
+    # Results from other pipeline parameters are neither current nor reused
+    with HotFolder(str(incoming), manifest, workers=2, settle=0, decode='fast') as folder:
+        assert len(folder.manifest) == 0
+        assert len(folder.poll()) == 4
+        assert len(folder.manifest) == 4
+
+def test_video_frames_stream_in_order(tmp_path):
+    """Pipelined video analysis matches serial per-frame results, in frame order"""
+    video_path = str(tmp_path / "cine.avi")
+    video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (256, 256))
+    for i in range(12):
+        video.write(cv2.cvtColor(make_phantom(256, seed=i), cv2.COLOR_GRAY2BGR))
+    video.release()
+    
+    expected = [run_pipeline(cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (200, 200)),
+                             outputs="area").tumor_area_cm2
+                for _, _, frame in iter_video_frames(video_path)]
+    
+    output = tmp_path / "frames.jsonl"
+    with ResultWriter(str(output), fields=['frame', 'time_s', 'tumor_area_cm2', 'category']) as writer:
+        summary = analyze_video(video_path, writer=writer, workers=3, queue_size=2)
+    
+    assert summary['num_frames'] == 12
+    assert np.allclose(summary['frame_areas_cm2'], expected)
+    assert np.allclose(summary['frame_times_s'], np.arange(12) / 10)
+    rows = output.read_text().splitlines()
+    assert len(rows) == 12 and '"frame": 11' in rows[-1]
+    
+    # Spacing of the 256x256 frames is converted for the 200x200 grid, not dropped
+    spaced = analyze_video(video_path, workers=2, pixel_spacing=(0.1, 0.1))
+    assert np.allclose(spaced['frame_areas_cm2'],
+                       np.asarray(expected) * (0.1 * 256 / 200 / 0.0508) ** 2)
+    
+    # Stopping early shuts the decoder down instead of hanging on its full queue
+    frames = iter_frame_results(video_path, workers=2, queue_size=1)
+    assert next(frames)[0] == 0
+    frames.close()
+
+def test_service_batches_requests_and_sheds_load():
+    """Concurrent uploads are micro-batched; a full queue answers 503 with a retry hint"""
+    import asyncio
+    import threading
+    
+    image_files = sorted(glob.glob('mri_sample_*'))
+    images = [open(f, 'rb').read() for f in image_files] + [b"not an image"]
+    expected = [run_pipeline(f, outputs="area").tumor_area_cm2 for f in image_files]
+    
+    async def batched():
+        service = DetectionService(port=0, max_batch=8, max_wait_ms=20, workers=1)
+        await service.start()
         try:
-            results = detector.process_complete_pipeline(image_file)
-            
-            print(f"   Tumor Area: {results['tumor_area_cm2']:.4f} cm²")
-            print(f"   Classification: {results['category']}")
-            
-            # Save result visualization
-            fig, axes = plt.subplots(2, 3, figsize=(12, 8))
-            fig.suptitle(f'Results for {image_file}', fontsize=14)
-            
-            # Display all processing steps
-            axes[0, 0].imshow(results['original'], cmap='gray')
-            axes[0, 0].set_title('Original')
-            axes[0, 0].axis('off')
-            
-            axes[0, 1].imshow(results['binary'], cmap='gray')
-            axes[0, 1].set_title('Binary')
-            axes[0, 1].axis('off')
-            
-            axes[0, 2].imshow(results['watershed'], cmap='viridis')
-            axes[0, 2].set_title('Watershed')
-            axes[0, 2].axis('off')
-            
-            axes[1, 0].imshow(results['morphology_tumor'], cmap='gray')
-            axes[1, 0].set_title('Tumor (White)')
-            axes[1, 0].axis('off')
-            
-            axes[1, 1].imshow(results['threshold'], cmap='gray')
-            axes[1, 1].set_title('Threshold')
-            axes[1, 1].axis('off')
-            
-            # Results text
-            axes[1, 2].text(0.1, 0.7, f'Area: {results["tumor_area_cm2"]:.4f} cm²', fontsize=12)
-            axes[1, 2].text(0.1, 0.5, f'Type: {results["category"]}', fontsize=12)
-            axes[1, 2].axis('off')
-            
-            plt.tight_layout()
-            
-            # Save the result
-            output_name = f"result_{os.path.splitext(image_file)[0]}.png"
-            plt.savefig(output_name, dpi=150, bbox_inches='tight')
-            plt.close()
-            
-            print(f"   Result saved as: {output_name}")
-            
-        except Exception as e:
-            print(f"   Error processing {image_file}: {e}")
+            report = await run_load(images, port=service.port, requests=3 * len(images),
+                                    concurrency=len(images), mask=True)
+            return report, service.batcher.stats()
+        finally:
+            await service.close()
     
-    print("\n" + "="*50)
-    print("Testing completed!")
+    async def overloaded():
+        service = DetectionService(port=0, max_batch=1, max_queue=2, workers=1)
+        await service.start()
+        try:
+            # Hold the only executor slot: one request runs, two wait, the rest are shed
+            release = threading.Event()
+            service.batcher.process = lambda *args: release.wait() and analyze_batch(*args)
+            load = asyncio.create_task(run_load(images[:1], port=service.port, requests=6,
+                                                concurrency=6))
+            await asyncio.sleep(0.5)
+            release.set()
+            return await load
+        finally:
+            await service.close()
+    
+    report, stats = asyncio.run(batched())
+    overload = asyncio.run(overloaded())
+    
+    for index, status, payload in report['responses']:
+        if index % len(images) == len(image_files):
+            assert status == 400 and 'error' in payload
+        else:
+            assert status == 200
+            assert np.isclose(payload['tumor_area_cm2'], expected[index % len(images)])
+            mask = cv2.imdecode(np.frombuffer(base64.b64decode(payload['mask_png']), np.uint8),
+                                cv2.IMREAD_GRAYSCALE)
+            assert mask.shape == (200, 200)
+    assert stats['batches'] < stats['images']
+    
+    # At most one running and two queued; everything else is shed
+    assert overload['ok'] <= 3 and overload['ok'] + overload['rejected'] == 6
+    assert all('retry after' in payload['error'] for _, status, payload in overload['responses']
+               if status == 503)
+    
+    # An image that fails in the pipeline gets its own error; the rest of its batch still succeeds
+    import brain_tumor_service
+    
+    class FailOnBlank(BrainTumorDetector):
+        def process_batch(self, images, outputs=None):
+            if not images.any(axis=(1, 2)).all():
+                raise RuntimeError("blank image")
+            return super().process_batch(images, outputs)
+    
+    blank = cv2.imencode('.png', np.zeros((50, 50), np.uint8))[1].tobytes()
+    detector, brain_tumor_service._detector = brain_tumor_service._detector, FailOnBlank()
+    try:
+        records = analyze_batch([images[0], blank, images[1]], [False, True, True])
+    finally:
+        brain_tumor_service._detector = detector
+    assert records[1] == {'error': "RuntimeError: blank image"}
+    assert np.isclose(records[0]['tumor_area_cm2'], expected[0]) and 'mask_png' not in records[0]
+    assert np.isclose(records[2]['tumor_area_cm2'], expected[1]) and 'mask_png' in records[2]
 
 if __name__ == "__main__":
-    test_all_images()
\ No newline at end of file
+    run_all_images()
\ No newline at end of file